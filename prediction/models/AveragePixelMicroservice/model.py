@@ -1,6 +1,24 @@
-from PIL import Image
-from PIL.ImageStat import Stat
-import time
+import os
+
+import numpy as np
+
+from utility.image_cache import open_image
+
+# Statistics are computed on the image reduced so that its longest side is at most this many pixels. Means change by
+# a fraction of a level, and JPEG images are decoded directly at the reduced size. Set to 0 to use the full image.
+MAX_IMAGE_SIDE = int(os.getenv('AVERAGE_PIXEL_MAX_SIDE', default=256))
+
+# Adds a brightness histogram and percentiles to the result
+HISTOGRAM = os.getenv('AVERAGE_PIXEL_HISTOGRAM', default='0') == '1'
+HISTOGRAM_BINS = 16
+PERCENTILES = (5, 50, 95)
+
+# ITU-R 601 luma weights, the same that PIL uses to convert images to grayscale
+LUMA_WEIGHTS = np.array([0.299, 0.587, 0.114])
+
+CLASSES = ['average_red', 'average_green', 'average_blue', 'brightness']
+if HISTOGRAM:
+    CLASSES += ['brightness_histogram', 'brightness_percentiles']
 
 
 def init():
@@ -8,9 +26,55 @@ def init():
     This method will be run once on startup. You should check if the supporting files your
     model needs have been created, and if not then you should create/fetch them.
     """
+    # The model has no supporting files
+    return True
+
+
+def load_pixels(image_path, max_side=MAX_IMAGE_SIDE):
+    """
+    Loads an image as an array of RGB pixels and the weight of each pixel. Images with transparency are weighted by
+    their alpha channel, so that fully transparent pixels do not count. Grayscale and palette images are converted to
+    RGB.
+
+    :param image_path: Path to image file
+    :param max_side: Maximum length of the longest side, or 0 to keep the full resolution
+    :return: 2-tuple of float array of shape (pixels, 3), array of pixel weights or None if all pixels count the same
+    """
+    # JPEG images are decoded directly at about max_side, unless the decoded image is shared with other models
+    image = open_image(image_path, max_side)
 
-    # Placeholder init code. Replace the sleep with check for model files required etc...
-    time.sleep(1)
+    has_alpha = image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info
+    mode = 'RGBA' if has_alpha else 'RGB'
+    if image.mode != mode:
+        image = image.convert(mode)
+
+    if max_side and max(image.size) > max_side:
+        # Averages blocks of pixels, which keeps the means of the image
+        image = image.reduce(-(-max(image.size) // max_side))
+
+    pixels = np.asarray(image, dtype=np.float32).reshape(-1, len(image.mode))
+    if not has_alpha:
+        return pixels, None
+
+    weights = pixels[:, 3]
+    if not weights.any():
+        return pixels[:, :3], None  # Fully transparent image
+    return pixels[:, :3], weights
+
+
+def brightness_distribution(pixels, weights):
+    """
+    Computes the histogram and percentiles of the brightness of the pixels.
+
+    :return: 2-tuple of list of the fraction of pixels in each of HISTOGRAM_BINS bins, {percentile: brightness}
+    """
+    luma = np.rint(pixels @ LUMA_WEIGHTS).astype(np.intp)
+    counts = np.bincount(luma, weights=weights, minlength=256)
+    distribution = np.cumsum(counts) / counts.sum()
+
+    histogram = (counts.reshape(HISTOGRAM_BINS, -1).sum(axis=1) / counts.sum()).tolist()
+    percentiles = {str(p): int(np.searchsorted(distribution, p / 100)) for p in PERCENTILES}
+    return histogram, percentiles
 
 
 def predict(image_file_name):
@@ -20,23 +84,25 @@ def predict(image_file_name):
     with the image as an input.
     """
 
-    image = Image.open('/app/objects/'+image_file_name)
-    stat = Stat(image)
-    av_r = stat.mean[0]
-    av_g = stat.mean[1]
-    av_b = stat.mean[2]
+    pixels, weights = load_pixels('/app/objects/' + image_file_name)
 
-    image.convert('L')  # Convert to grayscale
-    stat = Stat(image)
-    brightness = stat.mean[0]  # Between 0 -> 255. 0 is DARK and 255 is LIGHT
+    # Per channel means in one pass over the pixels. Brightness is the mean luma, which is the luma of the means.
+    if weights is None:
+        means = pixels.mean(axis=0, dtype=np.float64)
+    else:
+        means = weights @ pixels / weights.sum()
+    brightness = float(means @ LUMA_WEIGHTS)  # Between 0 -> 255. 0 is DARK and 255 is LIGHT
+
+    result = {  # For results, use the class names above with the result value
+        'average_red': float(means[0]),
+        'average_green': float(means[1]),
+        'average_blue': float(means[2]),
+        'brightness': brightness
+    }
+    if HISTOGRAM:
+        result['brightness_histogram'], result['brightness_percentiles'] = brightness_distribution(pixels, weights)
 
-    image.close()
     return {
-        'classes': ['average_red', 'average_green', 'average_blue', 'brightness'],  # List every class in the classifier
-        'result': {  # For results, use the class names above with the result value
-            'average_red': av_r,
-            'average_green': av_g,
-            'average_blue': av_b,
-            'brightness': stat.mean[0]
-        }
+        'classes': CLASSES,  # List every class in the classifier
+        'result': result
     }
@@ -0,0 +1,60 @@
+# Per-image latency benchmark for face detection over a folder of images. Compares the old behaviour of creating a
+# new MTCNN detector and detecting on the full resolution image for every prediction against the detector created
+# once in init() with images reduced to MAX_IMAGE_SIDE before detection.
+#
+# Run inside the worker container, where this folder is mounted as /app/model:
+#   python3 -m model.benchmark /app/objects 20
+import os
+import sys
+import time
+
+from model import model
+from utility.image_cache import load_image_array
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+
+def detect_faces_reload(image_path):
+    # detection as it was done before the detector was kept in memory
+    from mtcnn.mtcnn import MTCNN
+    pixels, _ = load_image_array(image_path, max_side=0)
+    return MTCNN().detect_faces(pixels)
+
+
+def time_per_image(image_paths, detect):
+    face_counts = []
+    start = time.perf_counter()
+    for image_path in image_paths:
+        face_counts.append(len(detect(image_path)))
+    return (time.perf_counter() - start) / len(image_paths), face_counts
+
+
+def main():
+    image_directory = sys.argv[1] if len(sys.argv) > 1 else '/app/objects'
+    limit = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    image_paths = sorted(
+        os.path.join(image_directory, f) for f in os.listdir(image_directory)
+        if f.lower().endswith(IMAGE_EXTENSIONS)
+    )[:limit]
+    if not image_paths:
+        print('No images found in ' + image_directory)
+        return
+
+    model.init()
+    model.detect_faces(image_paths[0])  # Warm up
+
+    before, old_counts = time_per_image(image_paths, detect_faces_reload)
+    full_resolution, _ = time_per_image(image_paths, lambda path: model.detect_faces(path, max_side=0))
+    after, new_counts = time_per_image(image_paths, model.detect_faces)
+
+    print('Images:                                 %d' % len(image_paths))
+    print('New detector, full resolution (old):    %.1f ms' % (before * 1000))
+    print('Shared detector, full resolution:       %.1f ms' % (full_resolution * 1000))
+    print('Shared detector, max side %5d (new):   %.1f ms' % (model.MAX_IMAGE_SIDE, after * 1000))
+    print('Speedup:                                %.1fx' % (before / after))
+    print('Images with a different face count:     %d' % sum(o != n for o, n in zip(old_counts, new_counts)))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,6 @@
-from matplotlib import pyplot
-from matplotlib.patches import Rectangle
-from mtcnn.mtcnn import MTCNN
-from PIL import Image
+import os
+
+from utility.image_cache import load_image_array
 
 
 """
@@ -9,19 +8,81 @@ from PIL import Image
 Facial detection using Multi-Task Cascaded Convolutional Neural Network
 
 Reference:
-https://machinelearningmastery.com/how-to-perform-face-detection-with-classical-and-deep-learning-methods-in-python-with-keras/ 
+https://machinelearningmastery.com/how-to-perform-face-detection-with-classical-and-deep-learning-methods-in-python-with-keras/
 https://arxiv.org/ftp/arxiv/papers/1604/1604.02878.pdf
 
 """
 
+detector = None
+
+# Images are reduced so that their longest side is at most this many pixels before detection. Detection time grows
+# with the number of pixels, and faces remain detectable at this size. Set to 0 to detect on the full image.
+MAX_IMAGE_SIDE = int(os.getenv('FACE_DETECT_MAX_SIDE', default=1024))
+
+
 def init():
     """
     This method will be run once on startup. You should check if the supporting files your
     model needs have been created, and if not then you should create/fetch them.
     """
 
+    global detector
+
+    # mtcnn imports tensorflow, so it is only imported when the model is loaded
+    from mtcnn.mtcnn import MTCNN
+
+    # create the detector, using default weights
+    detector = MTCNN()
     return True
 
+
+def detect_faces(image_path, max_side=MAX_IMAGE_SIDE):
+    """
+    Detects faces in an image. The bounding boxes are returned in the coordinates of the full resolution image,
+    even if detection was done on a reduced image.
+
+    :param image_path: Path to image file
+    :param max_side: Maximum length of the longest side that detection is done on, or 0 for the full resolution
+    :return: List of faces in the format returned by MTCNN.detect_faces
+    """
+    pixels, scale = load_image_array(image_path, max_side)
+
+    # detect faces in the image
+    faces = detector.detect_faces(pixels)
+
+    if scale != 1:
+        for face in faces:
+            face['box'] = [round(value * scale) for value in face['box']]
+            face['keypoints'] = {name: (round(x * scale), round(y * scale)) for name, (x, y) in face['keypoints'].items()}
+
+    return faces
+
+
+def draw_image_with_boxes(image_path, result_list):
+    """
+    Debug helper that saves a copy of the image with the detected faces outlined to src/image.jpg.
+    """
+    from matplotlib import pyplot
+    from matplotlib.patches import Rectangle
+
+    # load the image
+    data = pyplot.imread(image_path)
+    # plot the image
+    pyplot.imshow(data)
+    # get the context for drawing boxes
+    ax = pyplot.gca()
+    # plot each box
+    for result in result_list:
+        # get coordinates
+        x, y, width, height = result['box']
+        # create the shape
+        rect = Rectangle((x, y), width, height, fill=False, color='red')
+        # draw the box
+        ax.add_patch(rect)
+    # show the plot
+    pyplot.savefig('src/image.jpg')
+
+
 def predict(image_file_name):
     """
     Interface method between model and server. This signature must not be
@@ -29,40 +90,14 @@ def predict(image_file_name):
     with the image as an input.
     """
 
-    # image = Image.open('/app/objects/'+image_file_name)
-
-    def draw_image_with_boxes(result_list):
-        # load the image
-        data = pyplot.imread('/app/objects/'+image_file_name)
-        # plot the image
-        pyplot.imshow(data)
-        # get the context for drawing boxes
-        ax = pyplot.gca()
-        # plot each box
-        for result in result_list:
-            # get coordinates
-            x, y, width, height = result['box']
-            # create the shape
-            rect = Rectangle((x, y), width, height, fill=False, color='red')
-            # draw the box
-            ax.add_patch(rect)
-        # show the plot
-        pyplot.savefig('src/image.jpg')
-
-    pixels = pyplot.imread('/app/objects/'+image_file_name)
-
-    # create the detector, using default weights
-    detector = MTCNN()
-    # detect faces in the image
-    faces = detector.detect_faces(pixels)
+    faces = detect_faces('/app/objects/' + image_file_name)
 
     # For debug, un comment this method to generate image showing faces detected
-    # draw_image_with_boxes(faces)
-
+    # draw_image_with_boxes('/app/objects/' + image_file_name, faces)
 
     return {
-        'classes': ['number_faces'],  
-        'result': { 
+        'classes': ['number_faces'],
+        'result': {
             'number_faces': len(faces),
         }
     }
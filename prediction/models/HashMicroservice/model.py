@@ -1,7 +1,24 @@
 import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+
 import imagehash
 from PIL import Image
-import time
+
+from utility.image_cache import open_image
+
+# Number of images hashed at the same time by predict_batch(). Decoding and hashing release the GIL, so threads run in
+# parallel, but every thread holds one decoded image in memory.
+BATCH_THREADS = int(os.getenv('HASH_BATCH_THREADS', default=min(4, os.cpu_count() or 1)))
+
+# The difference and wavelet hashes are computed from a grayscale copy of the image reduced to this size, and the
+# color hash from a color copy reduced so that its longest side is at most COLOR_HASH_SIDE pixels
+SMALL_IMAGE_SIDE = 64
+COLOR_HASH_SIDE = 256
+
+CLASSES = ['md5', 'sha1', 'perceptual', 'difference', 'wavelet', 'color']
+
+executor = None
 
 
 def init():
@@ -9,8 +26,66 @@ def init():
     This method will be run once on startup. You should check if the supporting files your
     model needs have been created, and if not then you should create/fetch them.
     """
+    global executor
+    executor = ThreadPoolExecutor(BATCH_THREADS)
+    return True
+
+
+def hash_pixels(image):
+    """
+    Computes the md5 and sha1 hashes of the decoded pixel data of an image. The pixel data is copied out of the image
+    once and both hashes read it through the same memoryview.
+
+    :return: 2-tuple of md5 hex digest, sha1 hex digest
+    """
+    md5 = hashlib.md5()
+    sha1 = hashlib.sha1()
+    with memoryview(image.tobytes()) as pixel_data:
+        md5.update(pixel_data)
+        sha1.update(pixel_data)
+    return md5.hexdigest(), sha1.hexdigest()
+
+
+def hash_image(image_path):
+    """
+    Computes the cryptographic and perceptual hashes of an image. The raw pixel data is released before the
+    perceptual hashes are computed, which share one grayscale copy of the image and one reduced color copy.
+
+    :param image_path: Path to image file
+    :return: Dictionary of {class name: hash string}
+    """
+    image = open_image(image_path)  # Shared with the other models of the worker, so it is not modified
+    md5, sha1 = hash_pixels(image)
+
+    gray_image = image.convert('L')
+    color_image = image if image.mode == 'RGB' else image.convert('RGB')
+    if max(color_image.size) > COLOR_HASH_SIDE:
+        scale = COLOR_HASH_SIDE / max(color_image.size)
+        color_image = color_image.resize((max(1, round(color_image.size[0] * scale)),
+                                          max(1, round(color_image.size[1] * scale))), Image.BILINEAR)
+    del image
 
-    return True  # Nothing to init
+    # The perceptual hash is computed from the full resolution image, so that it matches hashes of earlier predictions
+    perceptual = imagehash.phash(gray_image)
+    small_gray_image = gray_image.resize((SMALL_IMAGE_SIDE, SMALL_IMAGE_SIDE), Image.LANCZOS)
+    del gray_image
+
+    return {
+        'md5': md5,
+        'sha1': sha1,
+        'perceptual': str(perceptual),
+        'difference': str(imagehash.dhash(small_gray_image)),
+        'wavelet': str(imagehash.whash(small_gray_image, image_scale=SMALL_IMAGE_SIDE)),
+        'color': str(imagehash.colorhash(color_image)),
+    }
+
+
+def predict_batch(image_file_names):
+    """
+    Hashes several images on BATCH_THREADS threads. Receives a list of image file names and returns a list of results
+    in the same order and format as predict().
+    """
+    return list(executor.map(predict, image_file_names))
 
 
 def predict(image_file_name):
@@ -20,17 +95,7 @@ def predict(image_file_name):
     with the image as an input.
     """
 
-    image = Image.open('/app/objects/'+image_file_name)
-
-    md5 = hashlib.md5(image.tobytes()).hexdigest()
-    sha1 = hashlib.sha1(image.tobytes()).hexdigest()
-    perceptual = str(imagehash.phash(image))
-
     return {
-        'classes': ['md5', 'sha1', 'perceptual'],  # List every class in the classifier
-        'result': {  # For results, use the class names above with the result value
-            'md5': md5,
-            'sha1': sha1,
-            'perceptual': perceptual,
-        }
+        'classes': CLASSES,  # List every class in the classifier
+        'result': hash_image('/app/objects/' + image_file_name)  # For results, use the class names above
     }
@@ -0,0 +1,61 @@
+# Per-file latency benchmark for reading image dimensions over a folder of images. Compares opening every image with
+# PIL against probing the header with model.probe, and checks that both report the same dimensions.
+#
+# Run inside the worker container, where this folder is mounted as /app/model:
+#   python3 -m model.benchmark /app/objects 1000
+import os
+import sys
+import time
+
+from PIL import Image
+
+from model.probe import probe_dimensions
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp')
+
+
+def pil_dimensions(image_path):
+    with Image.open(image_path) as image:
+        return image.size
+
+
+def time_per_file(image_paths, read_dimensions):
+    dimensions = []
+    start = time.perf_counter()
+    for image_path in image_paths:
+        dimensions.append(read_dimensions(image_path))
+    return (time.perf_counter() - start) / len(image_paths), dimensions
+
+
+def main():
+    image_directory = sys.argv[1] if len(sys.argv) > 1 else '/app/objects'
+    limit = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+
+    image_paths = sorted(
+        os.path.join(image_directory, f) for f in os.listdir(image_directory)
+        if f.lower().endswith(IMAGE_EXTENSIONS)
+    )[:limit]
+    if not image_paths:
+        print('No images found in ' + image_directory)
+        return
+
+    before, pil_results = time_per_file(image_paths, pil_dimensions)
+    after, probe_results = time_per_file(image_paths, probe_dimensions)
+
+    unsupported = sum(result is None for result in probe_results)
+    different = [
+        os.path.basename(image_path) for image_path, pil_result, probe_result
+        in zip(image_paths, pil_results, probe_results)
+        if probe_result is not None and tuple(probe_result) != tuple(pil_result)
+    ]
+
+    print('Files:                     %d' % len(image_paths))
+    print('PIL Image.open (old):      %.1f us' % (before * 1e6))
+    print('Header probe (new):        %.1f us' % (after * 1e6))
+    print('Speedup:                   %.1fx' % (before / after))
+    print('Unsupported by the probe:  %d' % unsupported)
+    print('Different dimensions:      %d %s' % (len(different), ' '.join(different)))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,6 @@
 from PIL import Image
-import time
+
+from model.probe import probe_dimensions
 
 
 def init():
@@ -8,8 +9,32 @@ def init():
     model needs have been created, and if not then you should create/fetch them.
     """
 
-    # Placeholder init code. Replace the sleep with check for model files required etc...
-    return True
+    return True  # Nothing to init
+
+
+def image_dimensions(image_path):
+    """
+    Reads the dimensions of an image from its header, without decoding it. Formats that probe_dimensions() does not
+    support are opened with PIL, which also only reads the header.
+
+    :param image_path: Path to image file
+    :return: 2-tuple of width, height
+    """
+    dimensions = probe_dimensions(image_path)
+    if dimensions is not None:
+        return dimensions
+
+    with Image.open(image_path) as image:
+        return image.size
+
+
+def predict_batch(image_file_names):
+    """
+    Reads the dimensions of several images in one job. Receives a list of image file names and returns a list of
+    results in the same order and format as predict().
+    """
+    return [predict(image_file_name) for image_file_name in image_file_names]
+
 
 def predict(image_file_name):
     """
@@ -18,11 +43,7 @@ def predict(image_file_name):
     with the image as an input.
     """
 
-    image = Image.open('/app/objects/'+image_file_name)
-
-    width, height = image.size
-
-    image.close()
+    width, height = image_dimensions('/app/objects/' + image_file_name)
 
     return {
         'classes': ['width', 'height'],  # List every class in the classifier
@@ -0,0 +1,171 @@
+# Reads the dimensions of images and videos from their container headers without decoding any pixel data. JPEG, PNG,
+# GIF, WebP and BMP dimensions are found within the first few KB of the file. JPEG segments before the frame header and
+# MP4 boxes are skipped by seeking over them, so only their headers are read.
+import struct
+
+# Number of bytes read from the start of every file. All supported formats except JPEG and MP4 store their dimensions
+# within these bytes.
+HEADER_SIZE = 4096
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+GIF_SIGNATURES = (b'GIF87a', b'GIF89a')
+
+# JPEG start of frame markers, which hold the image dimensions. C4, C8 and CC are other segments in the same range.
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+# JPEG markers without a length, which are not followed by a segment
+JPEG_STANDALONE_MARKERS = {0x01, 0xD0, 0xD1, 0xD2, 0xD3, 0xD4, 0xD5, 0xD6, 0xD7, 0xD8}
+
+# Top level boxes that start MP4 and QuickTime files
+MP4_FIRST_BOXES = {b'ftyp', b'moov', b'mdat', b'free', b'skip', b'wide', b'pnot'}
+
+
+def probe_png(header):
+    if len(header) >= 24 and header[12:16] == b'IHDR':
+        return struct.unpack('>II', header[16:24])
+    return None
+
+
+def probe_gif(header):
+    if len(header) >= 10:
+        return struct.unpack('<HH', header[6:10])
+    return None
+
+
+def probe_bmp(header):
+    if len(header) < 26:
+        return None
+    dib_header_size = struct.unpack('<I', header[14:18])[0]
+    if dib_header_size == 12:  # OS/2 BITMAPCOREHEADER
+        return struct.unpack('<HH', header[18:22])
+    width, height = struct.unpack('<ii', header[18:26])
+    return width, abs(height)  # Height is negative for images stored top down
+
+
+def probe_webp(header):
+    chunk = header[12:16]
+    if chunk == b'VP8 ' and len(header) >= 30:  # Lossy
+        width, height = struct.unpack('<HH', header[26:30])
+        return width & 0x3FFF, height & 0x3FFF
+    if chunk == b'VP8L' and len(header) >= 25:  # Lossless
+        b0, b1, b2, b3 = header[21:25]
+        return (b0 | (b1 & 0x3F) << 8) + 1, (b1 >> 6 | b2 << 2 | (b3 & 0x0F) << 10) + 1
+    if chunk == b'VP8X' and len(header) >= 30:  # Extended
+        return int.from_bytes(header[24:27], 'little') + 1, int.from_bytes(header[27:30], 'little') + 1
+    return None
+
+
+def probe_jpeg(file):
+    """
+    Walks the JPEG segments from the start of the file to the first start of frame segment.
+    """
+    file.seek(2)
+    while True:
+        marker = file.read(2)
+        if len(marker) < 2 or marker[0] != 0xFF:
+            return None
+        while marker[1] == 0xFF:  # Markers may be preceded by any number of fill bytes
+            marker = marker[1:] + file.read(1)
+            if len(marker) < 2:
+                return None
+
+        if marker[1] in JPEG_STANDALONE_MARKERS:
+            continue
+
+        segment_header = file.read(2)
+        if len(segment_header) < 2:
+            return None
+        segment_length = struct.unpack('>H', segment_header)[0]
+
+        if marker[1] in JPEG_SOF_MARKERS:
+            frame_header = file.read(5)
+            if len(frame_header) < 5:
+                return None
+            height, width = struct.unpack('>HH', frame_header[1:5])
+            return width, height
+
+        file.seek(segment_length - 2, 1)
+
+
+def read_mp4_boxes(file, end):
+    """
+    Reads the headers of the MP4 boxes between the current position of the file and end, or the end of the file if
+    end is None. The file is positioned at the content of each box when it is returned.
+
+    :return: Generator of 2-tuples of box type, position of the end of the box
+    """
+    while end is None or file.tell() + 8 <= end:
+        box_start = file.tell()
+        box_header = file.read(8)
+        if len(box_header) < 8:
+            return
+        box_size, box_type = struct.unpack('>I4s', box_header)
+
+        if box_size == 1:  # 64 bit size follows the type
+            large_size = file.read(8)
+            if len(large_size) < 8:
+                return
+            box_size = struct.unpack('>Q', large_size)[0]
+        elif box_size == 0:  # Box extends to the end of the file
+            yield box_type, end
+            return
+
+        if box_size < 8:
+            return
+        box_end = box_start + box_size
+        yield box_type, box_end
+        file.seek(box_end)
+
+
+def probe_mp4(file):
+    """
+    Finds the dimensions of the first video track in the track header boxes of an MP4 or QuickTime file. The moov box
+    may be stored after the media data, which is skipped over.
+    """
+    file.seek(0)
+    for box_type, moov_end in read_mp4_boxes(file, None):
+        if box_type != b'moov':
+            continue
+        for trak_type, trak_end in read_mp4_boxes(file, moov_end):
+            if trak_type != b'trak':
+                continue
+            for tkhd_type, _ in read_mp4_boxes(file, trak_end):
+                if tkhd_type != b'tkhd':
+                    continue
+                track_header = file.read(96)
+                if not track_header:
+                    break
+                # Version 1 track headers have 64 bit times and duration
+                offset = 88 if track_header[0] == 1 else 76
+                if len(track_header) < offset + 8:
+                    break
+                width, height = struct.unpack('>II', track_header[offset:offset + 8])
+                if width and height:  # Audio tracks have no dimensions
+                    return width >> 16, height >> 16  # 16.16 fixed point
+                break
+        return None
+    return None
+
+
+def probe_dimensions(path):
+    """
+    Reads the dimensions of an image or video from its header.
+
+    :param path: Path to image or video file
+    :return: 2-tuple of width, height, or None if the format is not supported or the header is invalid
+    """
+    with open(path, 'rb') as file:
+        header = file.read(HEADER_SIZE)
+
+        if header.startswith(PNG_SIGNATURE):
+            return probe_png(header)
+        if header[:6] in GIF_SIGNATURES:
+            return probe_gif(header)
+        if header.startswith(b'BM'):
+            return probe_bmp(header)
+        if header.startswith(b'RIFF') and header[8:12] == b'WEBP':
+            return probe_webp(header)
+        if header.startswith(b'\xFF\xD8'):
+            return probe_jpeg(file)
+        if header[4:8] in MP4_FIRST_BOXES:
+            return probe_mp4(file)
+    return None
@@ -1,15 +1,114 @@
+import os
+
 from transformers import pipeline
 
+nlp = None
+
+CLASSES = ['I-PER', 'I-LOC', 'I-ORG', 'I-MISC']
+
+# Number of text windows the pipeline runs through the model at once
+BATCH_SIZE = int(os.getenv('NER_BATCH_SIZE', default=8))
+
+# Texts longer than the model's maximum input length are split into windows of tokens. Consecutive windows share this
+# many tokens, so that entities on a window boundary are seen whole by at least one of the windows.
+WINDOW_OVERLAP = int(os.getenv('NER_WINDOW_OVERLAP', default=64))
+
 
 def init():
     """
     This method will be run once on startup. You should check if the supporting files your
     model needs have been created, and if not then you should create/fetch them.
     """
-    # Placeholder init code. Replace the sleep with check for model files required etc...
-    global nlp 
-    nlp = pipeline("ner")
+    global nlp
+    # The simple aggregation strategy merges the word pieces and consecutive tokens of an entity into one entity
+    nlp = pipeline("ner", aggregation_strategy="simple")
+
+
+def split_windows(text):
+    """
+    Splits a text into overlapping windows that each fit into the model. Windows start and end on word boundaries, so
+    the text of each window is tokenized the same way as in the whole text. Every character of the text is owned by
+    exactly one window, with the boundary in the middle of the overlap between two windows.
+
+    :param text: Text to split
+    :return: List of (start, end, owned start, owned end) character offsets of each window
+    """
+    tokenizer = nlp.tokenizer
+    window_size = min(tokenizer.model_max_length, 512) - tokenizer.num_special_tokens_to_add()
+
+    encoding = tokenizer(text, add_special_tokens=False, return_offsets_mapping=True, verbose=False)
+    offsets = encoding['offset_mapping']
+    word_ids = encoding.word_ids()
+    if not offsets:
+        return []
+
+    token_windows = []  # (first token, end token) of each window
+    first = 0
+    while True:
+        end = min(first + window_size, len(offsets))
+        word_end = end
+        while word_end > first and word_end < len(offsets) and word_ids[word_end] == word_ids[word_end - 1]:
+            word_end -= 1
+        # A single word that is longer than the window is split inside the word
+        if word_end > first:
+            end = word_end
+        token_windows.append((first, end))
+        if end == len(offsets):
+            break
+
+        next_first = max(end - WINDOW_OVERLAP, first + 1)
+        word_first = next_first
+        while word_first > first and word_ids[word_first] == word_ids[word_first - 1]:
+            word_first -= 1
+        first = word_first if word_first > first else next_first
+
+    windows = []
+    owned_start = 0
+    for i, (first, end) in enumerate(token_windows):
+        if i + 1 < len(token_windows):
+            next_first = token_windows[i + 1][0]
+            middle = (next_first + end) // 2
+            while middle > next_first and word_ids[middle] == word_ids[middle - 1]:
+                middle -= 1
+            owned_end = offsets[middle][0]
+        else:
+            owned_end = len(text)
+        windows.append((offsets[first][0], offsets[end - 1][1], owned_start, owned_end))
+        owned_start = owned_end
+
+    return windows
+
+
+def predict_batch(prediction_inputs):
+    """
+    Finds the entities in several texts. All windows of all texts are run through the pipeline together in batches of
+    BATCH_SIZE. Receives a list of texts and returns a list of results in the same format as predict().
+    """
+    texts = [str(prediction_input) for prediction_input in prediction_inputs]
+    text_windows = [split_windows(text) for text in texts]
+    window_texts = [text[start:end] for text, windows in zip(texts, text_windows) for start, end, _, _ in windows]
+
+    window_entities = iter(nlp(window_texts, batch_size=BATCH_SIZE) if window_texts else [])
 
+    results = []
+    for text, windows in zip(texts, text_windows):
+        result_dict = {entity: [] for entity in CLASSES}
+        for window_start, _, owned_start, owned_end in windows:
+            for entity in next(window_entities):
+                start = window_start + entity['start']
+                # Entities in the overlap between two windows are found by both, and only kept from the owner
+                if not owned_start <= start < owned_end:
+                    continue
+                entity_class = 'I-' + entity['entity_group']
+                if entity_class in result_dict:
+                    result_dict[entity_class].append(text[start:window_start + entity['end']])
+
+        results.append({
+            'classes': CLASSES,  # List every class in the classifier
+            'result': result_dict
+        })
+
+    return results
 
 
 def predict(prediction_input):
@@ -25,52 +124,4 @@ def predict(prediction_input):
     Example code for opening the image using PIL:
     image = Image.open('/app/objects/'+image_file_name)
     """
-    global nlp
-    text_input = prediction_input  # If text model
-    results = nlp(text_input)
-    result_dict = {}
-    for entity in ['I-PER', 'I-LOC', 'I-ORG', 'I-MISC']:
-        result_dict[entity] = []
-    
-    for result in results:
-        entity = result["entity"]
-        result_dict[entity].append(result['word'])
-
-    # only_person = False
-    # result_dict = {}
-    # for entity in ['I-PER', 'I-LOC', 'I-ORG', 'I-MISC']:
-    #     result_dict[entity] = ''
-    
-    # result = nlp(text_input)
-    # res = result[0]
-    # s = text_input[res['start']: res['end']]
-    # curr_index = res['index']
-    # curr_entity = res['entity']
-
-    # i = 1
-    # while(True):
-    #     while i < len(result) and curr_index+1 == result[i]['index'] and curr_entity == result[i]['entity']:
-            
-    #         s += text_input[result[i]['start']: result[i]['end']]
-    #         curr_index = result[i]['index']
-    #         i += 1
-    #     if not only_person or (only_person and curr_entity == 'I-PER'):
-    #         # print(s, " ", curr_entity)
-    #         result_dict[curr_entity] += ' ' + s
-    #     if i == len(result):
-    #         break
-    #     s = text_input[result[i]['start']: result[i]['end']]
-    #     curr_index = result[i]['index']
-    #     curr_entity = result[i]['entity']
-    #     i+=1
-
-    return {
-        'classes': ['I-PER', 'I-LOC', 'I-ORG', 'I-MISC'],  # List every class in the classifier
-        'result': result_dict
-        # {  # For results, use the class names above with the result value
-        #     'PER': result_dict['I-PER'],
-        #     'LOC': result_dict['I-LOC'],
-        #     'ORG': result_dict['I-ORG'],
-        #     'MISC': result_dict['I-MISC']
-        # }
-    }
\ No newline at end of file
+    return predict_batch([prediction_input])[0]
@@ -1,23 +1,46 @@
-from PIL import Image
-import time, json
+import os
+import json
 from torchvision import models, transforms
 import torch
 
+from utility.image_cache import load_image_array
+
 model = None
+device = None
 label_map = {}
-super_COCO_classes ={}
+super_COCO_classes = {}
 classes = []
-result = {}
 score_threshold = 0.6
 
+# Number of threads torch uses for inference. 0 keeps the torch default of one thread per core.
+NUM_THREADS = int(os.getenv('OBJECT_DETECTION_NUM_THREADS', default=0))
+
+# Images are resized so that their shortest side is MIN_SIZE and their longest side is at most MAX_SIZE before
+# detection. Lower values are faster but miss small objects. The defaults are those the model was trained with.
+MIN_SIZE = int(os.getenv('OBJECT_DETECTION_MIN_SIZE', default=800))
+MAX_SIZE = int(os.getenv('OBJECT_DETECTION_MAX_SIZE', default=1333))
+
+# Optimized mode runs a TorchScript version of the model with INT8 weights in the fully connected layers of the box
+# head instead of the eager float32 model. It is only used on CPU, since dynamic quantization has no GPU kernels. The
+# TorchScript module is created on the first start and cached in the model directory.
+OPTIMIZED = os.getenv('OBJECT_DETECTION_OPTIMIZED', default='0') == '1'
+
+# TorchScript modules are only guaranteed to load in the torch version that saved them, and the resize sizes are
+# part of the saved module
+OPTIMIZED_MODEL_PATH = 'model/fasterrcnn_resnet50_fpn_int8_{}_{}_torch{}.pt'.format(MIN_SIZE, MAX_SIZE,
+                                                                                      torch.__version__)
+
+# inference_mode is faster than no_grad, but is only available in newer versions of torch
+inference_mode = getattr(torch, 'inference_mode', torch.no_grad)
+
+
 def init():
     """
     This method will be run once on startup. You should check if the supporting files your
     model needs have been created, and if not then you should create/fetch them.
     """
-    # Placeholder init code. Replace the sleep with check for model files required etc...
     #load FasterRCNN model using ResNet trained on COCO
-    global model, label_map, super_COCO_classes, classes, result, score_threshold
+    global model, device, label_map, super_COCO_classes, classes, score_threshold
 
     USE_GPU = True
     if USE_GPU and torch.cuda.is_available():
@@ -25,13 +48,15 @@ def init():
     else:
         device = torch.device('cpu')
 
-    model = models.detection.fasterrcnn_resnet50_fpn(pretrained=True)
-    model.eval()
+    if NUM_THREADS > 0:
+        torch.set_num_threads(NUM_THREADS)
+
+    model = load_model(OPTIMIZED and device.type == 'cpu')
     #read classes
-    labels = open('model/coco_labels.txt', 'r')
-    for line in labels:
-        ids = line.split(',')
-        label_map[int(ids[0])] = ids[2]
+    with open('model/coco_labels.txt', 'r') as labels:
+        for line in labels:
+            ids = line.split(',')
+            label_map[int(ids[0])] = ids[2].strip()  #remove leading and trailing spaces if any
     # read super classes from json file
     with open('model/coco_labels_super.json', 'r') as fp:
         temp = json.load(fp)
@@ -39,7 +64,6 @@ def init():
     for k in temp:
         class_labels = k.split(',')
         classes.append(temp[k])
-        result[temp[k]] = 0
         for label in class_labels:
             if label not in super_COCO_classes:
                 super_COCO_classes[label] = temp[k]
@@ -47,6 +71,103 @@ def init():
                 super_COCO_classes[label] += ', '+ temp[k]
 
 
+def load_model(optimized):
+    """
+    Loads the FasterRCNN model on the device.
+
+    :param optimized: Whether to load the TorchScript INT8 model instead of the eager float32 model
+    :return: Model that is ready for inference with detect()
+    """
+    if optimized and os.path.exists(OPTIMIZED_MODEL_PATH):
+        return torch.jit.load(OPTIMIZED_MODEL_PATH, map_location=device).eval()
+
+    detection_model = models.detection.fasterrcnn_resnet50_fpn(pretrained=True, min_size=MIN_SIZE, max_size=MAX_SIZE)
+    detection_model.to(device)
+    detection_model.eval()
+
+    if optimized:
+        # Dynamic quantization stores the weights of the linear layers in the box head as INT8. The convolutions of
+        # the backbone stay in float32, since torchvision has no statically quantized FasterRCNN. The model has data
+        # dependent control flow, so it is scripted instead of traced.
+        detection_model = torch.jit.script(
+            torch.quantization.quantize_dynamic(detection_model, {torch.nn.Linear}, dtype=torch.qint8)
+        )
+
+        # Several workers may start at the same time, so the file is written under a temporary name first
+        temporary_path = OPTIMIZED_MODEL_PATH + '.' + str(os.getpid())
+        torch.jit.save(detection_model, temporary_path)
+        os.replace(temporary_path, OPTIMIZED_MODEL_PATH)
+
+    return detection_model
+
+
+def detect(image_tensors, detection_model=None):
+    """
+    Runs object detection on a list of image tensors.
+
+    :param image_tensors: List of RGB image tensors on the model's device
+    :param detection_model: Model returned by load_model(), defaults to the model loaded in init()
+    :return: List of detection results with boxes, labels and scores, in the order of image_tensors
+    """
+    detection_model = detection_model or model
+
+    with inference_mode():
+        outputs = detection_model(image_tensors)
+
+    # Scripted detection models return a tuple of (losses, detections)
+    if isinstance(outputs, tuple):
+        outputs = outputs[1]
+    return outputs
+
+
+def load_image_tensor(prediction_input):
+    """
+    Loads an image from the objects directory, or from the decoded image cache, as an RGB tensor on the model's device.
+    """
+    pixels, _ = load_image_array(prediction_input)
+    return transforms.functional.to_tensor(pixels).to(device)
+
+
+def count_super_classes(output):
+    """
+    Counts the objects detected with a score above score_threshold in each super class.
+
+    :param output: Detection result of a single image from the FasterRCNN model
+    :return: New dictionary of {super class: number of objects}
+    """
+    result = {super_class: 0 for super_class in classes}
+
+    scores = output['scores'].tolist()
+    # boxes = output['boxes'].tolist()
+    labels = output['labels'].tolist()
+
+    for index, score in enumerate(scores):
+        if score > score_threshold:
+            label = label_map.get(labels[index])
+            if label in super_COCO_classes:
+                result[super_COCO_classes[label]] += 1
+
+    return result
+
+
+def predict_batch(prediction_inputs):
+    """
+    Creates predictions for several images with a single forward pass of the model. Receives a list of image file
+    names and returns a list of results in the same format as predict().
+    """
+
+    image_tensors = [load_image_tensor(prediction_input) for prediction_input in prediction_inputs]
+    outputs = detect(image_tensors)
+
+    return [
+        {
+            'classes': classes,  # List every class in the classifier
+            'result': count_super_classes(output)  # For results, use the class names above with the result value
+        }
+        for output in outputs
+    ]
+
+
 def predict(prediction_input):
     """
     Interface method between model and server. This signature must not be
@@ -66,27 +187,4 @@ def predict(prediction_input):
     image = Image.open('/app/objects/'+image_file_name)
     """
 
-    global model, label_map, super_COCO_classes, classes, result, score_threshold
-    for key in result:
-        result[key] = 0
-    image = Image.open('/app/objects/' + prediction_input)
-    image_tensor = transforms.functional.to_tensor(image)
-
-    output = model([image_tensor])
-    for i in range(len(output)):
-        scores = output[i]['scores'].tolist()
-        # boxes = output[i]['boxes'].tolist()
-        labels = output[i]['labels'].tolist()
-        
-        for index, score in enumerate(scores):
-            if score > score_threshold:
-                label = label_map[labels[index]].strip() #remove leading and trailing spaces if any
-                if label in super_COCO_classes:
-                    result[super_COCO_classes[label]] += 1
-                
-
-
-    return {
-        'classes': classes,  # List every class in the classifier
-        'result': result # For results, use the class names above with the result value            
-    }
\ No newline at end of file
+    return predict_batch([prediction_input])[0]
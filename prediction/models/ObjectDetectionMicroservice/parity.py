@@ -0,0 +1,83 @@
+# Parity check for the optimized object detection model. Runs every image through the eager float32 model and the
+# optimized TorchScript INT8 model, checks that the top-k detected labels and the super class counts agree, and
+# compares the latency of both. Exits with status 1 if more than the tolerated fraction of images disagree.
+#
+# Run inside the worker container, where this folder is mounted as /app/model:
+#   python3 -m model.parity /app/objects 20
+import os
+import sys
+import time
+
+from model import model
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+TOP_K = 5
+TOLERANCE = 0.05  # Fraction of images where the top-k labels or super class counts may differ
+
+
+def detect_per_image(detection_model, image_paths):
+    top_k = []
+    counts = []
+    start = time.perf_counter()
+    for image_path in image_paths:
+        output = model.detect([model.load_image_tensor(image_path)], detection_model)[0]
+        # Detections are sorted by descending score
+        top_k.append([model.label_map.get(label) for label in output['labels'][:TOP_K].tolist()])
+        counts.append(model.count_super_classes(output))
+    return (time.perf_counter() - start) / len(image_paths), top_k, counts
+
+
+def main():
+    image_directory = sys.argv[1] if len(sys.argv) > 1 else '/app/objects'
+    limit = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    image_paths = sorted(
+        os.path.join(image_directory, f) for f in os.listdir(image_directory)
+        if f.lower().endswith(IMAGE_EXTENSIONS)
+    )[:limit]
+    if not image_paths:
+        print('No images found in ' + image_directory)
+        return
+
+    model.init()
+
+    start = time.perf_counter()
+    eager_model = model.load_model(optimized=False)
+    eager_load = time.perf_counter() - start
+
+    start = time.perf_counter()
+    optimized_model = model.load_model(optimized=True)
+    optimized_load = time.perf_counter() - start
+
+    # Warm up both models so that one-time allocations and TorchScript profiling runs are not counted
+    for detection_model in (eager_model, optimized_model):
+        detect_per_image(detection_model, image_paths[:1] * 2)
+
+    eager_time, eager_top_k, eager_counts = detect_per_image(eager_model, image_paths)
+    optimized_time, optimized_top_k, optimized_counts = detect_per_image(optimized_model, image_paths)
+
+    different_top_k = 0
+    different_counts = 0
+    for image_path, eager, optimized in zip(image_paths, eager_top_k, optimized_top_k):
+        if eager != optimized:
+            different_top_k += 1
+            print('%s: %s != %s' % (os.path.basename(image_path), eager, optimized))
+    for eager, optimized in zip(eager_counts, optimized_counts):
+        if eager != optimized:
+            different_counts += 1
+
+    print('Images:                                %d' % len(image_paths))
+    print('Load eager model:                      %.1f s' % eager_load)
+    print('Load optimized model:                  %.1f s' % optimized_load)
+    print('Eager float32:                         %.1f ms' % (eager_time * 1000))
+    print('Optimized TorchScript INT8:            %.1f ms' % (optimized_time * 1000))
+    print('Speedup:                               %.1fx' % (eager_time / optimized_time))
+    print('Images with different top %d labels:    %d' % (TOP_K, different_top_k))
+    print('Images with different class counts:    %d' % different_counts)
+
+    if max(different_top_k, different_counts) > TOLERANCE * len(image_paths):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
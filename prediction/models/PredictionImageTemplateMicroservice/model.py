@@ -45,3 +45,16 @@ def predict(prediction_object_path):
             'isRed': __model  # Note that we reference the variable we used in init(). This will be returned as 1.
         }
     }
+
+
+def predict_batch(prediction_object_paths):
+    """
+    Optional interface method between model and server. If this method is defined, the worker will collect several
+    queued objects and pass all of them to the model at once. This allows models to run a single forward pass
+    over a batch of inputs, which is much faster than one call per object.
+
+    This method receives a list of the same inputs that predict() receives, and must return a list of results in
+    the same order and format as predict(). Models that do not define this method receive objects one at a time.
+    """
+
+    return [predict(prediction_object_path) for prediction_object_path in prediction_object_paths]
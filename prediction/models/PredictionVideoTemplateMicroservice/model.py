@@ -1,6 +1,8 @@
-import base64
 import time
-import cv2
+
+import numpy as np
+
+from utility.video import sample_frames, batch_frames, SCENE
 
 
 def init():
@@ -33,12 +35,37 @@ def predict(prediction_object_path):
     prediction_object_path will be in the form: "app/objects/file_name", where file_name is the video, image, etc. file.
     """
 
-    cap = cv2.VideoCapture(prediction_object_path)
-    
+    # Sample the first frame of every scene, checking for scene changes twice per second. Frames are decoded as they are
+    # used, so a model can process them in batches without ever holding the whole video in memory.
+    frames = sample_frames('/app/objects/' + prediction_object_path, mode=SCENE, fps=2, max_side=512)
+    frame_results = []
+    for batch in batch_frames(frames, 8):
+        frame_results.extend(predict_frames([frame.pixels for frame in batch]))
+
+    # Combine the results of the frames into one result for the video. Here a class is found in the video if it is
+    # found in any of its frames.
     return {
         'classes': ['isGreen', 'isRed'],  # List every class in the classifier
         'result': {  # For results, use the class names above with the result value
-            'isGreen': 0,
-            'isRed': __model  # Note that we reference the variable we used in init(). This will be returned as 1.
+            'isGreen': max((result['isGreen'] for result in frame_results), default=0),
+            'isRed': max((result['isRed'] for result in frame_results), default=0)
         }
     }
+
+
+def predict_frames(frame_pixels):
+    """
+    Placeholder for the model. Replace the body with a single forward pass of your model over the batch of frames.
+
+    :param frame_pixels: List of RGB arrays of shape (height, width, 3), one for each frame
+    :return: List of results of the frames in the same order, using the class names returned by predict()
+    """
+    results = []
+    for pixels in frame_pixels:
+        # Placeholder prediction: whether the green or red channel is the brightest channel of the frame on average
+        channel_means = pixels.reshape(-1, 3).mean(axis=0)
+        results.append({
+            'isGreen': int(np.argmax(channel_means) == 1),
+            'isRed': int(np.argmax(channel_means) == 0) * __model  # Note that we reference the variable from init()
+        })
+    return results
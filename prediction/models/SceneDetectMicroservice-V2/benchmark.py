@@ -0,0 +1,67 @@
+# Per-image latency benchmark for the scene detection model. Compares the old behaviour of rebuilding the
+# wideresnet18 for every prediction against the persistent model that is created once in SceneDetectionModel().
+#
+# Run inside the worker container, where this folder is mounted as /app/model:
+#   python3 -m model.benchmark /app/objects 20
+import os
+import sys
+import time
+
+import torch
+from torch.nn import functional as F
+
+from model.scene_detect_model import SceneDetectionModel
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.gif')
+
+
+def reload_forward_pass(scene_model):
+    # forward pass as it was done before the model was kept in memory: load the network and hooks on every call
+    features_blobs = []
+    model = scene_model.load_model(features_blobs)
+    scene_model.get_weight_softmax(model)
+    with torch.no_grad():
+        logit = model.forward(scene_model.input_img)
+    h_x = F.softmax(logit, 1).data.squeeze()
+    probs, idx = h_x.sort(0, True)
+    return idx.numpy(), probs.numpy(), features_blobs
+
+
+def time_per_image(scene_model, image_paths, forward_pass):
+    start = time.perf_counter()
+    for image_path in image_paths:
+        scene_model.load_image(image_path)
+        forward_pass()
+    return (time.perf_counter() - start) / len(image_paths)
+
+
+def main():
+    image_directory = sys.argv[1] if len(sys.argv) > 1 else '/app/objects'
+    limit = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    image_paths = sorted(
+        os.path.join(image_directory, f) for f in os.listdir(image_directory)
+        if f.lower().endswith(IMAGE_EXTENSIONS)
+    )[:limit]
+    if not image_paths:
+        print('No images found in ' + image_directory)
+        return
+
+    scene_model = SceneDetectionModel()
+
+    # Warm up both paths once so that one-time allocations are not counted
+    scene_model.load_image(image_paths[0])
+    scene_model.forward_pass()
+    reload_forward_pass(scene_model)
+
+    before = time_per_image(scene_model, image_paths, lambda: reload_forward_pass(scene_model))
+    after = time_per_image(scene_model, image_paths, scene_model.forward_pass)
+
+    print('Images:                 %d' % len(image_paths))
+    print('Reload per image (old): %.1f ms' % (before * 1000))
+    print('Persistent model (new): %.1f ms' % (after * 1000))
+    print('Speedup:                %.1fx' % (before / after))
+
+
+if __name__ == '__main__':
+    main()
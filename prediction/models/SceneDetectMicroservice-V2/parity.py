@@ -0,0 +1,80 @@
+# Parity check for the optimized scene detection model. Runs every image through the eager float32 model and the
+# optimized TorchScript INT8 model, checks that the top-k scene categories agree and compares the latency of both.
+# Exits with status 1 if more than the tolerated fraction of images disagree.
+#
+# Run inside the worker container, where this folder is mounted as /app/model:
+#   python3 -m model.parity /app/objects 20
+import os
+import sys
+import time
+
+from model.scene_detect_model import SceneDetectionModel
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.gif')
+TOP_K = 5
+TOLERANCE = 0.05  # Fraction of images where the top 1 or top-k categories may differ
+
+
+def top_k_per_image(scene_model, image_paths):
+    top_k = []
+    start = time.perf_counter()
+    for image_path in image_paths:
+        scene_model.load_image(image_path)
+        idx, _, _ = scene_model.forward_pass()
+        top_k.append([scene_model.classes[i] for i in idx[:TOP_K]])
+    return (time.perf_counter() - start) / len(image_paths), top_k
+
+
+def main():
+    image_directory = sys.argv[1] if len(sys.argv) > 1 else '/app/objects'
+    limit = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    image_paths = sorted(
+        os.path.join(image_directory, f) for f in os.listdir(image_directory)
+        if f.lower().endswith(IMAGE_EXTENSIONS)
+    )[:limit]
+    if not image_paths:
+        print('No images found in ' + image_directory)
+        return
+
+    start = time.perf_counter()
+    eager_model = SceneDetectionModel(optimized=False)
+    eager_load = time.perf_counter() - start
+
+    start = time.perf_counter()
+    optimized_model = SceneDetectionModel(optimized=True)
+    optimized_load = time.perf_counter() - start
+
+    # Warm up both models once so that one-time allocations and TorchScript profiling runs are not counted
+    for scene_model in (eager_model, optimized_model):
+        for _ in range(2):
+            scene_model.load_image(image_paths[0])
+            scene_model.forward_pass()
+
+    eager_time, eager_top_k = top_k_per_image(eager_model, image_paths)
+    optimized_time, optimized_top_k = top_k_per_image(optimized_model, image_paths)
+
+    different_top_1 = 0
+    different_top_k = 0
+    for image_path, eager, optimized in zip(image_paths, eager_top_k, optimized_top_k):
+        if eager[0] != optimized[0]:
+            different_top_1 += 1
+        if set(eager) != set(optimized):
+            different_top_k += 1
+            print('%s: %s != %s' % (os.path.basename(image_path), eager, optimized))
+
+    print('Images:                          %d' % len(image_paths))
+    print('Load eager model:                %.1f s' % eager_load)
+    print('Load optimized model:            %.1f s' % optimized_load)
+    print('Eager float32:                   %.1f ms' % (eager_time * 1000))
+    print('Optimized TorchScript INT8:      %.1f ms' % (optimized_time * 1000))
+    print('Speedup:                         %.1fx' % (eager_time / optimized_time))
+    print('Images with a different top 1:   %d' % different_top_1)
+    print('Images with a different top %d:   %d' % (TOP_K, different_top_k))
+
+    if max(different_top_1, different_top_k) > TOLERANCE * len(image_paths):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -9,9 +9,35 @@ from torch.nn import functional as F
 
 import os
 import sys
+import threading
 import numpy as np
 from PIL import Image
 
+from utility.image_cache import load_image_array
+
+# Optimized mode runs a TorchScript version of the network with INT8 weights in the fully connected layer instead of
+# the eager float32 network. The TorchScript module is created on the first start and cached in MODEL_DIRECTORY.
+OPTIMIZED = os.getenv('SCENE_DETECT_OPTIMIZED', default='0') == '1'
+
+
+class SceneFeatureNetwork(torch.nn.Module):
+    """
+    Runs the wideresnet forward pass and returns the layer4 and avgpool features along with the logits. In eager mode
+    these features are collected by forward hooks, which are not kept when the network is traced.
+    """
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, x):
+        model = self.model
+        x = model.relu(model.bn1(model.conv1(x)))
+        layer4 = model.layer4(model.layer3(model.layer2(model.layer1(x))))
+        avgpool = model.avgpool(layer4)
+        logit = model.fc(avgpool.view(avgpool.size(0), -1))
+        return logit, layer4, avgpool
+
 
 class SceneDetectionModel:
     # Model URLs
@@ -26,19 +52,38 @@ class SceneDetectionModel:
     WIDERESNET18_FILE_NAME = 'wideresnet.py'
     WIDERESNET18_SCENE_ATTRIBUTES_FILE_NAME = 'W_sceneattribute_wideresnet18.npy'
     WIDERESNET18_TAR_FILE_NAME = 'wideresnet18_places365.pth.tar'
+    # TorchScript modules are only guaranteed to load in the torch version that saved them
+    WIDERESNET18_OPTIMIZED_FILE_NAME = 'wideresnet18_places365_int8_torch{}.pt'
     MODEL_DIRECTORY = 'model/SceneDetect/'
 
     # Default constants
     IMG_WIDTH = 224
     IMG_HEIGHT = 224
+    # Images are loaded with their longest side reduced to this size before they are resized to the input size, which
+    # skips most of the decoding work
+    LOAD_MAX_SIDE = 512
 
-    def __init__(self):
+    def __init__(self, optimized=OPTIMIZED):
         self.classes = self.download_classes()
         self.labels_indoor_outdoor = self.download_labels_indoor_outdoor()
         self.labels_attribute = self.download_labels_attributes()
         self.W_attribute = self.download_wideresnet18_attributes()
         self.download_model()
         self.input_img = None
+        self.tf = self.returnTF()
+
+        # The network, its hooks and the softmax weights are created once here and reused for every prediction.
+        # Hooks write into self.features_blobs, which is cleared at the start of every forward pass.
+        self.features_blobs = []
+        self.forward_lock = threading.Lock()
+        self.optimized = optimized
+        if self.optimized:
+            model = self.load_model()
+            self.weight_softmax = self.get_weight_softmax(model)
+            self.model = self.load_optimized_model(model)
+        else:
+            self.model = self.load_model(self.features_blobs)
+            self.weight_softmax = self.get_weight_softmax(self.model)
 
     # function to ensure presence of the list of scene categories
     def download_classes(self):
@@ -111,8 +156,9 @@ class SceneDetectionModel:
             os.system('wget ' + self.CSAILVISION_URL + self.WIDERESNET18_FILE_NAME + ' -P ' + self.MODEL_DIRECTORY)
 
     # fetch and load the model, model specified inside the function itself and can
-    # be modified to load a different model
-    def load_model(self, features_blobs):
+    # be modified to load a different model. Feature hooks are only registered if a
+    # features_blobs list is given.
+    def load_model(self, features_blobs=None):
         # create feature list given module, input and output
         def hook_feature(module, input, output):
             features_blobs.append(np.squeeze(output.data.cpu().numpy()))
@@ -128,35 +174,73 @@ class SceneDetectionModel:
         model.load_state_dict(state_dict)
         model.eval()
 
+        # inference only, so there is no need to track gradients on the weights
+        for param in model.parameters():
+            param.requires_grad = False
+
         # hook the feature extractor
-        features_names = ['layer4', 'avgpool']  # this is the last conv layer of the resnet
-        for name in features_names:
-            model._modules.get(name).register_forward_hook(hook_feature)
+        if features_blobs is not None:
+            features_names = ['layer4', 'avgpool']  # this is the last conv layer of the resnet
+            for name in features_names:
+                model._modules.get(name).register_forward_hook(hook_feature)
         return model
 
-    # method to load a single image into the model for prediction
-    def load_image(self, image_file_name):
-        tf = self.returnTF()
-        img = Image.open(image_file_name)
+    # load the optimized version of the model from the cache in MODEL_DIRECTORY, or create it from the eager model
+    # if the cache is missing or older than the weights
+    def load_optimized_model(self, model):
+        optimized_path = os.path.join(self.MODEL_DIRECTORY,
+                                      self.WIDERESNET18_OPTIMIZED_FILE_NAME.format(torch.__version__))
+        weights_path = os.path.join(self.MODEL_DIRECTORY, self.WIDERESNET18_TAR_FILE_NAME)
 
-        if img.mode != 'RGB':
-            img = img.convert("RGB")
-        self.input_img = V(tf(img).unsqueeze(0))
+        if os.path.exists(optimized_path) and os.path.getmtime(optimized_path) >= os.path.getmtime(weights_path):
+            optimized_model = torch.jit.load(optimized_path, map_location='cpu')
+        else:
+            # Dynamic quantization stores the weights of the linear layers as INT8. The convolutions stay in float32,
+            # since static quantization of the residual additions would require changes to the network definition.
+            network = torch.quantization.quantize_dynamic(SceneFeatureNetwork(model), {torch.nn.Linear},
+                                                          dtype=torch.qint8)
+            with torch.no_grad():
+                optimized_model = torch.jit.trace(network, torch.zeros(1, 3, self.IMG_HEIGHT, self.IMG_WIDTH))
 
-    def forward_pass(self):
-        # Common list required for hooking features later in the model
-        features_blobs = []
+            # Several workers may start at the same time, so the file is written under a temporary name first
+            temporary_path = optimized_path + '.' + str(os.getpid())
+            torch.jit.save(optimized_model, temporary_path)
+            os.replace(temporary_path, optimized_path)
 
-        # load the model using all helper functions defined before this
-        model = self.load_model(features_blobs)
+        # Freezing inlines the weights as constants and folds the batch normalization layers into the convolutions
+        return torch.jit.freeze(optimized_model.eval())
 
-        # get the softmax weight
+    # get the softmax weight of the final fully connected layer
+    @staticmethod
+    def get_weight_softmax(model):
         params = list(model.parameters())
         weight_softmax = params[-2].data.numpy()
         weight_softmax[weight_softmax < 0] = 0
+        return weight_softmax
+
+    # method to load a single image into the model for prediction
+    def load_image(self, image_file_name):
+        pixels, _ = load_image_array(image_file_name, self.LOAD_MAX_SIDE)
+        img = Image.fromarray(pixels)
+        self.input_img = V(self.tf(img).unsqueeze(0))
+
+    def forward_pass(self):
+        if self.optimized:
+            # The optimized model returns the features directly instead of writing them to the shared buffer
+            with torch.no_grad():
+                logit, *features = self.model(self.input_img)
+            features_blobs = [np.squeeze(feature.numpy()) for feature in features]
+        else:
+            # The hooks registered in load_model() append to the shared feature buffer, so only one forward pass may
+            # use it at a time. The buffer is emptied before the pass and a copy is returned to the caller.
+            with self.forward_lock:
+                del self.features_blobs[:]
+
+                # forward pass
+                with torch.no_grad():
+                    logit = self.model.forward(self.input_img)
+                features_blobs = list(self.features_blobs)
 
-        # forward pass
-        logit = model.forward(self.input_img)
         h_x = F.softmax(logit, 1).data.squeeze()
         probs, idx = h_x.sort(0, True)
         probs = probs.numpy()
@@ -1,6 +1,23 @@
+import os
+import re
+
 from transformers import pipeline
 
-#nlp = None
+nlp = None
+
+CLASSES = ['POSITIVE', 'NEGATIVE']
+
+# Number of chunks the pipeline runs through the model at once
+BATCH_SIZE = int(os.getenv('SENTIMENT_BATCH_SIZE', default=8))
+
+# Texts are split into sentences, which are grouped into chunks of at most this many characters. Chunks of this size
+# fit into the model's maximum input length, and longer chunks are truncated by the pipeline.
+CHUNK_SIZE = int(os.getenv('SENTIMENT_CHUNK_SIZE', default=1000))
+
+# A sentence starts with a character that is neither whitespace nor sentence punctuation, and ends with the sentence
+# punctuation that follows it, at a line break or at the end of the text
+SENTENCE_PATTERN = re.compile(r'[^\s.!?][^.!?\n]*[.!?]*')
+
 
 def init():
     """
@@ -9,9 +26,88 @@ def init():
     """
     global nlp
     nlp = pipeline("sentiment-analysis")
-    return
 
 
+def split_chunks(text):
+    """
+    Splits a text into chunks of consecutive sentences of at most CHUNK_SIZE characters. Sentences that are longer
+    than CHUNK_SIZE are split at the last space that fits.
+
+    :param text: Text to split
+    :return: List of (start, end) character offsets of each chunk
+    """
+    chunks = []
+    start = end = None
+    for sentence in SENTENCE_PATTERN.finditer(text):
+        sentence_start, sentence_end = sentence.span()
+        if start is not None and sentence_end - start <= CHUNK_SIZE:
+            end = sentence_end
+            continue
+
+        if start is not None:
+            chunks.append((start, end))
+
+        while sentence_end - sentence_start > CHUNK_SIZE:
+            split = text.rfind(' ', sentence_start + 1, sentence_start + CHUNK_SIZE)
+            if split == -1:
+                split = sentence_start + CHUNK_SIZE
+            chunks.append((sentence_start, split))
+            sentence_start = split
+            while sentence_start < sentence_end and text[sentence_start].isspace():
+                sentence_start += 1
+        start, end = sentence_start, sentence_end
+
+    if start is not None:
+        chunks.append((start, end))
+    return chunks
+
+
+def predict_batch(prediction_inputs):
+    """
+    Scores the sentiment of several texts. All chunks of all texts are run through the pipeline together in batches of
+    BATCH_SIZE. Receives a list of texts and returns a list of results in the same format as predict().
+    """
+    texts = [str(prediction_input) for prediction_input in prediction_inputs]
+    # Texts without any sentence are scored as a whole, as they were before they were split into chunks
+    text_chunks = [split_chunks(text) or [(0, len(text))] for text in texts]
+    chunk_texts = [text[start:end] for text, chunks in zip(texts, text_chunks) for start, end in chunks]
+
+    chunk_scores = iter(nlp(chunk_texts, batch_size=BATCH_SIZE, truncation=True))
+
+    results = []
+    for chunks in text_chunks:
+        chunk_results = []
+        positive = 0
+        total_weight = 0
+        for start, end in chunks:
+            chunk_score = next(chunk_scores)
+            chunk_results.append({
+                'start': start,
+                'end': end,
+                'label': chunk_score['label'],
+                'score': chunk_score['score']
+            })
+
+            # The document sentiment is the average of the chunk sentiments, weighted by the length of the chunks
+            chunk_positive = chunk_score['score'] if chunk_score['label'] == 'POSITIVE' else 1 - chunk_score['score']
+            weight = max(end - start, 1)
+            positive += chunk_positive * weight
+            total_weight += weight
+
+        positive /= total_weight
+        results.append({
+            'classes': CLASSES,  # List every class in the classifier
+            'result': {
+                'POSITIVE': positive,
+                'NEGATIVE': 1 - positive
+            },
+            'details': {  # Scores of each chunk, which are stored with the object but not searched
+                'chunks': chunk_results
+            }
+        })
+
+    return results
+
 
 def predict(prediction_input: str):
     """
@@ -31,14 +127,4 @@ def predict(prediction_input: str):
     Example code for opening the image using PIL:
     image = Image.open('/app/objects/'+image_file_name)
     """
-    global nlp
-    data = str(prediction_input)
-    result = nlp(data)[0]
-
-    return {
-        'classes': ['POSITIVE', 'NEGATIVE'],  # List every class in the classifier
-        'result': {  
-            result["label"]: result["score"]
-        }
-    }
-
+    return predict_batch([prediction_input])[0]
@@ -1,19 +1,28 @@
-from PIL import Image
-import time
-import librosa
+import os
+import subprocess
+import tempfile
+
+import numpy as np
 import torch
+from imageio_ffmpeg import get_ffmpeg_exe
 from transformers import Wav2Vec2ForCTC, Wav2Vec2Tokenizer
-import IPython.display as display
-import soundfile as sf
 import truecase
 import spacy
-from spacy import displacy
-from collections import Counter
-import en_core_web_sm
-import truecase
 
 nlp = spacy.load("en_core_web_sm")
-import moviepy.editor as mp
+
+# Wav2Vec2 was trained on audio sampled at 16 kHz
+SAMPLE_RATE = 16000
+
+# The audio is transcribed in blocks of this many seconds, several blocks at a time
+BLOCK_SECONDS = 25
+BATCH_SIZE = int(os.getenv('SPEECH_REC_BATCH_SIZE', default=4))
+
+# Blocks at the end of the audio that are shorter than this are too short to contain speech and are skipped
+MIN_BLOCK_SAMPLES = SAMPLE_RATE // 10
+
+# ffmpeg error for videos without an audio track
+NO_AUDIO_MESSAGE = 'does not contain any stream'
 
 
 def init():
@@ -21,14 +30,69 @@ def init():
     This method will be run once on startup. You should check if the supporting files your
     model needs have been created, and if not then you should create/fetch them.
     """
-    # Placeholder init code. Replace the sleep with check for model files required etc...
-    time.sleep(1)
     global __tokenizer
     __tokenizer = Wav2Vec2Tokenizer.from_pretrained("facebook/wav2vec2-base-960h")
     global __model
     __model = Wav2Vec2ForCTC.from_pretrained("facebook/wav2vec2-base-960h")
 
 
+def stream_audio(video_path):
+    """
+    Decodes the audio track of a video to mono samples at SAMPLE_RATE in a single pass. The samples are read from
+    ffmpeg's output as they are decoded, so no audio files are written and only one batch of blocks is held in memory.
+    ffmpeg's errors are written to a temporary file, since a full stderr pipe that is not read would block ffmpeg
+    while this waits for its output.
+
+    :param video_path: Path to video file
+    :return: Generator of lists of up to BATCH_SIZE float32 sample arrays of BLOCK_SECONDS each
+    """
+    block_samples = BLOCK_SECONDS * SAMPLE_RATE
+    command = [get_ffmpeg_exe(), '-nostdin', '-loglevel', 'error', '-i', video_path,
+               '-vn', '-ac', '1', '-ar', str(SAMPLE_RATE), '-f', 'f32le', '-']
+
+    with tempfile.TemporaryFile() as error_file:
+        with subprocess.Popen(command, stdout=subprocess.PIPE, stderr=error_file) as process:
+            while True:
+                data = process.stdout.read(block_samples * BATCH_SIZE * 4)  # 4 bytes per float32 sample
+                if not data:
+                    break
+                samples = np.frombuffer(data, dtype=np.float32)
+                yield [samples[i:i + block_samples] for i in range(0, len(samples), block_samples)]
+
+        error_file.seek(0)
+        error = error_file.read().decode(errors='replace')
+
+    if process.returncode != 0 and NO_AUDIO_MESSAGE not in error:
+        raise RuntimeError('Could not decode audio of ' + video_path + ': ' + error)
+
+
+def transcribe(video_path):
+    """
+    Transcribes all of the speech in a video. The audio is run through Wav2Vec2 in batches of blocks, and the
+    transcript is assembled from the blocks as they are transcribed.
+
+    :param video_path: Path to video file
+    :return: Truecased transcript, or an empty string if the video has no audio
+    """
+    transcript = []
+    for blocks in stream_audio(video_path):
+        blocks = [block for block in blocks if len(block) >= MIN_BLOCK_SAMPLES]
+        if not blocks:
+            continue
+
+        # The last block of the audio is padded with silence to the length of the other blocks
+        input_values = __tokenizer(blocks, return_tensors="pt", padding=True).input_values
+        with torch.no_grad():
+            logits = __model(input_values).logits
+        predicted_ids = torch.argmax(logits, dim=-1)
+
+        for transcription in __tokenizer.batch_decode(predicted_ids):
+            if transcription:
+                transcript.append(truecase.get_true_case(transcription.lower()))
+
+    return ' '.join(transcript)
+
+
 def predict(prediction_object_path):
     """
     Interface method between model and server. This signature must not be
@@ -47,55 +111,16 @@ def predict(prediction_object_path):
     prediction_object_path will be in the form: "app/objects/file_name", where file_name is the video, image, etc. file.
     """
 
-    video = mp.VideoFileClip('/app/objects/' + prediction_object_path)
-    ex_aud = video.audio
-
-    ex_aud.write_audiofile("short1.wav")
-
-    # Loading the audio file
-    audio, rate = librosa.load("short1.wav", sr=16000)
-
-    # Importing Wav2Vec pretrained model
-
-    def asr_transcript(tokenizer, model, input_file):
-        if not tokenizer:
-            print("Not receving tokenizer", flush=True)
-
-        transcript = ""
-        pre, rate = librosa.load(input_file, sr=16000)
-        sf.write("temp1.wav", pre, rate)
-        stream = librosa.stream("temp1.wav",
-                                block_length=25,
-                                frame_length=16000,
-                                hop_length=16000)
-        for speech in stream:
-            if len(speech.shape) > 1:
-                speech = speech[:, 0] + speech[:, 1]
-        input_values = tokenizer(speech, return_tensors="pt").input_values
-        logits = model(input_values).logits
-        predicted_ids = torch.argmax(logits, dim=-1)
-        transcription = tokenizer.batch_decode(predicted_ids)[0]
-        # print(transcription)
-        transcript += truecase.get_true_case(transcription.lower())
-
-        return transcript
-
-    short1_trans = asr_transcript(__tokenizer, __model, "short1.wav")
+    transcript = transcribe('/app/objects/' + prediction_object_path)
 
-    # file1 = open("speech.txt", "w")
-    # file1.write(short1_trans)
-    # file = open("speech.txt", mode="r")
-    # speech = file.read()
     ner_dict = {'DATE': [], 'PERSON': [], 'GPE': [], 'ORG': [], 'TIME': [], 'LOC': [], 'LANGUAGE': [], 'PRODUCT': [],
                 "FAC": []}
 
-    # put the Speech.txt string into the nlp object (this pipeline automatically extracts NER entities)
-    doc = nlp(short1_trans)
+    # put the transcript into the nlp object (this pipeline automatically extracts NER entities)
+    doc = nlp(transcript)
     for entities in doc.ents:
-        if entities.label_ == "CARDINAL":
-            nothing = "nothing"
-        else:
-            # print(f"word: {entities.text}: TAG: {entities.label_}")
+        # Entity types that are not listed in the classes, such as CARDINAL, are ignored
+        if entities.label_ in ner_dict:
             ner_dict[entities.label_].append(entities.text)
 
     return {
@@ -0,0 +1,7 @@
+model_name='video_frames'
+model_tags='video,frames'
+# The model type determines what inputs your model will receive. The options are:
+# - 'image'  :  Model receives a file name to an image file, opens it, and creates a prediction
+# - 'text'   :  Model receives a string of text and uses it to create a prediction.
+# - 'video'  :  Model receives a file name to an video file, opens it, and creates a prediction
+model_type = 'video'
@@ -0,0 +1,38 @@
+from utility.video import sample_frames, KEYFRAME
+
+# Frames are only counted, so they are converted to tiny arrays
+COUNT_FRAME_SIDE = 16
+
+CLASSES = ['keyframes', 'duration']
+
+
+def init():
+    """
+    This method will be run once on startup. You should check if the supporting files your
+    model needs have been created, and if not then you should create/fetch them.
+    """
+    # The model has no supporting files. Frames of videos that are uploaded with frame models are extracted by
+    # utility.fanout.extract_video_frames(), which the server enqueues on the queue of this model.
+    return True
+
+
+def predict(video_file_name):
+    """
+    Interface method between model and server. This signature must not be
+    changed and your model must be able to create a prediction from the object
+    file that is passed in.
+    """
+
+    keyframes = 0
+    duration = 0.0
+    for frame in sample_frames('/app/objects/' + video_file_name, mode=KEYFRAME, max_side=COUNT_FRAME_SIDE):
+        keyframes += 1
+        duration = frame.timestamp
+
+    return {
+        'classes': CLASSES,  # List every class in the classifier
+        'result': {  # For results, use the class names above with the result value
+            'keyframes': keyframes,
+            'duration': duration  # Timestamp of the last keyframe in seconds
+        }
+    }
@@ -0,0 +1,108 @@
+"""
+Benchmark for object lookups by md5 hash, comparing the previous access pattern (two find_one calls without an index)
+against a single find_one backed by the unique hash_md5 index created by db_connection.create_indexes_db().
+
+The benchmark uses its own database so that server data is never modified. It may be run against a local mongod
+(default, uses DB_HOST) or against mongomock if it is installed:
+
+    python benchmark/benchmark_db.py --objects 1000000 --lookups 200
+    python benchmark/benchmark_db.py --mongomock --objects 100000
+"""
+import argparse
+import os
+import random
+import time
+import uuid
+
+from pymongo import ASCENDING, MongoClient
+
+BENCHMARK_DATABASE = 'benchmark_database'
+INSERT_BATCH_SIZE = 10000
+
+
+def create_collection(use_mongomock):
+    if use_mongomock:
+        import mongomock
+        client = mongomock.MongoClient()
+    else:
+        client = MongoClient(os.getenv('DB_HOST', default='database'), 27017)
+
+    collection = client[BENCHMARK_DATABASE]['objects']
+    collection.drop()
+    return collection
+
+
+def populate(collection, num_objects):
+    """
+    Inserts num_objects documents in the shape of UniversalMLPredictionObject and returns their hashes.
+    """
+    hashes = []
+    batch = []
+    for i in range(num_objects):
+        hash_md5 = uuid.uuid4().hex
+        hashes.append(hash_md5)
+        batch.append({
+            'file_names': ['image_' + str(i) + '.jpg'],
+            'hash_md5': hash_md5,
+            'type': 'image',
+            'users': ['user_' + str(i % 100)],
+            'metadata': '',
+            'models': {},
+            'text_content': '',
+            'tags': [],
+            'user_role_able_to_tag': ['admin'],
+        })
+        if len(batch) == INSERT_BATCH_SIZE:
+            collection.insert_many(batch, ordered=False)
+            batch = []
+    if batch:
+        collection.insert_many(batch, ordered=False)
+    return hashes
+
+
+def double_lookup(collection, hash_md5):
+    # Previous pattern used by get_object_by_md5_hash_db: check for existence, then fetch again
+    if not collection.find_one({'hash_md5': hash_md5}):
+        return None
+    return collection.find_one({'hash_md5': hash_md5})
+
+
+def single_lookup(collection, hash_md5):
+    return collection.find_one({'hash_md5': hash_md5}, {'_id': 0})
+
+
+def time_lookups(collection, hashes, lookup):
+    start = time.perf_counter()
+    for hash_md5 in hashes:
+        lookup(collection, hash_md5)
+    return (time.perf_counter() - start) / len(hashes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark object lookups by md5 hash')
+    parser.add_argument('--objects', type=int, default=1000000, help='Number of objects to insert')
+    parser.add_argument('--lookups', type=int, default=200, help='Number of random lookups to time')
+    parser.add_argument('--mongomock', action='store_true', help='Use mongomock instead of a mongod server')
+    args = parser.parse_args()
+
+    collection = create_collection(args.mongomock)
+
+    print('Inserting ' + str(args.objects) + ' objects...', flush=True)
+    hashes = populate(collection, args.objects)
+    sample = random.sample(hashes, min(args.lookups, len(hashes)))
+
+    before = time_lookups(collection, sample, double_lookup)
+
+    collection.create_index([('hash_md5', ASCENDING)], unique=True)
+    after = time_lookups(collection, sample, single_lookup)
+
+    print('Lookups:                      %d' % len(sample))
+    print('Two queries, no index (old):  %.3f ms' % (before * 1000))
+    print('One query, hash index (new):  %.3f ms' % (after * 1000))
+    print('Speedup:                      %.1fx' % (before / after))
+
+    collection.drop()
+
+
+if __name__ == '__main__':
+    main()
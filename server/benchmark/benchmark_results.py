@@ -0,0 +1,96 @@
+"""
+Benchmark for the pending job check done by /model/results. Compares the previous approach (listing every queued and
+started job, matching the md5 hash against each job id and fetching matching jobs) against reading the pending job
+counters that are kept per object with one MGET.
+
+Jobs are created on a separate queue that no worker listens on, and are removed when the benchmark is finished:
+
+    python benchmark/benchmark_results.py --jobs 100000 --hashes 50
+"""
+import argparse
+import os
+import random
+import time
+import uuid
+
+from redis import Redis
+from rq import Queue
+from rq.job import Job
+from rq.registry import StartedJobRegistry
+
+BENCHMARK_QUEUE = 'benchmark_results_model'
+PREDICTION_PENDING_KEY_PREFIX = 'benchmark_prediction_pending:'
+ENQUEUE_BATCH_SIZE = 5000
+
+
+def enqueue_jobs(connection, queue, num_jobs):
+    hashes = [uuid.uuid4().hex for _ in range(num_jobs)]
+    for i in range(0, num_jobs, ENQUEUE_BATCH_SIZE):
+        with connection.pipeline() as pipe:
+            batch = hashes[i:i + ENQUEUE_BATCH_SIZE]
+            queue.enqueue_many([
+                Queue.prepare_data('utility.main.predict_object', (hash_md5, hash_md5 + '.jpg'),
+                                   job_id=hash_md5 + BENCHMARK_QUEUE + str(uuid.uuid4()))
+                for hash_md5 in batch
+            ], pipeline=pipe)
+            for hash_md5 in batch:
+                pipe.incr(PREDICTION_PENDING_KEY_PREFIX + hash_md5)
+            pipe.execute()
+    return hashes
+
+
+def scan_jobs(connection, md5_hashes):
+    # Previous /model/results pending check
+    all_jobs = set(StartedJobRegistry(BENCHMARK_QUEUE, connection=connection).get_job_ids() +
+                   Queue(BENCHMARK_QUEUE, connection=connection).job_ids)
+    pending = []
+    for md5_hash in md5_hashes:
+        found_pending_job = False
+        for job_id in all_jobs:
+            if md5_hash in job_id and Job.fetch(job_id, connection=connection).get_status() != 'finished':
+                found_pending_job = True
+                break
+        pending.append(found_pending_job)
+    return pending
+
+
+def read_counters(connection, md5_hashes):
+    counts = connection.mget([PREDICTION_PENDING_KEY_PREFIX + md5_hash for md5_hash in md5_hashes])
+    return [count is not None and int(count) > 0 for count in counts]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the pending job check of /model/results')
+    parser.add_argument('--jobs', type=int, default=100000, help='Number of queued jobs')
+    parser.add_argument('--hashes', type=int, default=50, help='Number of hashes requested per call')
+    args = parser.parse_args()
+
+    connection = Redis(host=os.getenv('REDIS_HOST', default='redis'), port=6379)
+    queue = Queue(BENCHMARK_QUEUE, connection=connection)
+
+    try:
+        print('Enqueueing ' + str(args.jobs) + ' jobs...', flush=True)
+        hashes = enqueue_jobs(connection, queue, args.jobs)
+        sample = random.sample(hashes, min(args.hashes, len(hashes)))
+
+        start = time.perf_counter()
+        old_result = scan_jobs(connection, sample)
+        before = time.perf_counter() - start
+
+        start = time.perf_counter()
+        new_result = read_counters(connection, sample)
+        after = time.perf_counter() - start
+
+        assert old_result == new_result
+        print('Hashes per request:          %d' % len(sample))
+        print('Scan all jobs (old):         %.1f ms' % (before * 1000))
+        print('Pending counters MGET (new): %.3f ms' % (after * 1000))
+        print('Speedup:                     %.0fx' % (before / after))
+    finally:
+        queue.empty()
+        for key in connection.scan_iter(PREDICTION_PENDING_KEY_PREFIX + '*'):
+            connection.delete(key)
+
+
+if __name__ == '__main__':
+    main()
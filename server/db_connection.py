@@ -1,10 +1,118 @@
 from typing import Union, List
 
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import ASCENDING, UpdateOne
+from pymongo.errors import OperationFailure
+
 from dependency import User, user_collection, PAGINATION_PAGE_SIZE, UniversalMLPredictionObject, Roles, \
     APIKeyData, object_collection,\
-    api_key_collection, model_collection, TrainingResult, training_collection, logger
-import math
+    api_key_collection, model_collection, TrainingResult, training_collection, frame_result_collection, logger
+# Shared with the prediction workers, so that the server and workers create the same search tokens
+from prediction_worker.utility.search_tokens import create_search_tokens, SEARCH_TOKEN_VERSION
+import base64
 import json
+import math
+import re
+import time
+
+
+# ---------------------------
+# Database Indexes
+# ---------------------------
+
+# Indexes required by the lookups in this file, in the format of (collection, field or tuple of fields, unique)
+DATABASE_INDEXES = [
+    (user_collection, 'username', True),
+    (api_key_collection, 'key', True),
+    (api_key_collection, 'user', False),
+    (object_collection, 'hash_md5', True),
+    # Finds the objects of a user in _id order, so that cursor pages of users read only the objects of the page
+    (object_collection, ('users', '_id'), False),
+    (object_collection, 'search_tokens', False),
+    # One result of each model at each timestamp of a video, read in timestamp order
+    (frame_result_collection, ('video_hash', 'model_name', 'timestamp'), True),
+    (model_collection, 'model_name', True),
+    (training_collection, 'training_id', True),
+    (training_collection, 'username', False),
+]
+
+
+def create_indexes_db():
+    """
+    Creates all indexes used by the server. This is safe to call on every startup, since MongoDB will not rebuild an
+    index that already exists with the same specification. If a unique index cannot be created because the collection
+    already contains duplicate values, a regular index is created instead so that lookups are still indexed.
+    """
+
+    for collection, fields, unique in DATABASE_INDEXES:
+        keys = [(field, ASCENDING) for field in (fields if isinstance(fields, tuple) else (fields,))]
+        try:
+            collection.create_index(keys, unique=unique, background=True)
+        except OperationFailure as e:
+            if not unique:
+                raise
+            logger.warning('Unable to create unique index on ' + collection.name + '.' + str(fields) + ': ' + str(e))
+            collection.create_index(keys, background=True)
+
+
+# ---------------------------
+# Search Tokens
+# ---------------------------
+
+SEARCH_TOKEN_MIGRATION_BATCH_SIZE = 1000
+
+# Number of objects matching a search, cached per (username, search filter, search string) for a short time
+SEARCH_COUNT_CACHE_TTL = 30
+SEARCH_COUNT_CACHE_MAX_SIZE = 10000
+search_count_cache = {}
+
+
+def create_search_token_query(search_string: str) -> List[dict]:
+    """
+    Creates the query to find objects matching a search string. An object matches if, for every word in the search
+    string, one of its search tokens starts with that word. Anchored regular expressions use the multikey index.
+    Punctuation in the search string separates words, so only letters and digits reach the regular expressions.
+
+    :param search_string: String entered by the user
+    :return: List of query expressions that must all match
+    """
+    return [{'search_tokens': {'$regex': '^' + re.escape(token)}} for token in create_search_tokens(search_string)]
+
+
+def migrate_search_tokens_db():
+    """
+    Creates the search tokens of objects that were added before the current SEARCH_TOKEN_VERSION. Only objects with an
+    older or missing 'search_tokens_version' are updated, so this may be run on every startup. Tokens are added to the
+    existing tokens, which keeps the tokens that workers add concurrently and the tokens of frame results of videos.
+
+    Objects are read in _id order, continuing after the last object of the previous batch, so the collection is
+    scanned once in total instead of once per batch.
+    """
+    projection = {'_id': 1, 'models': 1, 'file_names': 1}
+    last_id = None
+
+    while True:
+        query = {'search_tokens_version': {'$ne': SEARCH_TOKEN_VERSION}}
+        if last_id is not None:
+            query['_id'] = {'$gt': last_id}
+        batch = list(
+            object_collection.find(query, projection).sort('_id', ASCENDING).limit(SEARCH_TOKEN_MIGRATION_BATCH_SIZE)
+        )
+        if not batch:
+            break
+        last_id = batch[-1]['_id']
+
+        object_collection.bulk_write([
+            UpdateOne({'_id': obj['_id']}, {
+                '$addToSet': {'search_tokens': {'$each': create_search_tokens(
+                    list(obj.get('models', {})), list(obj.get('models', {}).values()), obj.get('file_names', [])
+                )}},
+                '$set': {'search_tokens_version': SEARCH_TOKEN_VERSION}
+            })
+            for obj in batch
+        ], ordered=False)
+        logger.debug('Created search tokens for ' + str(len(batch)) + ' objects')
 
 
 # ---------------------------
@@ -24,11 +132,9 @@ def add_user_db(user: User) -> bool:
     if user.roles is None:
         roles = []
 
-    if not user_collection.find_one({"username": user.username}):
-        user_collection.insert_one(user.dict())
-        return True
-
-    return False  # This means there is already a user in the database with this name.
+    # Insert the user only if the username is not taken. upserted_id is None when a user with this name exists.
+    result = user_collection.update_one({"username": user.username}, {'$setOnInsert': user.dict()}, upsert=True)
+    return result.upserted_id is not None
 
 
 def get_user_by_name_db(username: str) -> Union[User, None]:
@@ -38,10 +144,10 @@ def get_user_by_name_db(username: str) -> Union[User, None]:
     :param username: username of user
     :return: User object if user with given username exists, else None
     """
-    if not user_collection.find_one({"username": username}):
+    database_result = user_collection.find_one({"username": username})
+    if not database_result:
         return None
 
-    database_result = user_collection.find_one({"username": username})
     user_object = User(**database_result)
     return user_object
 
@@ -54,11 +160,8 @@ def set_user_roles_db(username: str, updated_roles: list) -> bool:
     :param updated_roles: Array of roles that user will now have
     :return: Success: True or False
     """
-    if not user_collection.find_one({"username": username}):
-        return False
-
-    user_collection.update_one({'username': username}, {'$set': {'roles': updated_roles}})
-    return True
+    result = user_collection.update_one({'username': username}, {'$set': {'roles': updated_roles}})
+    return result.matched_count > 0
 
 
 # ---------------------------
@@ -73,8 +176,7 @@ def add_api_key_db(key: APIKeyData):
     :return: {'status': 'success'} if added, else {'status': 'failure'}
     """
 
-    if not api_key_collection.find_one({"key": key.key}):
-        api_key_collection.insert_one(key.dict())
+    api_key_collection.update_one({"key": key.key}, {'$setOnInsert': key.dict()}, upsert=True)
 
 
 def get_api_key_by_key_db(key: str) -> Union[APIKeyData, None]:
@@ -84,10 +186,10 @@ def get_api_key_by_key_db(key: str) -> Union[APIKeyData, None]:
     :param key: API key string to lookup
     :return: APIKeyData if key with given ID exists, else NoneType if no API key for a given key string exists.
     """
-    if not api_key_collection.find_one({"key": key}):
+    database_result = api_key_collection.find_one({"key": key})
+    if not database_result:
         return None
 
-    database_result = api_key_collection.find_one({"key": key})
     api_key_object = APIKeyData(**database_result)
     return api_key_object
 
@@ -99,9 +201,6 @@ def get_api_keys_by_user_db(user: User) -> List[APIKeyData]:
     :param user: User object to find API keys associated with it
     :return: List of APIKeyData for all keys associated with user. Returns [] if no keys found.
     """
-    if not api_key_collection.find_one({"user": user.username}):
-        return []
-
     database_results = list(api_key_collection.find({"user": user.username, 'enabled': True}))
     user_keys = [APIKeyData(**res) for res in database_results]
     return user_keys
@@ -115,11 +214,8 @@ def set_api_key_enabled_db(key: APIKeyData, enabled: bool) -> bool:
     :param enabled: Key will be enabled (True) or disabled (False)
     :return: Success: True or False
     """
-    if not api_key_collection.find_one({"key": key.key}):
-        return False
-
-    api_key_collection.update_one({'key': key.key}, {'$set': {'enabled': enabled}})
-    return True
+    result = api_key_collection.update_one({'key': key.key}, {'$set': {'enabled': enabled}})
+    return result.matched_count > 0
 
 
 
@@ -134,25 +230,69 @@ def add_object_db(obj: UniversalMLPredictionObject):
     :param obj: UniversalMLPredictionObject to add to database.
     """
 
-    if not object_collection.find_one({"hash_md5": obj.hash_md5}):
-        object_collection.insert_one(obj.dict())
+    new_object = obj.dict()
+    new_object['search_tokens_version'] = SEARCH_TOKEN_VERSION
+    object_collection.update_one({"hash_md5": obj.hash_md5}, {'$setOnInsert': new_object}, upsert=True)
+
+
+def upsert_object_db(obj: UniversalMLPredictionObject, username: str, filename: str):
+    """
+    Adds an uploaded object to the database in a single atomic operation. If no object with the same md5 hash exists,
+    it is created from obj. In both cases the uploading user and the file name are added to the object's lists
+    if they are not in them already.
+
+    :param obj: UniversalMLPredictionObject that was uploaded
+    :param username: Username of user who uploaded the object
+    :param filename: file name with extension that the object was uploaded under
+    """
+
+    upsert_objects_db([obj], username, {obj.hash_md5: [filename]})
+
+
+def upsert_objects_db(objects: List[UniversalMLPredictionObject], username: str, filenames: dict):
+    """
+    Adds a group of uploaded objects to the database with one bulk write. This behaves the same as calling
+    upsert_object_db for each object, but only makes a single round trip to the database.
+
+    :param objects: List of UniversalMLPredictionObject that were uploaded. Each md5 hash should only appear once.
+    :param username: Username of user who uploaded the objects
+    :param filenames: Dictionary of {hash_md5: [file names]} that each object was uploaded under
+    """
+    if not objects:
+        return
+
+    operations = []
+    for obj in objects:
+        new_object = obj.dict()
+        new_object.pop('users')
+        new_object.pop('file_names')
+        new_object.pop('search_tokens')
+        new_object['search_tokens_version'] = SEARCH_TOKEN_VERSION
+
+        operations.append(UpdateOne(
+            {"hash_md5": obj.hash_md5},
+            {
+                '$setOnInsert': new_object,
+                '$addToSet': {
+                    'users': username,
+                    'file_names': {'$each': list(filenames[obj.hash_md5])},
+                    'search_tokens': {'$each': create_search_tokens(filenames[obj.hash_md5])}
+                }
+            },
+            upsert=True
+        ))
+
+    object_collection.bulk_write(operations, ordered=False)
 
 
 def add_user_to_object(obj: UniversalMLPredictionObject, username: str):
     """
     Adds a user account to a UniversalMLPredictionObject record. This is used to track which users upload objects.
 
-    :param v: UniversalMLPredictionObject to update
+    :param obj: UniversalMLPredictionObject to update
     :param username: Username of user who is accessing object
     """
-    if object_collection.find_one({"hash_md5": obj.hash_md5}):
-        existing_users = list(object_collection.find_one({"hash_md5": obj.hash_md5})['users'])
-        if username not in existing_users:  # Only update if not in list already
-            existing_users.append(username)
-            object_collection.update_one(
-                {"hash_md5": obj.hash_md5},
-                {'$set': {'users': existing_users}}
-            )
+    object_collection.update_one({"hash_md5": obj.hash_md5}, {'$addToSet': {'users': username}})
 
 
 def add_filename_to_object(obj: UniversalMLPredictionObject, filename: str):
@@ -163,36 +303,100 @@ def add_filename_to_object(obj: UniversalMLPredictionObject, filename: str):
     :param obj: UniversalMLPredictionObject to update
     :param filename: file name with extension
     """
-    if object_collection.find_one({"hash_md5": obj.hash_md5}):
-        current_names = list(object_collection.find_one({"hash_md5": obj.hash_md5})['file_names'])
-        if filename not in current_names:  # Only update if not in list already
-            current_names.append(filename)
-            object_collection.update_one(
-                {"hash_md5": obj.hash_md5},
-                {'$set': {'file_names': current_names}}
-            )
+    object_collection.update_one({"hash_md5": obj.hash_md5}, {'$addToSet': {'file_names': filename}})
 
 
 def add_model_to_object_db(obj: UniversalMLPredictionObject, model_name, result):
     """
     Adds prediction data to a UniversalMLPredictionObject object. This is normally called when a prediction microservice
-    returns data to the server with the results of a prediction request. The 'metadata' field is always updated.
-    in this method as a string to enable easy querying of nested model results.
+    returns data to the server with the results of a prediction request. The search tokens of the model name and
+    results are added to the object so that it can be found by searching for them.
 
     :param obj: UniversalMLPredictionObject to add prediction data to
     :param model_name: Name of model that was run on the object.
     :param result: JSON results of the training
     """
 
-    new_metadata = [list(obj.dict()['models'].values()), model_name, result] + obj.file_names
-    metadata_str = json.dumps(new_metadata)
-    for char_to_replace in ['"', "'", "\\", '[', ']', '{', '}']:
-        metadata_str = metadata_str.replace(char_to_replace, '')
+    object_collection.update_one({'hash_md5': obj.hash_md5}, {
+        '$set': {'models.' + model_name: result},
+        '$addToSet': {'search_tokens': {'$each': create_search_tokens(model_name, result)}}
+    })
+
+
+def create_object_search_query(user: User, search_filter: dict = None, search_string: str = '') -> dict:
+    """
+    Creates the mongo query for the objects a user may see that match a search. If the user is an administrator, then
+    all objects in the server will be queried. Otherwise, only objects that contain the username will be included.
+
+    :param user: User that is searching
+    :param search_filter Optional filter to narrow down query
+    :param search_string String whose words will be matched against the object search tokens
+    :return: Query for object_collection
+    """
+
+    # List comprehension to take the inputted filter and make it into a pymongo query-compatible expression
+    search_params = []
+    if search_filter:  # Append search filter
+        flat_model_filter = (
+            [{'models.' + model + '.' + str(model_class): {'$gt': 0}} for model in search_filter for model_class in
+                search_filter[model]])
+        search_params.append({'$or': flat_model_filter})
+    if search_string:  # Append search string
+        search_params.extend(create_search_token_query(search_string))
+    if Roles.admin.name not in user.roles:  # Add username to limit results if not admin
+        search_params.append({'users': user.username})
+
+    if not search_params:
+        return {}
+    if len(search_params) == 1:
+        return search_params[0]
+    return {'$and': search_params}
+
+
+def count_objects_db(query: dict, cache_key: tuple = None) -> int:
+    """
+    Counts the objects matching a query. Counting every matching document is as expensive as the query itself, so
+    counts are cached for SEARCH_COUNT_CACHE_TTL seconds when a cache_key is provided. Counts of the whole
+    collection are read from the collection metadata instead.
+
+    :param query: Query for object_collection
+    :param cache_key: Optional hashable key identifying the query, such as (username, filter, search string)
+    :return: Number of matching objects
+    """
+    if not query:
+        return object_collection.estimated_document_count()
 
-    object_collection.update_one({'hash_md5': obj.hash_md5}, {'$set': {
-        'models.' + model_name: result,
-        'metadata': metadata_str
-    }})
+    if cache_key is not None:
+        cached = search_count_cache.get(cache_key)
+        if cached and cached[1] > time.monotonic():
+            return cached[0]
+
+    num_objects = object_collection.count_documents(query)
+
+    if cache_key is not None:
+        if len(search_count_cache) >= SEARCH_COUNT_CACHE_MAX_SIZE:
+            search_count_cache.clear()
+        search_count_cache[cache_key] = (num_objects, time.monotonic() + SEARCH_COUNT_CACHE_TTL)
+    return num_objects
+
+
+def encode_search_cursor(object_id: ObjectId) -> str:
+    """
+    Creates the opaque cursor returned to clients from the _id of the last object on a page.
+    """
+    return base64.urlsafe_b64encode(object_id.binary).decode()
+
+
+def decode_search_cursor(cursor: str) -> Union[ObjectId, None]:
+    """
+    Reads the _id of the last object on a page from a cursor created by encode_search_cursor.
+
+    :return: ObjectId, or None if the cursor is invalid
+    """
+    try:
+        return ObjectId(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError, InvalidId):
+        return None
 
 
 def get_objects_from_user_db(
@@ -200,7 +404,9 @@ def get_objects_from_user_db(
         page: int = -1,
         search_filter: dict = None,
         search_string: str = '',
-        paginate: bool = True
+        paginate: bool = True,
+        cursor: str = None,
+        include_count: bool = True
 ):
     """
     Returns a list of object hashes associated with a username. This method also has pagination support and if a page
@@ -208,14 +414,20 @@ def get_objects_from_user_db(
     in this request is an administrator, then all object in the server will be queried. Otherwise, only UniversalMLPredictionObject
     objects that contain the username will be included in the results.
 
+    Pages may also be requested with a cursor instead of a page number. Cursor pages are found with a range query on
+    _id, so every page is as fast as the first one. An empty cursor returns the first page, and each result contains
+    the 'next_cursor' to request the following page, or None if there are no more results.
+
     This method also has unique functionality to allow for filtering of object results. If these values are provided,
     the mongo query will be filtered based on the fields available in search_filter and search_string.
 
     :param username: Username of user to get objects for
     :param page: Page to return of results. Will return all objects if page is -1
     :param search_filter Optional filter to narrow down query
-    :param search_string String that will be matched against object metadata
+    :param search_string String whose words will be matched against the object search tokens
     :param paginate Return all results or only page
+    :param cursor Optional cursor of page to return. If provided, page is ignored
+    :param include_count Whether the number of matching objects is counted
     :return: Dictionary of object hashes, total pages
     """
 
@@ -223,49 +435,45 @@ def get_objects_from_user_db(
 
     user = get_user_by_name_db(username)
     if not user:  # If user does not exist, return empty
-        return [], 0
-
-    # If there is a filter, start with the correct dataset that has been filtered already
-    # Generate the result of the query in this step
-    if search_filter or search_string:
-        # List comprehension to take the inputted filter and make it into a pymongo query-compatible expression
-        search_params = []
-        if search_filter:  # Append search filter
-            flat_model_filter = (
-                [{'models.' + model + '.' + str(model_class): {'$gt': 0}} for model in search_filter for model_class in
-                    search_filter[model]])
-            search_params.append({'$or': flat_model_filter})
-        if search_string:  # Append search string
-            search_params.append({"metadata": {'$regex': search_string, '$options': 'i'}})
-        if Roles.admin.name not in user.roles:  # Add username to limit results if not admin
-            search_params.append({'users': username})
-
-        result = object_collection.find({'$and': search_params}, {"hash_md5"})
-    else:
-        if Roles.admin.name in user.roles:
-            result = object_collection.find({}, {"hash_md5"})
-        else:
-            result = object_collection.find({'users': username}, {"hash_md5"})
+        return {"hashes": [], "num_objects": 0, "num_pages": 0, "next_cursor": None}
 
-    # If we are getting a specific page of objects, then generate the list of hashes
+    # Generate the query from the filter and search string
+    query = create_object_search_query(user, search_filter, search_string)
+
+    return_value = {}
     final_hash_list = []
-    if page > 0 and paginate:
+    if cursor is not None:
+        # Objects are returned in _id order, starting after the last object of the previous page
+        page_query = {'$and': [query, {'_id': {'$gt': decode_search_cursor(cursor)}}]} if cursor else query
+        page_objects = list(
+            object_collection.find(page_query, {"hash_md5": 1}).sort('_id', ASCENDING).limit(PAGINATION_PAGE_SIZE + 1)
+        )
+
+        final_hash_list = [object_map['hash_md5'] for object_map in page_objects[:PAGINATION_PAGE_SIZE]]
+        has_next_page = len(page_objects) > PAGINATION_PAGE_SIZE
+        return_value["next_cursor"] = encode_search_cursor(page_objects[PAGINATION_PAGE_SIZE - 1]['_id']) \
+            if has_next_page else None
+
+    # If we are getting a specific page of objects, then generate the list of hashes
+    elif page > 0 and paginate:
         # We use this for actual db queries. Page 1 = index 0
         page_index = page - 1
-        final_hash_list = result.skip(PAGINATION_PAGE_SIZE * page_index).limit(PAGINATION_PAGE_SIZE)
+        final_hash_list = object_collection.find(query, {"hash_md5"})\
+            .skip(PAGINATION_PAGE_SIZE * page_index).limit(PAGINATION_PAGE_SIZE)
 
         # After query, convert the result to a list
         final_hash_list = [object_map['hash_md5'] for object_map in list(final_hash_list)]
     elif not paginate:  # Return all results
-        final_hash_list = [object_map['hash_md5'] for object_map in list(result)]
+        final_hash_list = [object_map['hash_md5'] for object_map in object_collection.find(query, {"hash_md5"})]
 
-    num_objects = result.count()
-    return_value = {
-        "hashes": final_hash_list,
-        "num_objects": num_objects
-    }
-    if paginate:
-        return_value["num_pages"] = math.ceil(num_objects / PAGINATION_PAGE_SIZE)
+    return_value["hashes"] = final_hash_list
+
+    if include_count:
+        cache_key = (username, json.dumps(search_filter, sort_keys=True), search_string)
+        num_objects = count_objects_db(query, cache_key)
+        return_value["num_objects"] = num_objects
+        if paginate:
+            return_value["num_pages"] = math.ceil(num_objects / PAGINATION_PAGE_SIZE)
 
     return return_value
 
@@ -285,14 +493,14 @@ def get_models_from_object_db(obj: UniversalMLPredictionObject, model_name: str
         "models": 1
     }
 
-    if not object_collection.find_one({"hash_md5": obj.hash_md5}):
+    results = object_collection.find_one({"hash_md5": obj.hash_md5}, projection)
+    if not results:
         return {}
 
     if model_name != "":
-        results = object_collection.find_one({"hash_md5": obj.hash_md5}, projection)
         return {model_name: results['models'][model_name]}
     else:
-        return object_collection.find_one({"hash_md5": obj.hash_md5}, projection)['models']
+        return results['models']
 
 
 def get_object_by_md5_hash_db(object_hash) -> Union[UniversalMLPredictionObject, None]:
@@ -302,18 +510,81 @@ def get_object_by_md5_hash_db(object_hash) -> Union[UniversalMLPredictionObject,
     :param object_hash: md5 hash of object to search for
     :return: UniversalMLPredictionObject object of object with a md5 hash, or None if not found
     """
-    if not object_collection.find_one({"hash_md5": object_hash}):
+    result = object_collection.find_one({"hash_md5": object_hash}, {'_id': 0, 'timeline': 0})
+    if not result:
         return None
 
-    result = object_collection.find_one({"hash_md5": object_hash})
-    result.pop('_id')
-        
+    if result['type'] == 'video':
+        result['timeline'] = get_timelines_db([object_hash]).get(object_hash, {})
     return UniversalMLPredictionObject(**result)
 
 
+def get_objects_by_md5_hashes_db(object_hashes: List[str]) -> dict:
+    """
+    Locates a group of objects by their md5 hashes with a single query.
+
+    :param object_hashes: md5 hashes of objects to search for
+    :return: Dictionary of {hash_md5: UniversalMLPredictionObject} for every hash that was found
+    """
+    results = list(object_collection.find({"hash_md5": {'$in': list(object_hashes)}}, {'_id': 0, 'timeline': 0}))
+
+    timelines = get_timelines_db([result['hash_md5'] for result in results if result['type'] == 'video'])
+    for result in results:
+        if result['type'] == 'video':
+            result['timeline'] = timelines.get(result['hash_md5'], {})
+    return {result['hash_md5']: UniversalMLPredictionObject(**result) for result in results}
+
+
+def get_timelines_db(video_hashes: List[str]) -> dict:
+    """
+    Reads the results of image models on the frames of a group of videos. Workers store every frame result as its own
+    document, so a video with many frames never grows past the document size limit, and the results are sorted here
+    by the index on (video_hash, model_name, timestamp) instead of on every write.
+
+    :param video_hashes: md5 hashes of videos
+    :return: Dictionary of {video hash_md5: {model_name: [{timestamp, hash_md5, result}]}} for videos with results
+    """
+    if not video_hashes:
+        return {}
+
+    timelines = {}
+    results = frame_result_collection.find({'video_hash': {'$in': list(video_hashes)}}, {'_id': 0}) \
+        .sort([('video_hash', ASCENDING), ('model_name', ASCENDING), ('timestamp', ASCENDING)])
+    for result in results:
+        timelines.setdefault(result['video_hash'], {}).setdefault(result['model_name'], []).append({
+            'timestamp': result['timestamp'],
+            'hash_md5': result['hash_md5'],
+            'result': result['result']
+        })
+    return timelines
+
+
+def update_list_field_of_objects(hashes_md5: [str], field: str, remove_values: [str], new_values: [str],
+                                 extra_filter: dict = None):
+    """
+    Adds and removes values from a list field on a group of objects. Updates are done with $pull and $addToSet so
+    that concurrent updates to the same object can not overwrite each other. Values that are in both remove_values and
+    new_values are kept on the object.
+
+    :param hashes_md5: list of md5 hashes of objects to update
+    :param field: name of the list field to update
+    :param remove_values: values to remove from the field
+    :param new_values: values to add to the field
+    :param extra_filter: Optional query that each updated object must also match
+    """
+    query = {'hash_md5': {'$in': list(hashes_md5)}, **(extra_filter or {})}
+
+    values_to_remove = [value for value in remove_values if value not in new_values]
+    if values_to_remove:
+        object_collection.update_many(query, {'$pull': {field: {'$in': values_to_remove}}})
+    if new_values:
+        object_collection.update_many(query, {'$addToSet': {field: {'$each': list(new_values)}}})
+
+
 def update_tags_to_object(hashes_md5: [str], username: str, remove_tags: [str], new_tags: [str]):
     """
-    This method recieves two tags, where user can choose an tag and update it into a new tag
+    Adds and removes tags on a list of objects. A user may only change the tags of an object if one of their roles
+    is in the object's user_role_able_to_tag field.
 
     param:
         username: user that is updating the tags
@@ -324,27 +595,33 @@ def update_tags_to_object(hashes_md5: [str], username: str, remove_tags: [str],
     return:
         always return a list with status message in it
     """
-    result = []
     user = get_user_by_name_db(username)
-    if user:
-        roles = user.roles
-        for hash_md5 in hashes_md5:
-            if get_object_by_md5_hash_db(hash_md5):
-                object = get_object_by_md5_hash_db(hash_md5)
-                authed_roles = object['user_role_able_to_tag']
-                if set(roles) & set(authed_roles): # update tags here
-                    image_collection.update_one(
-                    {"hash_md5": hash_md5},
-                    {'$set': {'tags': list(new_tags)}}
-                    )
-                    result.append({'status': 'success', 'detail': hash_md5 + ' updated tags'})
-                else:
-                    result.append({'status': 'failure', 'detail': hash_md5 + ' not authorized'})
-            else: # if object not found
-                result.append({'status': 'failure', 'detail': hash_md5 + ' not found'})
-        return result
-    return [{'status': 'failure', 'detail': 'User does not exist'}]
-   
+    if not user:
+        return [{'status': 'failure', 'detail': 'User does not exist'}]
+
+    # Find which objects exist and which of them the user may tag in one query
+    existing_objects = {
+        obj['hash_md5']: obj.get('user_role_able_to_tag', [])
+        for obj in object_collection.find({'hash_md5': {'$in': list(hashes_md5)}},
+                                          {'_id': 0, 'hash_md5': 1, 'user_role_able_to_tag': 1})
+    }
+
+    result = []
+    authorized_hashes = []
+    for hash_md5 in hashes_md5:
+        if hash_md5 not in existing_objects:
+            result.append({'status': 'failure', 'detail': hash_md5 + ' not found'})
+        elif set(user.roles) & set(existing_objects[hash_md5]):
+            authorized_hashes.append(hash_md5)
+            result.append({'status': 'success', 'detail': hash_md5 + ' updated tags'})
+        else:
+            result.append({'status': 'failure', 'detail': hash_md5 + ' not authorized'})
+
+    if authorized_hashes:
+        update_list_field_of_objects(authorized_hashes, 'tags', remove_tags, new_tags,
+                                     extra_filter={'user_role_able_to_tag': {'$in': user.roles}})
+    return result
+
 
 # TODO: Current any roles can change the user_role_able_to_tag field under object object, change the following mark line to limit access
 def update_role_to_tag_object(hashes_md5: [str], username: str, remove_roles: [str], new_roles: [str]):
@@ -358,26 +635,25 @@ def update_role_to_tag_object(hashes_md5: [str], username: str, remove_roles: [s
         remove_roles: list of roles needs to be remove from objects, default []
         new_roles: list of roles needs to be added to objects, default []
     """
-    result = []
     user = get_user_by_name_db(username)
-    if user:
-        if set(user.roles) & {"admin", "investigator", "researcher"}: # currently all roles can access this function
-            for hash_md5 in hashes_md5:
-                if get_object_by_md5_hash_db(hash_md5):
-                    role_obj = get_object_by_md5_hash_db(hash_md5)
-                    current_authed_role = role_obj['user_role_able_to_tag']
-                    current_authed_role = list(set(current_authed_role) - set(remove_roles) - set(new_roles))
-                    current_authed_role = current_authed_role + new_roles
-                    role_obj.update_one(
-                        {"hash_md5": hash_md5},
-                        {'$set': {'user_role_able_to_tag': list(current_authed_role)}}
-                    )
-                    result.append({'status': 'success', 'detail': hash_md5 + ' updated tag roles'})
-                else:
-                    result.append({'status': 'failure', 'detail': hash_md5 + ' not found'})
-            return result
+    if not user:
+        return [{'status': 'failure', 'detail': 'User does not exist'}]
+
+    if not set(user.roles) & {"admin", "investigator", "researcher"}:  # currently all roles can access this function
         return [{'status': 'failure', 'detail': username + ' not authorized'}]
-    return [{'status': 'failure', 'detail': 'User does not exist'}]
+
+    existing_hashes = set(object_collection.distinct('hash_md5', {'hash_md5': {'$in': list(hashes_md5)}}))
+
+    result = []
+    for hash_md5 in hashes_md5:
+        if hash_md5 in existing_hashes:
+            result.append({'status': 'success', 'detail': hash_md5 + ' updated tag roles'})
+        else:
+            result.append({'status': 'failure', 'detail': hash_md5 + ' not found'})
+
+    if existing_hashes:
+        update_list_field_of_objects(existing_hashes, 'user_role_able_to_tag', remove_roles, new_roles)
+    return result
 
 
 # ---------------------------
@@ -403,22 +679,17 @@ def get_models_db():
 
 
 def add_training_result_db(tr: TrainingResult):
-    if not training_collection.find_one({'training_id': tr.training_id}):
-        training_collection.insert_one(tr.dict())
+    training_collection.update_one({'training_id': tr.training_id}, {'$setOnInsert': tr.dict()}, upsert=True)
 
 
 def update_training_result_db(tr: TrainingResult):
-    if not training_collection.find_one({'training_id': tr.training_id}):
-        add_training_result_db(tr)
-    else:
-        training_collection.replace_one({'training_id': tr.training_id}, tr.dict())
+    training_collection.replace_one({'training_id': tr.training_id}, tr.dict(), upsert=True)
 
 
 def get_training_result_by_training_id(training_id: str):
-    if not training_collection.find_one({'training_id': training_id}):
-        return None
-
     res = training_collection.find_one({'training_id': training_id})
+    if not res:
+        return None
 
     return TrainingResult(**res)
 
@@ -449,12 +720,8 @@ def get_training_statistics_db(username: str = None):
     :param username: Optional username. If provided will only find jobs that a user has submitted.
     :return: 2-tuple of jobs pending, jobs finished
     """
-    if username is not None:
-        u = get_user_by_name_db(username)
-        finished = training_collection.find({'username': username, 'complete': True})
-        pending = training_collection.find({'username': username, 'complete': False})
-    else:
-        finished = training_collection.find({'complete': True})
-        pending = training_collection.find({'complete': False})
+    query = {'username': username} if username is not None else {}
+    finished = training_collection.count_documents({**query, 'complete': True})
+    pending = training_collection.count_documents({**query, 'complete': False})
 
-    return pending.count(), finished.count()
+    return pending, finished
@@ -11,6 +11,7 @@ from pymongo import MongoClient
 import os
 
 import redis as rd
+from redis import asyncio as aioredis
 
 logger = logging.getLogger("api")
 
@@ -19,6 +20,7 @@ pool = ThreadPoolExecutor(10)
 shutdown = False
 WAIT_TIME = 10
 redis = rd.Redis(host="redis", port=6379)
+async_redis = aioredis.Redis(host="redis", port=6379)  # Used by endpoints that wait on Redis, such as event streams
 
 # --------------------------------------------------------------------------------
 #                                  Database Objects
@@ -32,9 +34,38 @@ api_key_collection = database["api_key"]  # Create collection for API keys in da
 model_collection = database["models"]  # Create collection for models and their structures in database
 training_collection = database["training"]  # Create collection for training status and results
 object_collection = database["objects"]  # Create collection for objects in database
+frame_result_collection = database["frame_results"]  # Create collection for image model results on frames of videos
 
 PAGINATION_PAGE_SIZE = 15
 
+# Redis keys 'prediction_pending:<hash_md5>' count the prediction jobs of an object that have not finished yet. They
+# are incremented when jobs are enqueued and decremented by the prediction workers.
+PREDICTION_PENDING_KEY_PREFIX = 'prediction_pending:'
+PREDICTION_PENDING_KEY_TTL = 60 * 60 * 24  # Expire counters of jobs that were never run after one day
+
+# Prediction workers publish a message on the channel 'prediction_complete:<hash_md5>' when a job is finished
+PREDICTION_COMPLETE_CHANNEL_PREFIX = 'prediction_complete:'
+
+# Success and failure callback of prediction jobs, which decrements the pending counter of the object. Running it on
+# failure keeps jobs that raised, timed out or were abandoned by a stopped worker from staying pending until the
+# counter expires. Must match utility.main.finish_pending_job in the prediction workers.
+PREDICTION_JOB_CALLBACK = 'utility.main.finish_pending_job'
+
+# Videos that are uploaded with frame models are sent to this model, which extracts frames from them and enqueues the
+# frames on the frame models. Must match model_name in prediction/models/VideoFramesMicroservice/config.py
+VIDEO_FRAMES_MODEL = 'video_frames'
+VIDEO_FRAMES_JOB_TIMEOUT = 60 * 60 * 6  # Frame extraction reads the whole video, which may be hours long
+
+# Interactive prediction jobs are enqueued on the queue named after the model, and bulk jobs on a queue of each user,
+# '<model_name>:bulk:<username>'. Workers take interactive jobs first, and take bulk jobs from each user in turn. The
+# users with bulk queues of a model are stored in the Redis set 'prediction_bulk_users:<model_name>'.
+PREDICTION_BULK_QUEUE_INFIX = ':bulk:'
+PREDICTION_BULK_USERS_KEY_PREFIX = 'prediction_bulk_users:'
+
+# Uploads of at most this many objects are interactive unless bulk priority is requested. Larger uploads are bulk, and
+# only administrators may request interactive priority for them.
+PREDICTION_INTERACTIVE_MAX_OBJECTS = int(os.getenv('PREDICTION_INTERACTIVE_MAX_OBJECTS', default=20))
+
 
 # --------------------------------------------------------------------------------
 #                                  Model Prediction Objects
@@ -62,6 +93,14 @@ class AvailableTypes(Enum):
     audio = 'audio'
 
 
+class PredictionPriority(Enum):
+    """
+    Scheduling lanes of prediction jobs. Interactive jobs are predicted before any bulk jobs.
+    """
+    interactive = 'interactive'
+    bulk = 'bulk'
+
+
 class UniversalMLPredictionObject(BaseModel):
     """
     Object that is used to store all data associated with a video model prediction request.
@@ -71,11 +110,15 @@ class UniversalMLPredictionObject(BaseModel):
     hash_md5: str  # Video md5 hash
     type: AvailableTypes
     users: list = []  # All users who have uploaded the video
-    metadata: str = ""  # All video information stored as a string
+    metadata: str = ""  # No longer updated, objects are searched by search_tokens
+    search_tokens: list = []  # Normalized words from file names and model results, used for searching
     models: dict = {}  # ML Model results
+    model_details: dict = {}  # Optional details of ML Model results, which are not searched. {model_name: details}
     text_content: Optional[str] = '' # Store text for text models
     tags: list = []  # Allow certified user to add tags when video is being uploaded
     user_role_able_to_tag: list = []  # list of users allowed to add and remove tags
+    timeline: dict = {}  # Image model results on frames of a video, {model_name: [{timestamp, hash_md5, result}]}.
+    # Read from frame_result_collection, and not stored on the object.
 
 
 class MicroserviceConnection(BaseModel):
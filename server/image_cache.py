@@ -0,0 +1,73 @@
+import os
+import uuid
+
+import numpy as np
+from PIL import Image
+
+from dependency import logger
+
+# When enabled, uploaded images are decoded once by the server, and the RGB raster is stored next to the original as
+# a memory-mappable .npy file together with reduced versions of it. Image models load these rasters through
+# utility.image_cache.load_image_array() instead of each decoding the original file.
+PREDECODE_IMAGES = os.getenv('PREDECODE_IMAGES', default='0') == '1'
+
+# Longest side of the reduced rasters that are stored in addition to the full resolution raster. Reduced rasters are
+# only stored for images that are larger than the size. Must match IMAGE_CACHE_SIZES in
+# prediction_worker/utility/image_cache.py
+IMAGE_CACHE_SIZES = (1024, 512)
+
+
+def image_cache_path(object_path: str, max_side: int = 0) -> str:
+    """
+    Returns the path of a decoded raster of an object. Must match image_cache_path() in
+    prediction_worker/utility/image_cache.py
+
+    :param object_path: Path of the original object
+    :param max_side: Longest side of the reduced raster, or 0 for the full resolution raster
+    :return: Path of the .npy file
+    """
+    base_path = os.path.splitext(object_path)[0]
+    if max_side:
+        return base_path + '.rgb_' + str(max_side) + '.npy'
+    return base_path + '.rgb.npy'
+
+
+def save_array(array: np.ndarray, path: str):
+    """
+    Saves an array as a .npy file. The file is written under a temporary name first, so workers never read a
+    partially written file.
+    """
+    temporary_path = path + '.' + str(uuid.uuid4())
+    with open(temporary_path, 'wb') as array_file:
+        np.save(array_file, array)
+    os.replace(temporary_path, path)
+
+
+def write_image_cache(object_path: str) -> bool:
+    """
+    Decodes an uploaded image and stores its RGB raster and reduced versions of it next to the original. The full
+    resolution raster is written last, so that workers can use its presence to know that the reduced rasters exist.
+
+    :param object_path: Path of the original object
+    :return: True if the rasters exist, False if the object is not an image that can be decoded
+    """
+    if os.path.exists(image_cache_path(object_path)):
+        return True  # Object was uploaded before
+
+    try:
+        with Image.open(object_path) as image:
+            image = image.convert('RGB')
+    except (OSError, Image.DecompressionBombError) as e:
+        logger.debug('[Image Cache] Could not decode [' + object_path + ']: ' + str(e))
+        return False
+
+    # Each reduced raster is created from the next larger one
+    reduced_image = image
+    for max_side in sorted(IMAGE_CACHE_SIZES, reverse=True):
+        if max(image.size) > max_side:
+            reduced_image = reduced_image.copy()
+            reduced_image.thumbnail((max_side, max_side), Image.BILINEAR)
+            save_array(np.asarray(reduced_image), image_cache_path(object_path, max_side))
+
+    save_array(np.asarray(image), image_cache_path(object_path))
+    return True
@@ -12,6 +12,7 @@ from starlette import status
 from starlette.responses import JSONResponse
 
 from dependency import CredentialException, pool
+from db_connection import create_indexes_db, migrate_search_tokens_db
 from routers.auth import auth_router
 from routers.prediction import model_router
 from routers.training import training_router
@@ -151,9 +152,12 @@ def delete_unused_files():
 @app.on_event('startup')
 def on_startup():
     """
-    On server startup, schedule
-    """ 
+    On server startup, ensure that all database indexes exist, create search tokens for objects with tokens of an
+    older version and schedule the file deletion thread
+    """
 
+    create_indexes_db()
+    pool.submit(migrate_search_tokens_db)
     pool.submit(delete_unused_files) 
 
 
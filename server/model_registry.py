@@ -0,0 +1,75 @@
+import threading
+import time
+
+from rq import Worker
+
+from dependency import redis
+
+# Number of seconds that the list of connected models is reused before it is read from Redis again
+MODEL_REGISTRY_TTL = 5
+
+
+class ModelRegistry:
+    """
+    In-process cache of the prediction models that are connected to the server. Prediction workers register in Redis
+    with a name of the format 'prediction;<model_type>;<model_name>;<model_tags>;<worker_id>', so the connected models
+    can be found from the registered worker names. Workers that host several models repeat the type, name and tags
+    for each model before the worker id.
+
+    Reading every worker with Worker.all() is one Redis round trip per worker. Instead, the registry reads the set of
+    registered worker keys and checks which of those keys still exist (rq removes the key of a worker that stops
+    sending heartbeats), which is two round trips regardless of the number of workers. The result is cached for
+    MODEL_REGISTRY_TTL seconds.
+    """
+
+    def __init__(self, connection, ttl: float = MODEL_REGISTRY_TTL):
+        self.connection = connection
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.models = {}  # {model_name: {'type': model_type, 'tags': model_tags}}
+        self.last_refresh = None
+
+    def get_models(self) -> dict:
+        """
+        Returns all connected prediction models, reading them from Redis if the cached value has expired.
+
+        :return: Dictionary of {model_name: {'type': model_type, 'tags': model_tags}}
+        """
+        with self.lock:
+            if self.last_refresh is None or time.monotonic() - self.last_refresh > self.ttl:
+                self.models = self.read_models()
+                self.last_refresh = time.monotonic()
+            return self.models
+
+    def invalidate(self):
+        """
+        Forces the next call to get_models() to read the connected models from Redis.
+        """
+        with self.lock:
+            self.last_refresh = None
+
+    def read_models(self) -> dict:
+        worker_keys = [
+            key.decode() if isinstance(key, bytes) else key
+            for key in self.connection.smembers(Worker.redis_workers_keys)
+        ]
+
+        # Only include workers whose key has not expired
+        with self.connection.pipeline() as pipe:
+            for key in worker_keys:
+                pipe.exists(key)
+            alive = pipe.execute()
+
+        models = {}
+        for key, is_alive in zip(worker_keys, alive):
+            if not is_alive:
+                continue
+            worker_data = key[len(Worker.redis_worker_namespace_prefix):].split(';')
+            if worker_data[0] != 'prediction':
+                continue
+            for i in range(1, len(worker_data) - 2, 3):
+                models[worker_data[i + 1]] = {'type': worker_data[i], 'tags': worker_data[i + 2]}
+        return models
+
+
+model_registry = ModelRegistry(redis)
@@ -0,0 +1,94 @@
+import asyncio
+import json
+from typing import List
+
+from dependency import async_redis, logger, PREDICTION_COMPLETE_CHANNEL_PREFIX
+
+
+class PredictionEventBroker:
+    """
+    Forwards prediction completion messages published by the prediction workers to the clients that are waiting for
+    them. The server holds a single Redis subscription to every completion channel, regardless of the number of
+    connected clients, and each client receives messages for the object hashes it subscribed to on its own queue.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.subscribers = {}  # {hash_md5: set of asyncio.Queue}
+        self.listener = None
+        self.subscribed = None  # asyncio.Event that is set once Redis confirmed the subscription of the listener
+
+    def subscribe(self, md5_hashes: List[str]) -> asyncio.Queue:
+        """
+        Registers a new subscriber for a list of object hashes. Must be called from the server's event loop.
+
+        :param md5_hashes: Hashes of objects to receive completion messages for
+        :return: Queue that will receive a dict for every completed prediction job of the objects
+        """
+        queue = asyncio.Queue()
+        for md5_hash in md5_hashes:
+            self.subscribers.setdefault(md5_hash, set()).add(queue)
+
+        self.ensure_listening()
+        return queue
+
+    def ensure_listening(self):
+        """
+        Starts listening to Redis on the first subscription, or if the connection was lost.
+        """
+        if self.listener is None or self.listener.done():
+            self.subscribed = asyncio.Event()
+            self.listener = asyncio.ensure_future(self.listen(self.subscribed))
+
+    async def wait_until_subscribed(self, timeout: float) -> bool:
+        """
+        Waits until Redis confirmed the subscription to the completion channels, after which no message published by
+        a worker is missed. Starts listening if the broker is not listening yet.
+
+        :param timeout: Seconds to wait for the confirmation
+        :return: True if the subscription was confirmed, False if it timed out or the listener stopped before
+        """
+        self.ensure_listening()
+        listener = self.listener
+        try:
+            await asyncio.wait_for(asyncio.shield(self.subscribed.wait()), timeout=timeout)
+        except asyncio.TimeoutError:
+            return False
+        return not listener.done()
+
+    def unsubscribe(self, queue: asyncio.Queue, md5_hashes: List[str]):
+        """
+        Removes a subscriber that was created with subscribe().
+
+        :param queue: Queue returned by subscribe()
+        :param md5_hashes: Hashes that were passed to subscribe()
+        """
+        for md5_hash in md5_hashes:
+            queues = self.subscribers.get(md5_hash)
+            if queues is None:
+                continue
+            queues.discard(queue)
+            if not queues:
+                del self.subscribers[md5_hash]
+
+    async def listen(self, subscribed: asyncio.Event):
+        pubsub = self.connection.pubsub()
+        try:
+            await pubsub.psubscribe(PREDICTION_COMPLETE_CHANNEL_PREFIX + '*')
+            async for message in pubsub.listen():
+                if message['type'] == 'psubscribe':
+                    subscribed.set()  # Redis sends the confirmation once messages are delivered to this connection
+                if message['type'] != 'pmessage':
+                    continue
+
+                event = json.loads(message['data'])
+                for queue in self.subscribers.get(event['hash_md5'], ()):
+                    queue.put_nowait(event)
+        except Exception as e:
+            logger.error('Prediction event listener stopped: ' + str(e))
+        finally:
+            subscribed.set()  # Release the waiters of a listener that stopped, which read the pending counts instead
+            await pubsub.reset()
+
+
+prediction_event_broker = PredictionEventBroker(async_redis)
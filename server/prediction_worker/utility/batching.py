@@ -0,0 +1,87 @@
+import os
+import time
+
+from rq.exceptions import NoSuchJobError
+from rq.job import Job, JobStatus
+from rq.registry import StartedJobRegistry
+
+from utility.main import predict_objects_batch, supports_batch_prediction
+from utility.models import job_model
+from utility.scheduling import LaneWorker
+
+# Maximum number of queued jobs that will be predicted together in one predict_batch() call. Workers that host several
+# models may set it per model with PREDICTION_BATCH_SIZE_<MODEL_NAME>, such as PREDICTION_BATCH_SIZE_IMAGE_SHAPE.
+BATCH_SIZE = int(os.getenv('PREDICTION_BATCH_SIZE', default=8))
+
+# Maximum number of seconds to wait for more jobs to arrive before predicting on a partial batch
+BATCH_WAIT_TIME = float(os.getenv('PREDICTION_BATCH_WAIT', default=0.5))
+
+# Delay between polls of the queue while a batch is being filled
+BATCH_POLL_INTERVAL = 0.05
+
+# Seconds added to the time that drained jobs are kept in the started registry. A drained job may wait for every other
+# job of its batch, so it is kept for the timeout of the whole batch and this margin. If the worker stops before the
+# job is performed, rq's registry cleanup moves the job to the failed registry after that time.
+STARTED_JOB_TTL_MARGIN = 60
+
+
+def model_batch_size(model_package):
+    """
+    Returns the number of jobs that are predicted together by a model, or 1 if the model does not define
+    predict_batch().
+    """
+    if not supports_batch_prediction(model_package):
+        return 1
+    return int(os.getenv('PREDICTION_BATCH_SIZE_' + model_package.name.upper(), default=BATCH_SIZE))
+
+
+class BatchWorker(LaneWorker):
+    """
+    LaneWorker that groups jobs for models that define predict_batch(). When a job is received, the worker drains
+    more jobs from the same queue up to the batch size of the model, waiting at most BATCH_WAIT_TIME seconds for them
+    to arrive. The model is then called once for the whole batch, and every job is performed through the normal rq path so that
+    job statuses and registries are the same as when jobs are predicted one at a time.
+    """
+
+    def execute_job(self, job, queue):
+        jobs = [job] + self.drain_queue(queue, model_batch_size(job_model(job)) - 1)
+
+        if len(jobs) > 1:
+            predict_objects_batch(jobs)
+
+        for batch_job in jobs:
+            super().execute_job(batch_job, queue)
+
+    def drain_queue(self, queue, max_jobs):
+        """
+        Removes up to max_jobs jobs from a queue and marks them as started so that they are still reported as
+        pending while the batch is being predicted.
+
+        :param queue: Queue to take jobs from
+        :param max_jobs: Maximum number of jobs to take
+        :return: List of rq Job objects
+        """
+        jobs = []
+        deadline = time.monotonic() + BATCH_WAIT_TIME
+        started_registry = StartedJobRegistry(queue.name, connection=self.connection)
+        batch_jobs = max_jobs + 1  # Including the job that started the batch
+
+        while len(jobs) < max_jobs:
+            job_id = queue.pop_job_id()
+            if job_id is None:
+                if time.monotonic() >= deadline:
+                    break
+                time.sleep(BATCH_POLL_INTERVAL)
+                continue
+
+            try:
+                job = Job.fetch(job_id, connection=self.connection)
+            except NoSuchJobError:
+                continue  # Job was deleted after being queued
+
+            job.set_status(JobStatus.STARTED)
+            job_timeout = job.timeout or queue.DEFAULT_TIMEOUT
+            started_registry.add(job, job_timeout * batch_jobs + STARTED_JOB_TTL_MARGIN)
+            jobs.append(job)
+
+        return jobs
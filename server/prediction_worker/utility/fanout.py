@@ -0,0 +1,153 @@
+import hashlib
+import io
+import os
+import uuid
+
+from PIL import Image
+from pymongo import UpdateOne
+from rq import Queue, get_current_job
+from rq.job import Callback
+
+from utility.main import database_object_collection, finish_pending_job, PREDICTION_PENDING_KEY_PREFIX
+from utility.scheduling import queue_bulk_user, PREDICTION_BULK_QUEUE_INFIX, PREDICTION_BULK_USERS_KEY_PREFIX
+from utility.search_tokens import SEARCH_TOKEN_VERSION
+from utility.video import sample_frames, KEYFRAME
+
+OBJECT_DIRECTORY = '/app/objects/'
+
+# Must match dependency.PREDICTION_PENDING_KEY_TTL on the server
+PREDICTION_PENDING_KEY_TTL = 60 * 60 * 24
+
+# Frames are sampled with utility.video.sample_frames() in this mode, at VIDEO_FRAMES_FPS in the fps and scene modes.
+# Frames closer than MIN_INTERVAL seconds to the previous extracted frame are skipped, which limits the number of
+# keyframes taken from videos with very short groups of pictures.
+MODE = os.getenv('VIDEO_FRAMES_MODE', default=KEYFRAME)
+FPS = float(os.getenv('VIDEO_FRAMES_FPS', default=1.0))
+MIN_INTERVAL = float(os.getenv('VIDEO_FRAMES_MIN_INTERVAL', default=1.0))
+
+# Frames are stored as JPEG images with their longest side reduced to at most MAX_SIDE pixels
+MAX_SIDE = int(os.getenv('VIDEO_FRAMES_MAX_SIDE', default=1280))
+JPEG_QUALITY = 90
+
+# Number of extracted frames that are enqueued on the frame models at once. Identical frames in the same group, such
+# as black frames between scenes, are predicted once.
+ENQUEUE_BATCH_SIZE = int(os.getenv('VIDEO_FRAMES_ENQUEUE_BATCH_SIZE', default=64))
+
+
+def store_frame(pixels):
+    """
+    Encodes a frame as a JPEG image and stores it in the object directory under the name <hash_md5>.jpg, in the same
+    way that the server stores uploaded objects.
+
+    :param pixels: RGB array of the frame
+    :return: 2-tuple of md5 hash, file name of the frame
+    """
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, 'JPEG', quality=JPEG_QUALITY)
+    data = buffer.getvalue()
+
+    hash_md5 = hashlib.md5(data).hexdigest()
+    file_name = hash_md5 + '.jpg'
+    if not os.path.exists(OBJECT_DIRECTORY + file_name):
+        # Write to a unique temporary name so that workers never read a partially written frame
+        temporary_path = OBJECT_DIRECTORY + 'frame_' + str(uuid.uuid4())
+        with open(temporary_path, 'wb') as frame_file:
+            frame_file.write(data)
+        os.replace(temporary_path, OBJECT_DIRECTORY + file_name)
+    return hash_md5, file_name
+
+
+def enqueue_frame_jobs(connection, video_hash, frames, frame_models, bulk_user=None):
+    """
+    Adds frames to the database and enqueues a prediction job for every frame on every frame model. The jobs are added
+    to the pending jobs of the video in the same pipeline, so that the video is pending until all frames are predicted.
+    Frames of videos that were uploaded in bulk are enqueued on the bulk queues of the same user.
+
+    Frames are stored as image objects without users, so they are only returned by the searches of administrators.
+    Their results are stored as frame results of the video by utility.main.create_prediction().
+
+    :param connection: Redis connection
+    :param video_hash: md5 hash of the video
+    :param frames: Dictionary of {frame hash_md5: (frame file name, [timestamps of the frame in the video])}
+    :param frame_models: List of image model names
+    :param bulk_user: Username whose bulk queues the jobs are enqueued on, or None to enqueue interactive jobs
+    """
+    database_object_collection.bulk_write([
+        UpdateOne({'hash_md5': frame_hash}, {'$setOnInsert': {
+            'file_names': [file_name],
+            'hash_md5': frame_hash,
+            'type': 'image',
+            'users': [],
+            'metadata': '',
+            'search_tokens': [],
+            'search_tokens_version': SEARCH_TOKEN_VERSION,
+            'models': {},
+            'model_details': {},
+            'text_content': '',
+            'tags': [],
+            'user_role_able_to_tag': ['admin']
+        }}, upsert=True)
+        for frame_hash, (file_name, _) in frames.items()
+    ], ordered=False)
+
+    with connection.pipeline() as pipe:
+        for model in frame_models:
+            queue_name = model
+            if bulk_user:
+                queue_name += PREDICTION_BULK_QUEUE_INFIX + bulk_user
+                pipe.sadd(PREDICTION_BULK_USERS_KEY_PREFIX + model, bulk_user)
+
+            job_data = [
+                Queue.prepare_data(
+                    'utility.main.predict_object',
+                    (frame_hash, file_name, {'hash_md5': video_hash, 'timestamps': timestamps}),
+                    job_id=frame_hash + model + str(uuid.uuid4()),
+                    on_success=Callback(finish_pending_job),
+                    on_failure=Callback(finish_pending_job)
+                )
+                for frame_hash, (file_name, timestamps) in frames.items()
+            ]
+            Queue(name=queue_name, connection=connection).enqueue_many(job_data, pipeline=pipe)
+
+        pending_key = PREDICTION_PENDING_KEY_PREFIX + video_hash
+        pipe.incrby(pending_key, len(frames) * len(frame_models))
+        pipe.expire(pending_key, PREDICTION_PENDING_KEY_TTL)
+        pipe.execute()
+
+
+def extract_video_frames(video_hash, video_file_name, frame_models):
+    """
+    Job function that is enqueued by the server for videos that are uploaded with frame models. Frames are extracted
+    as the video is decoded and enqueued on the frame models in groups of ENQUEUE_BATCH_SIZE, so the frame models start
+    predicting before the whole video is read. The job is marked as no longer pending for the video by its callbacks,
+    even if extraction failed.
+
+    :param video_hash: md5 hash of the video
+    :param video_file_name: File name of the video in the object directory
+    :param frame_models: List of image model names to run on the frames
+    """
+    job = get_current_job()
+    bulk_user = queue_bulk_user(job.origin)  # Frames are predicted in the same lane as the video
+    try:
+        frames = {}  # {frame hash_md5: (file name, [timestamps])}
+        frame_count = 0
+        previous_timestamp = None
+
+        for frame in sample_frames(OBJECT_DIRECTORY + video_file_name, mode=MODE, fps=FPS, max_side=MAX_SIDE):
+            if previous_timestamp is not None and frame.timestamp - previous_timestamp < MIN_INTERVAL:
+                continue
+            previous_timestamp = frame.timestamp
+
+            frame_hash, file_name = store_frame(frame.pixels)
+            frames.setdefault(frame_hash, (file_name, []))[1].append(frame.timestamp)
+            frame_count += 1
+            if frame_count == ENQUEUE_BATCH_SIZE:
+                enqueue_frame_jobs(job.connection, video_hash, frames, frame_models, bulk_user)
+                frames = {}
+                frame_count = 0
+
+        if frames:
+            enqueue_frame_jobs(job.connection, video_hash, frames, frame_models, bulk_user)
+    except Exception as e:
+        print(e)
+        print('[Error] Frame Extraction Crash. Hash:[' + video_hash + ']', flush=True)
@@ -0,0 +1,119 @@
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image
+
+OBJECT_DIRECTORY = '/app/objects/'
+
+# Must match image_cache.IMAGE_CACHE_SIZES on the server
+IMAGE_CACHE_SIZES = (1024, 512)
+
+# Number of decoded images that open_image() keeps in a worker that hosts several models (see utility.models). The
+# worker takes jobs from the queues of its models in turn, so the jobs of one object on each model run close together
+# and the image is decoded once for all of them.
+SHARED_IMAGE_COUNT = int(os.getenv('SHARED_IMAGE_COUNT', default=4))
+
+shared_images = OrderedDict()  # {object path: decoded PIL image}, from least to most recently used
+shared_images_lock = threading.Lock()  # Models such as the hash model open images on several threads
+share_images = False
+
+
+def enable_shared_images():
+    """
+    Shares the images decoded by open_image() and load_image_array() between the models of this worker.
+    """
+    global share_images
+    share_images = SHARED_IMAGE_COUNT > 0
+
+
+def decode_image(object_path, draft_size=0):
+    with open(object_path, 'rb') as image_file:
+        image = Image.open(image_file)
+        if draft_size:
+            # JPEG images can be decoded directly at a reduced size, which skips most of the decoding work
+            image.draft('RGB', (draft_size, draft_size))
+        image.load()
+    return image
+
+
+def open_image(file_name, draft_size=0):
+    """
+    Opens and decodes an image. In a worker that hosts several models, the decoded image is kept and shared by every
+    model that predicts on it, so it must not be modified in place. Shared images are always decoded at full
+    resolution, since other models may need it.
+
+    :param file_name: Name of the object in the objects directory, or path to an image file
+    :param draft_size: Size that JPEG images may be decoded at instead of their full size, or 0 for the full size
+    :return: Decoded PIL image
+    """
+    object_path = os.path.join(OBJECT_DIRECTORY, file_name)
+    if not share_images:
+        return decode_image(object_path, draft_size)
+
+    with shared_images_lock:
+        image = shared_images.get(object_path)
+        if image is not None:
+            shared_images.move_to_end(object_path)
+            return image
+
+    image = decode_image(object_path)
+    with shared_images_lock:
+        shared_images[object_path] = image
+        while len(shared_images) > SHARED_IMAGE_COUNT:
+            shared_images.popitem(last=False)
+    return image
+
+
+def image_cache_path(object_path, max_side=0):
+    """
+    Returns the path of a decoded raster of an object in the same way as image_cache.image_cache_path on the server.
+    """
+    base_path = os.path.splitext(object_path)[0]
+    if max_side:
+        return base_path + '.rgb_' + str(max_side) + '.npy'
+    return base_path + '.rgb.npy'
+
+
+def load_image_array(file_name, max_side=0):
+    """
+    Loads an image as an RGB array of shape (height, width, 3), reduced so that its longest side is at most max_side
+    pixels. If the server decoded the image on upload (see PREDECODE_IMAGES on the server), the smallest stored raster
+    that is large enough is memory mapped instead of decoding the original. The mapping is copy-on-write, so the pixels
+    are only read from disk as they are used and the array can be modified without changing the stored raster.
+
+    :param file_name: Name of the object in the objects directory, or path to an image file
+    :param max_side: Maximum length of the longest side, or 0 to keep the full resolution
+    :return: 2-tuple of RGB pixel array, factor to multiply coordinates by to get full resolution coordinates
+    """
+    object_path = os.path.join(OBJECT_DIRECTORY, file_name)
+    cache_path = image_cache_path(object_path)
+
+    if os.path.exists(cache_path):
+        pixels = np.load(cache_path, mmap_mode='c')
+        original_side = max(pixels.shape[:2])
+
+        for cache_side in sorted(IMAGE_CACHE_SIZES):
+            reduced_cache_path = image_cache_path(object_path, cache_side)
+            if max_side and max_side <= cache_side < original_side and os.path.exists(reduced_cache_path):
+                pixels = np.load(reduced_cache_path, mmap_mode='c')
+                break
+    elif share_images:
+        image = open_image(object_path)
+        original_side = max(image.size)
+        pixels = np.array(image.convert('RGB') if image.mode != 'RGB' else image)  # Copy, the image is shared
+    else:
+        with Image.open(object_path) as image:
+            original_side = max(image.size)
+            if max_side:
+                # JPEG images can be decoded directly at a reduced size, which skips most of the decoding work
+                image.draft('RGB', (max_side, max_side))
+            pixels = np.asarray(image.convert('RGB'))
+
+    if max_side and max(pixels.shape[:2]) > max_side:
+        image = Image.fromarray(pixels)
+        image.thumbnail((max_side, max_side), Image.BILINEAR)
+        pixels = np.asarray(image)
+
+    return pixels, original_side / max(pixels.shape[:2])
@@ -1,17 +1,117 @@
 import os
 import json
-from model.model import predict, init
-from model.config import model_name, model_type
-from pymongo import MongoClient
+from pymongo import MongoClient, UpdateOne
+from rq import get_current_job
 
-client = MongoClient(os.getenv('DB_HOST', default='database'), 27017)
+from utility.models import job_model
+from utility.scheduling import queue_model_name
+from utility.search_tokens import create_search_tokens
+
+# Connect on first use, so that worker processes forked by utility.prefork each open their own connections
+client = MongoClient(os.getenv('DB_HOST', default='database'), 27017, connect=False)
 database_object_collection = client['server_database']['objects']
 database_model_collection = client['server_database']['models']
+database_frame_result_collection = client['server_database']['frame_results']
+
+# Must match dependency.PREDICTION_PENDING_KEY_PREFIX and dependency.PREDICTION_COMPLETE_CHANNEL_PREFIX on the server
+PREDICTION_PENDING_KEY_PREFIX = 'prediction_pending:'
+PREDICTION_COMPLETE_CHANNEL_PREFIX = 'prediction_complete:'
+
+# Results created by predict_objects_batch(), keyed by job id. predict_object() uses these instead of running the
+# model again when the job it is processing was part of a batch.
+batch_results = {}
+
+
+def supports_batch_prediction(model_package):
+    """
+    Checks whether a loaded model defines the optional predict_batch(list_of_inputs) method.
+
+    :param model_package: ModelPackage of the model
+    :return: True if the model can predict on several objects at once, else False
+    """
+    return callable(getattr(model_package.module, 'predict_batch', None))
+
 
+def predict_objects_batch(jobs):
+    """
+    Runs the model's predict_batch() method once for a group of prediction jobs and stores each result so that
+    predict_object() can use it when the job is performed. If the batch fails, nothing is stored and every job falls
+    back to an individual predict() call.
 
-def predict_object(object_identifier, object_data):
+    :param jobs: List of rq Job objects for utility.main.predict_object from the queue of one model
+    """
+    model_package = job_model(jobs[0])
+    batch_inputs = [job.args[1] for job in jobs]
     try:
-        result = predict(object_data)  # Create prediction on model
+        results = model_package.module.predict_batch(batch_inputs)
+    except Exception as e:
+        print(e)
+        print('[Error] Batch Prediction Crash. Model: [' + model_package.name + '] Falling back to single predictions.',
+              flush=True)
+        return
+
+    if len(results) != len(jobs):
+        print('[Error] Batch Prediction returned ' + str(len(results)) + ' results for ' + str(len(jobs)) + ' jobs.',
+              flush=True)
+        return
+
+    for job, result in zip(jobs, results):
+        batch_results[job.id] = result
+
+
+def predict_object(object_identifier, object_data, video=None):
+    """
+    Job function that is enqueued by the server for every object and model. Creates the prediction and saves it to the
+    database. The job is marked as no longer pending for the object by finish_pending_job().
+
+    Frames of videos are enqueued by utility.fanout.extract_video_frames() with the video they were extracted from,
+    as {'hash_md5': video hash, 'timestamps': [seconds from the start of the video]}. Their results are also stored as
+    frame results of the video, and the job is pending for the video instead of the frame.
+    """
+    create_prediction(object_identifier, object_data, video)
+
+
+def pending_object_identifier(job):
+    """
+    Returns the object that a job is pending for. Jobs of video frames are pending for their video, and all other jobs
+    for the object in their first argument.
+    """
+    if job.func_name == 'utility.main.predict_object' and len(job.args) > 2 and job.args[2]:
+        return job.args[2]['hash_md5']
+    return job.args[0]
+
+
+def finish_pending_job(job, connection, *args, **kwargs):
+    """
+    Success and failure callback of every prediction job. Decreases the number of pending jobs of an object that the
+    server increased when the job was enqueued, and notifies clients that are listening for results of this object.
+
+    As a failure callback, this also runs when a job raised, timed out, or was abandoned by a worker that stopped
+    while performing it, which rq finds when it cleans up the started job registry.
+    """
+    object_identifier = pending_object_identifier(job)
+    pending_key = PREDICTION_PENDING_KEY_PREFIX + object_identifier
+    pending = connection.decr(pending_key)
+    if pending < 0:  # Counter had already expired
+        connection.delete(pending_key)
+        pending = 0
+
+    connection.publish(PREDICTION_COMPLETE_CHANNEL_PREFIX + object_identifier, json.dumps({
+        'hash_md5': object_identifier,
+        'model_name': queue_model_name(job.origin),
+        'pending': pending
+    }))
+
+
+def create_prediction(object_identifier, object_data, video=None):
+    job = get_current_job()
+    model_package = job_model(job)  # Workers may host several models, so the model is found from the job's queue
+    model_name = model_package.name
+    try:
+        if job is not None and job.id in batch_results:
+            result = batch_results.pop(job.id)  # Prediction was already created as part of a batch
+        else:
+            result = model_package.module.predict(object_data)  # Create prediction on model
     except Exception as e:
         # Do not send prediction results to server on crash.
         print(e)
@@ -20,24 +120,34 @@ def predict_object(object_identifier, object_data):
 
     print('Prediction Complete', result, flush=True)
 
-    # Update model results in the database
-    current_image_obj = database_object_collection.find_one({"hash_md5": object_identifier})
-    if current_image_obj:
-        nm = [list(current_image_obj['models'].values()), model_name, result['result']] + current_image_obj['file_names']
-        metadata_str = json.dumps(nm)
-        for char_to_replace in ['"', "'", "\\", '[', ']', '{', '}']:
-            metadata_str = metadata_str.replace(char_to_replace, '')
-
-        database_object_collection.update_one({'hash_md5': object_identifier}, {'$set': {
-            'models.' + model_name: result['result'],
-            'metadata': metadata_str
-        }})
-
-    # Add model structure to server database.
-    if not database_model_collection.find_one({'model_name': model_name}):
-        print('Adding Model Information to Database: ' + model_name, flush=True)
-        database_model_collection.insert_one({
-            'model_name': model_name,
-            'model_fields': result['classes'],
-            'model_type': model_type
+    # Update model results in the database, and add their words to the object's search tokens. Optional details of the
+    # results are stored without being searched.
+    search_tokens = create_search_tokens(model_name, result['result'])
+    object_update = {'models.' + model_name: result['result']}
+    if 'details' in result:
+        object_update['model_details.' + model_name] = result['details']
+    database_object_collection.update_one({'hash_md5': object_identifier}, {
+        '$set': object_update,
+        '$addToSet': {'search_tokens': {'$each': search_tokens}}
+    })
+
+    # Store the results of frames at each of their timestamps in the video. The server reads them as the timeline of
+    # the video, in the order of the timestamps. Words of the results are also added to the search tokens of the video.
+    if video:
+        database_frame_result_collection.bulk_write([
+            UpdateOne({'video_hash': video['hash_md5'], 'model_name': model_name, 'timestamp': timestamp}, {'$set': {
+                'hash_md5': object_identifier,
+                'result': result['result']
+            }}, upsert=True)
+            for timestamp in video['timestamps']
+        ], ordered=False)
+        database_object_collection.update_one({'hash_md5': video['hash_md5']}, {
+            '$addToSet': {'search_tokens': {'$each': search_tokens}}
         })
+
+    # Add model structure to server database if it is not there already.
+    database_model_collection.update_one({'model_name': model_name}, {'$setOnInsert': {
+        'model_name': model_name,
+        'model_fields': result['classes'],
+        'model_type': model_package.type
+    }}, upsert=True)
@@ -0,0 +1,81 @@
+import importlib
+import os
+import sys
+import types
+from collections import namedtuple
+
+from utility.scheduling import queue_model_name
+
+# Directory of the model of a worker that hosts one model
+MODEL_DIRECTORY = '/app/model'
+
+# A worker hosts several models when PREDICTION_MODELS is a comma separated list of model folders, which are mounted
+# in MODELS_DIRECTORY as /app/models/<folder>
+MODELS_DIRECTORY = '/app/models/'
+PREDICTION_MODELS = [folder.strip() for folder in os.getenv('PREDICTION_MODELS', default='').split(',') if folder.strip()]
+
+ModelPackage = namedtuple('ModelPackage', ['name', 'type', 'tags', 'module'])  # module is the imported model.py
+
+loaded_models = {}  # {model_name: ModelPackage}
+
+
+def import_model_package(directory):
+    """
+    Imports config.py and model.py of a model folder. Models import their own modules as 'model.<module>', so the
+    folder is registered as the package 'model' while it is imported. The package is removed from sys.modules
+    afterwards, which allows the next folder to be imported as 'model' as well.
+
+    :param directory: Path to model folder
+    :return: ModelPackage
+    """
+    package = types.ModuleType('model')
+    package.__path__ = [directory]
+    sys.modules['model'] = package
+    try:
+        config = importlib.import_module('model.config')
+        module = importlib.import_module('model.model')
+    finally:
+        for name in [name for name in sys.modules if name == 'model' or name.startswith('model.')]:
+            del sys.modules[name]
+
+    return ModelPackage(config.model_name, config.model_type, config.model_tags, module)
+
+
+def load_models():
+    """
+    Imports every model hosted by this worker and runs its init() method once.
+
+    :return: List of ModelPackage
+    """
+    directories = [MODELS_DIRECTORY + folder for folder in PREDICTION_MODELS] or [MODEL_DIRECTORY]
+    for directory in directories:
+        model_package = import_model_package(directory)
+        model_package.module.init()  # Ensure that the model is ready to receive predictions.
+        loaded_models[model_package.name] = model_package
+    return list(loaded_models.values())
+
+
+def job_model(job):
+    """
+    Returns the model that a job was enqueued for. Jobs are enqueued on the queue named after their model, or on a
+    bulk queue of the model (see utility.scheduling).
+
+    :param job: rq Job, or None outside of a job
+    :return: ModelPackage
+    """
+    if job is not None and queue_model_name(job.origin) in loaded_models:
+        return loaded_models[queue_model_name(job.origin)]
+    return next(iter(loaded_models.values()))
+
+
+def worker_name(model_packages, worker_id):
+    """
+    Creates the name that a worker registers with in Redis, which the server reads the connected models from. Each
+    hosted model adds its type, name and tags, so a worker that hosts one model is named
+    'prediction;<model_type>;<model_name>;<model_tags>;<worker_id>'.
+    """
+    return ';'.join(
+        ['prediction'] +
+        [field for package in model_packages for field in (package.type, package.name, package.tags)] +
+        [worker_id]
+    )
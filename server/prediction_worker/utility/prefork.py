@@ -0,0 +1,111 @@
+import gc
+import os
+import signal
+import sys
+import time
+import traceback
+
+# Number of worker processes that are forked from the process that loaded the models. Each process takes jobs from the
+# queues on its own, and the loaded models are shared between them until a process writes to them. Set to 0 to start
+# one process per core.
+WORKER_PROCESSES = int(os.getenv('PREDICTION_WORKER_PROCESSES', default=1)) or os.cpu_count() or 1
+
+# Seconds to wait before replacing a worker process that exited, so that a model that crashes on every job does not
+# fork in a loop
+RESTART_DELAY = 1
+
+
+def explicit_thread_count():
+    """
+    Checks whether the number of threads was chosen in the environment of the worker, either for a model, such as
+    OBJECT_DETECTION_NUM_THREADS, or for the libraries it uses, such as OMP_NUM_THREADS.
+
+    :return: True if any *_NUM_THREADS environment variable is set to a value other than 0
+    """
+    return any(name.endswith('_NUM_THREADS') and value.strip() not in ('', '0') for name, value in os.environ.items())
+
+
+def limit_threads(processes):
+    """
+    Divides the cores between the worker processes. PyTorch models otherwise start one thread per core in every
+    process, and the processes slow each other down. Models that set their own number of threads are left unchanged.
+    """
+    torch = sys.modules.get('torch')
+    if torch is not None and not explicit_thread_count():
+        torch.set_num_threads(max(1, (os.cpu_count() or 1) // processes))
+
+
+def fork_worker(run_worker, processes):
+    """
+    Forks a worker process that calls run_worker() and exits when it returns.
+
+    :return: Process id of the worker process
+    """
+    pid = os.fork()
+    if pid != 0:
+        return pid
+
+    exit_code = 1
+    try:
+        # The worker installs its own handlers for a warm shutdown
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        limit_threads(processes)
+        run_worker()
+        exit_code = 0
+    except SystemExit as e:
+        exit_code = e.code if isinstance(e.code, int) else 1
+    except BaseException:
+        traceback.print_exc()
+    finally:
+        sys.stdout.flush()
+        os._exit(exit_code)
+
+
+def run_worker_pool(run_worker, processes=WORKER_PROCESSES):
+    """
+    Runs run_worker() in several long lived processes that are forked from this process. Models must be loaded before
+    this is called, so that their weights are in memory that the processes share copy-on-write instead of every process
+    loading its own copy. Worker processes that exit are replaced until this process receives SIGTERM or SIGINT, which
+    stops every worker process after its current job.
+
+    :param run_worker: Function that creates a worker and processes jobs with it
+    :param processes: Number of worker processes
+    """
+    # Move every object that exists now to a generation that the garbage collector never visits. Otherwise collections
+    # in the worker processes write to the objects of the loaded models, which copies the memory pages holding them.
+    gc.freeze()
+
+    children = set()
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        if signum == signal.SIGTERM:  # SIGINT from a terminal is already sent to every process of the group
+            for child in children:
+                try:
+                    os.kill(child, signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for _ in range(processes):
+        children.add(fork_worker(run_worker, processes))
+    print('Started ' + str(processes) + ' Worker Processes', flush=True)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        children.discard(pid)
+
+        if not stopping:
+            print('[Error] Worker process ' + str(pid) + ' exited with status ' + str(status) + '. Restarting.',
+                  flush=True)
+            time.sleep(RESTART_DELAY)
+            if not stopping:
+                children.add(fork_worker(run_worker, processes))
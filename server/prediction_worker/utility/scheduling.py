@@ -0,0 +1,127 @@
+import os
+import time
+
+from rq import Queue, SimpleWorker, worker_registration
+from rq.maintenance import clean_intermediate_queue
+from rq.registry import clean_registries
+from rq.utils import utcnow
+
+# Must match dependency.PREDICTION_BULK_QUEUE_INFIX and dependency.PREDICTION_BULK_USERS_KEY_PREFIX on the server
+PREDICTION_BULK_QUEUE_INFIX = ':bulk:'
+PREDICTION_BULK_USERS_KEY_PREFIX = 'prediction_bulk_users:'
+
+# Seconds that the users with bulk queues are reused before they are read from Redis again. An idle worker also stops
+# waiting on its queues after this many seconds, so that it starts listening on the bulk queues of new users.
+BULK_USERS_REFRESH_INTERVAL = float(os.getenv('PREDICTION_BULK_USERS_REFRESH', default=5))
+
+
+def queue_model_name(queue_name):
+    """
+    Returns the name of the model of an interactive queue '<model_name>' or a bulk queue '<model_name>:bulk:<username>'.
+    """
+    return queue_name.split(':', 1)[0]
+
+
+def queue_bulk_user(queue_name):
+    """
+    Returns the user of a bulk queue, or None for an interactive queue.
+    """
+    model_name, infix, username = queue_name.partition(PREDICTION_BULK_QUEUE_INFIX)
+    return username if infix else None
+
+
+class LaneWorker(SimpleWorker):
+    """
+    SimpleWorker that takes jobs from the interactive queues of its models before any of their bulk queues. Jobs are
+    taken from the bulk queues of each user in turn, so the objects that one user uploaded in bulk do not delay the
+    objects of other users by more than one job each. Workers that host several models also take jobs from the queues
+    of each model in turn.
+
+    The order of the queues is kept in place of the order that rq keeps for its dequeue strategies. reorder_queues()
+    is the hook that rq's own round robin strategy overrides, but the list of queues that rq dequeues from
+    (_ordered_queues) and dequeue_timeout are internals of rq, which is pinned in requirements.txt for this reason.
+    Check test_scheduling.py on the server when upgrading rq.
+
+    Bulk queues are not in self.queues, which rq only reads at startup, so clean_registries() also cleans them.
+    """
+
+    def __init__(self, queues, *args, **kwargs):
+        self.interactive_queues = list(queues)
+        self.bulk_queues = []
+        self.bulk_queues_refreshed = None
+        super().__init__(queues, *args, **kwargs)
+        self.model_names = [queue.name for queue in self.interactive_queues]
+
+    # rq==1.15.1 passes _ordered_queues to Queue.dequeue_any() on every attempt and assigns it in Worker.__init__()
+    # and Worker.reorder_queues(). Other versions of rq may read or reorder the queues elsewhere, and then the lanes
+    # are silently ignored. Keep the pin in requirements.txt until this is checked against the new version.
+    @property
+    def _ordered_queues(self):
+        self.refresh_bulk_queues()
+        return self.interactive_queues + self.bulk_queues
+
+    @_ordered_queues.setter
+    def _ordered_queues(self, queues):
+        pass  # rq resets the order when the worker starts. The order of each lane is kept by reorder_queues().
+
+    @property
+    def dequeue_timeout(self):
+        return max(1, int(BULK_USERS_REFRESH_INTERVAL))
+
+    def refresh_bulk_queues(self):
+        """
+        Reads the users with bulk queues of the models of this worker. Queues that the worker already listens on keep
+        their place in the order, and the queues of new users are added at the end.
+        """
+        if not hasattr(self, 'model_names'):
+            return  # rq may read the queues before the worker is initialized
+        if self.bulk_queues_refreshed is not None and \
+                time.monotonic() - self.bulk_queues_refreshed < BULK_USERS_REFRESH_INTERVAL:
+            return
+
+        with self.connection.pipeline() as pipe:
+            for model_name in self.model_names:
+                pipe.smembers(PREDICTION_BULK_USERS_KEY_PREFIX + model_name)
+            model_users = [{user.decode() for user in users} for users in pipe.execute()]
+
+        # The queues of one user on each model are next to each other, so that workers that host several models
+        # predict an object on every model one after another
+        queue_names = [
+            model_name + PREDICTION_BULK_QUEUE_INFIX + user
+            for user in sorted(set().union(*model_users))
+            for model_name, users in zip(self.model_names, model_users) if user in users
+        ]
+
+        known_queue_names = {queue.name for queue in self.bulk_queues}
+        self.bulk_queues = [queue for queue in self.bulk_queues if queue.name in queue_names] + [
+            Queue(queue_name, connection=self.connection, serializer=self.serializer)
+            for queue_name in queue_names if queue_name not in known_queue_names
+        ]
+        self.bulk_queues_refreshed = time.monotonic()
+
+    def clean_registries(self):
+        """
+        Runs the maintenance of rq on the interactive and bulk queues. Jobs that are abandoned in the started job
+        registry of a queue, because the worker that performed them stopped, are moved to the failed job registry,
+        which runs their failure callback and finishes them as pending jobs of their object.
+        """
+        self.bulk_queues_refreshed = None  # Include the bulk queues of every user, however recently they were read
+        self.refresh_bulk_queues()
+        for queue in self.interactive_queues + self.bulk_queues:
+            # If there are multiple workers running, only one of them cleans each queue
+            if queue.acquire_maintenance_lock():
+                self.log.info('Cleaning registries for queue: %s', queue.name)
+                clean_registries(queue)
+                worker_registration.clean_worker_registry(queue)
+                clean_intermediate_queue(self, queue)
+        self.last_cleaned_at = utcnow()
+
+    def reorder_queues(self, reference_queue):
+        """
+        Moves the queue that a job was just taken from behind the other queues of its lane.
+        """
+        lane = self.bulk_queues if queue_bulk_user(reference_queue.name) else self.interactive_queues
+        queue_names = [queue.name for queue in lane]
+        if reference_queue.name in queue_names:
+            position = queue_names.index(reference_queue.name) + 1
+            lane[:] = lane[position:] + lane[:position]
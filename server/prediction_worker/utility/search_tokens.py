@@ -0,0 +1,36 @@
+import re
+from typing import List
+
+# Objects are searched with a multikey index on the 'search_tokens' field, which holds every normalized word in the
+# object's file names and model results. Words are split on anything that is not a letter or digit, including '_'.
+# The server and the prediction workers both tokenize with this module, which has no dependencies so that both
+# images can import it.
+SEARCH_TOKEN_PATTERN = re.compile(r'[^\W_]+')
+SEARCH_TOKEN_MAX_LENGTH = 64  # Longer tokens are left out to keep index keys small
+
+# Version of the tokenization above, stored on every object as 'search_tokens_version'. Increase it when the tokens
+# change, so that db_connection.migrate_search_tokens_db on the server adds the new tokens to existing objects.
+SEARCH_TOKEN_VERSION = 1
+
+
+def create_search_tokens(*values) -> List[str]:
+    """
+    Creates the normalized search tokens for a group of values. Dictionaries contribute both their keys and values,
+    and lists contribute all of their items.
+
+    :param values: Strings, numbers, lists or dictionaries to tokenize
+    :return: Sorted list of unique lowercase tokens
+    """
+    tokens = set()
+    values = list(values)
+    while values:
+        value = values.pop()
+        if isinstance(value, dict):
+            values.extend(value.keys())
+            values.extend(value.values())
+        elif isinstance(value, (list, tuple, set)):
+            values.extend(value)
+        elif value is not None:
+            tokens.update(SEARCH_TOKEN_PATTERN.findall(str(value).lower()))
+
+    return sorted(token for token in tokens if len(token) <= SEARCH_TOKEN_MAX_LENGTH)
@@ -0,0 +1,162 @@
+import os
+from collections import namedtuple
+
+import av
+import numpy as np
+
+# Frame sampling modes of sample_frames()
+KEYFRAME = 'keyframe'  # Every keyframe. Only keyframes are decoded, which is by far the fastest mode.
+FPS = 'fps'  # Frames at a fixed rate
+SCENE = 'scene'  # Frames at a fixed rate that differ from the previous sampled frame by more than a threshold
+
+# When the next frame to sample is more than this many seconds ahead, the video is seeked to the keyframe before it
+# instead of decoding every frame up to it
+SEEK_MIN_GAP = float(os.getenv('VIDEO_SEEK_MIN_GAP', default=2.0))
+
+# Scene changes are detected on grayscale copies of the frames of this size. SCENE_THRESHOLD is the mean absolute
+# difference of two copies, between 0 and 1, above which a frame is a new scene.
+SCENE_ANALYSIS_SIDE = 64
+SCENE_THRESHOLD = float(os.getenv('VIDEO_SCENE_THRESHOLD', default=0.15))
+
+VideoFrame = namedtuple('VideoFrame', ['timestamp', 'pixels'])  # Seconds from the start of the video, RGB array
+
+
+class FrameDecoder:
+    """
+    Decodes frames of the first video stream of a container, with timestamps in seconds from the start of the stream.
+    """
+
+    def __init__(self, container):
+        self.container = container
+        self.stream = container.streams.video[0]
+        self.stream.thread_type = 'AUTO'  # Decode with several threads
+        self.start_time = self.stream.start_time or 0
+        self.frames = None
+
+    def timestamp(self, frame):
+        return float((frame.pts - self.start_time) * frame.time_base)
+
+    def seek(self, timestamp):
+        """
+        Moves to the keyframe at or before timestamp. Frames decoded afterwards start at that keyframe.
+        """
+        self.container.seek(self.start_time + int(timestamp / self.stream.time_base), stream=self.stream)
+        self.frames = None
+
+    def decode(self):
+        """
+        Returns the frames from the current position of the decoder as a generator of (timestamp, frame)
+        """
+        if self.frames is None:
+            self.frames = (
+                (self.timestamp(frame), frame) for frame in self.container.decode(self.stream)
+                if frame.pts is not None
+            )
+        return self.frames
+
+
+def decode_keyframes(decoder, start):
+    decoder.stream.codec_context.skip_frame = 'NONKEY'  # The decoder drops all other frames without decoding them
+    if start:
+        decoder.seek(start)
+    for timestamp, frame in decoder.decode():
+        if timestamp >= start:
+            yield timestamp, frame
+
+
+def decode_fps(decoder, fps, start):
+    interval = 1 / fps
+    target = start
+    position = None  # Timestamp of the last decoded frame
+
+    while True:
+        if position is None or target - position > SEEK_MIN_GAP:
+            decoder.seek(target)
+
+        for position, frame in decoder.decode():
+            if position >= target:
+                break
+        else:
+            return  # End of the video
+
+        yield position, frame
+        # Frames are sampled at most once if the video has fewer frames per second than fps
+        while target <= position:
+            target += interval
+
+
+def decode_scenes(decoder, fps, threshold, start):
+    previous = None
+    for timestamp, frame in decode_fps(decoder, fps, start):
+        analysis_frame = frame.to_ndarray(width=SCENE_ANALYSIS_SIDE, height=SCENE_ANALYSIS_SIDE, format='gray')
+        analysis_frame = analysis_frame.astype(np.float32)
+        if previous is None or np.mean(np.abs(analysis_frame - previous)) / 255 > threshold:
+            yield timestamp, frame
+        previous = analysis_frame
+
+
+def frame_pixels(frame, max_side):
+    """
+    Converts a decoded frame to an RGB array, reduced so that its longest side is at most max_side pixels.
+    """
+    width, height = frame.width, frame.height
+    if max_side and max(width, height) > max_side:
+        scale = max_side / max(width, height)
+        width, height = max(1, round(width * scale)), max(1, round(height * scale))
+    return frame.to_ndarray(width=width, height=height, format='rgb24')
+
+
+def sample_frames(video_path, mode=FPS, fps=1.0, scene_threshold=SCENE_THRESHOLD, max_side=0, start=0.0, end=None,
+                  max_frames=None):
+    """
+    Samples frames from a video without decoding all of it. Frames are returned one at a time as they are decoded, so
+    only one frame is held in memory regardless of the length of the video.
+
+    :param video_path: Path to video file
+    :param mode: KEYFRAME to sample every keyframe, FPS to sample frames at a fixed rate, or SCENE to sample frames at a
+                 fixed rate that are the start of a new scene
+    :param fps: Frames per second to sample in FPS and SCENE mode
+    :param scene_threshold: Difference between 0 and 1 from the previous sampled frame of a new scene in SCENE mode
+    :param max_side: Maximum length of the longest side of the frames, or 0 to keep the full resolution
+    :param start: Seconds from the start of the video of the first frame to sample
+    :param end: Seconds from the start of the video after which no frames are sampled, or None for the whole video
+    :param max_frames: Maximum number of frames to sample, or None for no limit
+    :return: Generator of VideoFrame, in the order of their timestamps
+    """
+    with av.open(video_path) as container:
+        if not container.streams.video:
+            return
+        decoder = FrameDecoder(container)
+
+        if mode == KEYFRAME:
+            frames = decode_keyframes(decoder, start)
+        elif mode == FPS:
+            frames = decode_fps(decoder, fps, start)
+        elif mode == SCENE:
+            frames = decode_scenes(decoder, fps, scene_threshold, start)
+        else:
+            raise ValueError('Unknown frame sampling mode: ' + str(mode))
+
+        for count, (timestamp, frame) in enumerate(frames):
+            if (end is not None and timestamp > end) or (max_frames is not None and count >= max_frames):
+                break
+            yield VideoFrame(timestamp, frame_pixels(frame, max_side))
+
+
+def batch_frames(frames, batch_size):
+    """
+    Groups frames into lists of batch_size frames, so that image models can predict on several frames at once while
+    at most batch_size frames are held in memory.
+
+    :param frames: Iterable of frames, such as the generator returned by sample_frames()
+    :param batch_size: Number of frames in each batch. The last batch may be smaller.
+    :return: Generator of lists of frames
+    """
+    batch = []
+    for frame in frames:
+        batch.append(frame)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
@@ -1,22 +1,49 @@
 import uuid
 from redis import Redis
 
-from model.config import model_name, model_type, model_tags
-from rq import Queue, SimpleWorker, Connection
-from model.model import init, predict
+from rq import Queue, Connection
+from utility.models import load_models, worker_name
+from utility.batching import BatchWorker, model_batch_size
+from utility.scheduling import LaneWorker
+from utility.prefork import run_worker_pool, WORKER_PROCESSES
 
 
 redis = Redis(host='redis', port=6379)
 
+
+def run_worker(model_packages):
+    """
+    Creates a worker for the loaded models and processes jobs until the worker is stopped. Every worker process has
+    its own worker id.
+    """
+    unique_worker_id = str(uuid.uuid4())
+    queues = [Queue(model_package.name) for model_package in model_packages]
+
+    # Models that define predict_batch() receive several queued objects at once
+    batch_sizes = {model_package.name: model_batch_size(model_package) for model_package in model_packages}
+    if max(batch_sizes.values()) > 1:
+        print('Batch Prediction Enabled. Batch Sizes: ' + str(batch_sizes), flush=True)
+        worker = BatchWorker(queues, connection=redis, name=worker_name(model_packages, unique_worker_id))
+    else:
+        worker = LaneWorker(queues, connection=redis, name=worker_name(model_packages, unique_worker_id))
+
+    if len(model_packages) > 1:
+        # Jobs are taken from the queue of each model in turn. The server enqueues objects in the same order on
+        # every model, so the jobs of one object run one after another and share its decoded image.
+        print('Hosting Models: ' + ', '.join(batch_sizes), flush=True)
+        from utility.image_cache import enable_shared_images  # Requires numpy and pillow, which not every model installs
+        enable_shared_images()
+    worker.work()
+
+
 if __name__ == '__main__':
     print('Starting Worker', flush=True)
-    unique_worker_id = str(uuid.uuid4())
     with Connection(redis):
-        worker_name = 'prediction;' + model_type + ';' + model_name + ';' + model_tags + ';' + unique_worker_id
-        queue = Queue(model_name)
-        init()  # Ensure that the model is ready to receive predictions.
-        worker = SimpleWorker([queue], connection=redis, name=worker_name)
-        worker.work()
-    print('Ending Worker', flush=True)
-
+        model_packages = load_models()  # Ensure that the models are ready to receive predictions.
 
+        # Several worker processes are forked after the models are loaded, and share the loaded models
+        if WORKER_PROCESSES > 1:
+            run_worker_pool(lambda: run_worker(model_packages))
+        else:
+            run_worker(model_packages)
+    print('Ending Worker', flush=True)
@@ -1,24 +1,30 @@
+import asyncio
 import hashlib
+import json
 import os
-import shutil
-from fastapi.responses import JSONResponse
-from rq.registry import StartedJobRegistry
+from fastapi.responses import JSONResponse, StreamingResponse
 
 import dependency
-from fastapi import File, UploadFile, HTTPException, Depends, APIRouter, Form
-from rq.job import Job
-from rq import Worker
+from fastapi import File, UploadFile, HTTPException, Depends, APIRouter, Form, Query, Request
 
 from routers.auth import current_user_investigator
-from dependency import redis, User, UniversalMLPredictionObject
-from db_connection import add_object_db, add_user_to_object, get_objects_from_user_db, get_object_by_md5_hash_db, \
-    add_filename_to_object, get_models_db, update_tags_to_object, update_role_to_tag_object
-from typing import List
+from model_registry import model_registry
+from dependency import redis, async_redis, pool, User, UniversalMLPredictionObject, PredictionPriority, Roles
+from image_cache import PREDECODE_IMAGES, write_image_cache
+from prediction_events import prediction_event_broker
+from db_connection import upsert_objects_db, get_objects_from_user_db, get_objects_by_md5_hashes_db, \
+    get_models_db, update_tags_to_object, update_role_to_tag_object, decode_search_cursor
+from typing import List, Optional
 from rq import Queue
+from rq.job import Callback
 import uuid
 
 model_router = APIRouter()
 
+PREDICTION_OBJECT_DIRECTORY = "/app/prediction/"  # Docker volume shared with the prediction workers
+UPLOAD_BUFFER_SIZE = 65536  # Read object data in 64KB Chunks for hashlib
+RESULT_STREAM_KEEP_ALIVE = 15  # Seconds between keep-alive messages on /results/stream
+
 
 @model_router.get("/list", dependencies=[Depends(current_user_investigator)])
 async def get_prediction_models(model_type: str = ''):
@@ -48,8 +54,7 @@ async def get_prediction_model_tags():
     Returns list of tags for each available model
     """
 
-    worker_data = [w.name.split(';') for w in Worker.all(redis)]
-    valid_workers = {w[2]: w[3] for w in worker_data if w[0] == 'prediction'}
+    valid_workers = {name: model['tags'] for name, model in model_registry.get_models().items()}
 
     return {"tags": valid_workers}
 
@@ -59,16 +64,17 @@ async def get_prediction_model_types():
     """
     Returns list of types for each available model
     """
-    worker_data = [w.name.split(';') for w in Worker.all(redis)]
-    valid_workers = {w[2]: w[1] for w in worker_data if w[0] == 'prediction'}
+    valid_workers = {name: model['type'] for name, model in model_registry.get_models().items()}
 
     return {"tags": valid_workers}
 
 
 @model_router.post("/predict")
 def create_new_prediction(models: List[str] = (),
+                          frame_models: List[str] = (),
                           model_type: str = Form(...),
                           objects: List[UploadFile] = File(...),
+                          priority: Optional[PredictionPriority] = Form(None),
                           current_user: User = Depends(current_user_investigator)):
     """
     Create a new prediction request for any number of objects on any number of models. This will enqueue the jobs
@@ -78,99 +84,89 @@ def create_new_prediction(models: List[str] = (),
     :param current_user: User object who is logged in
     :param objects: List of file objects that will be used by the models for prediction
     :param models: List of models to run on objects
+    :param frame_models: List of image models to run on frames extracted from video objects. The results are stored in
+                         the timeline of the video object.
+    :param priority: Scheduling lane of the jobs. Defaults to interactive for small uploads and bulk for large uploads.
     :return: Unique keys for each object uploaded in objects.
     """
 
     # Start with error checking on the models list.
     # Ensure that all desired models are valid.
-    if not models:
+    if not models and not frame_models:
         return HTTPException(status_code=400, detail="You must specify models to process objects with")
 
     invalid_models = []
+    available_models = get_available_prediction_models()
+    models_of_type = get_models_by_type(model_type)
     for model in models:
         # Ensure that the desired model is running
-        if model not in get_available_prediction_models():
+        if model not in available_models:
             invalid_models.append(model)
 
         # Ensure desired model is the correct type for input
-        if model not in get_models_by_type(model_type):
+        if model not in models_of_type:
             invalid_models.append(model)
 
+    # Frames are extracted from videos by the video frames model before they are sent to the image models
+    if frame_models:
+        if model_type != 'video' or dependency.VIDEO_FRAMES_MODEL not in available_models:
+            return HTTPException(status_code=400,
+                                 detail="Frame models require video objects and a running video frames model")
+
+        image_models = get_models_by_type('image')
+        invalid_models.extend(model for model in frame_models if model not in image_models)
+
     if invalid_models:
         error_message = "Invalid Models Specified: " + ''.join(list(set(invalid_models)))
         return HTTPException(status_code=400, detail=error_message)
 
+    priority = select_prediction_priority(priority, len(objects), current_user)
+    if priority is None:
+        return HTTPException(status_code=403, detail="Only administrators may upload more than " +
+                                                     str(dependency.PREDICTION_INTERACTIVE_MAX_OBJECTS) +
+                                                     " objects with interactive priority")
 
-    # Now we must hash each uploaded object to get a unique identifier
-    # After hashing, we will store the object file temporarily in a Docker volume
-    buffer_size = 65536  # Read object data in 64KB Chunks for hashlib
+
+    # Now we must hash each uploaded object to get a unique identifier. Objects are read once: while the hash is
+    # computed, the data is also spooled to the prediction volume (or kept in memory for text).
     processed_image_hashes = {}
+    prediction_objects = {}  # {hash_md5: UniversalMLPredictionObject}
+    uploaded_file_names = {}  # {hash_md5: [file names]}
+    prediction_inputs = {}  # {hash_md5: input passed to model predict()}
 
-    # Process uploaded objects
     for upload_file in objects:
-        file_obj = upload_file.file
-        md5 = hashlib.md5()
-
-        # Obtain MD5 hash for uploaded object by reading it in blocks and updating the hash
-        while True:
-            data = file_obj.read(buffer_size)
-            if not data:
-                break
-            md5.update(data)
-
-        # Obtain final hash value and set the result dict
-        hash_md5 = md5.hexdigest()
+        hash_md5, prediction_input = spool_uploaded_object(upload_file, model_type)
         processed_image_hashes[upload_file.filename] = hash_md5
+        uploaded_file_names.setdefault(hash_md5, []).append(upload_file.filename)
 
-        # Reset the file to the initial position for further processing
-        file_obj.seek(0)
-
-        # Either add object to database if it doesn't exist or get the current object from the database
-        if get_object_by_md5_hash_db(hash_md5):
-            prediction_obj = get_object_by_md5_hash_db(hash_md5)
-        else:
-            # Create a UniversalMLPredictionObject object to store data (dependency.py)
-            prediction_obj = UniversalMLPredictionObject(**{
-                'file_names': [upload_file.filename],
-                'hash_md5': hash_md5,
-                'type': model_type,
-                'users': [current_user.username],
-                'models': {},
-                'user_role_able_to_tag': ['admin']
-            })
+        # The same object may be uploaded multiple times in a request under different names
+        if hash_md5 in prediction_objects:
+            continue
 
-            # If the type of the object is 'text' we add the text content to the object
-            if model_type == 'text':
-                prediction_obj.text_content = file_obj.read()
+        prediction_inputs[hash_md5] = prediction_input
 
-            # Add created object to database
-            add_object_db(prediction_obj)
+        # Create a UniversalMLPredictionObject object to store data (dependency.py)
+        prediction_objects[hash_md5] = UniversalMLPredictionObject(**{
+            'file_names': [upload_file.filename],
+            'hash_md5': hash_md5,
+            'type': model_type,
+            'users': [current_user.username],
+            'models': {},
+            'text_content': prediction_input if model_type == 'text' else '',
+            'user_role_able_to_tag': ['admin']
+        })
 
-        # Associate the current user with the object that was uploaded
-        add_user_to_object(prediction_obj, current_user.username)
+    # Add objects to database if they don't exist, and associate the current user and the names the files were
+    # uploaded under with them. This is done with a single bulk write for all objects.
+    upsert_objects_db(list(prediction_objects.values()), current_user.username, uploaded_file_names)
 
-        # Associate the name the file was uploaded under to the object
-        add_filename_to_object(prediction_obj, upload_file.filename)
+    # Decode uploaded images once for all image models, before any of the models receives a job for them
+    if model_type == 'image' and PREDECODE_IMAGES:
+        list(pool.map(write_image_cache, [PREDICTION_OBJECT_DIRECTORY + name for name in prediction_inputs.values()]))
 
-        # Copy object to the temporary storage volume for prediction
-        if model_type != 'text':
-            new_filename = hash_md5 + os.path.splitext(upload_file.filename)[1]
-            stored_object_path = "/app/prediction/" + new_filename
-            stored_object = open(stored_object_path, 'wb+')
-            shutil.copyfileobj(file_obj, stored_object)
-
-            for model in models:
-                Queue(name=model, connection=redis).enqueue(
-                    'utility.main.predict_object', hash_md5, new_filename, job_id=hash_md5 + model + str(uuid.uuid4())
-                )
-        # just for text, because instead of file_name, text predict takes the text content
-        else:
-            text_content = file_obj.read()
-            text_content = text_content.decode('UTF-8')
-            for model in models:
-                Queue(name=model, connection=redis).enqueue(
-                    'utility.main.predict_object', hash_md5, text_content, job_id=hash_md5 + model + str(uuid.uuid4())
-                )
+    # Enqueue every (object, model) job at once. For text, the model receives the text content instead of a file name.
+    bulk_user = current_user.username if priority == PredictionPriority.bulk else None
+    enqueue_prediction_jobs(models, prediction_inputs, frame_models, bulk_user)
 
     return {"prediction objects": [processed_image_hashes[key] for key in processed_image_hashes]}
 
@@ -188,33 +184,14 @@ async def get_jobs(md5_hashes: List[str]):
     if not md5_hashes:
         return []
 
-    # If there are any pending predictions, alert user and return existing ones
-    # Since job_id is a composite hash+model, we must loop and find all jobs that have the
-    # hash we want to find. We must get all running and pending jobs to return the correct value
-    all_jobs = set()
-    for model in get_available_prediction_models():
-        all_jobs.update(
-            StartedJobRegistry(model, connection=redis).get_job_ids() + Queue(model, connection=redis).job_ids)
-
-    for md5_hash in md5_hashes:
-
-        object = get_object_by_md5_hash_db(md5_hash)  # Get object
-        found_pending_job = False
-        for job_id in all_jobs:
-            if md5_hash in job_id and Job.fetch(job_id, connection=redis).get_status() != 'finished':
-                found_pending_job = True
-                results.append({
-                    'detail': 'Object has pending predictions. Check back later for all model results.',
-                    **object.dict()
-                })
-                break  # Don't look for more jobs since we have found one that is pending
-
-        # If we have found a job that is pending, then move on to next object
-        if found_pending_job:
-            continue
+    # Both the objects and the number of unfinished jobs of each object are read with one request each
+    objects = get_objects_by_md5_hashes_db(md5_hashes)
+    pending_jobs = redis.mget([dependency.PREDICTION_PENDING_KEY_PREFIX + md5_hash for md5_hash in md5_hashes])
+
+    for md5_hash, pending in zip(md5_hashes, pending_jobs):
+        object = objects.get(md5_hash)
 
-        # If we haven't found a pending job for this object, and it doesn't exist in our database, then that
-        # means that the object hash must be invalid.
+        # If the object doesn't exist in our database, then that means that the object hash must be invalid.
         if not object:
             return JSONResponse(
                 status_code=404,
@@ -224,26 +201,103 @@ async def get_jobs(md5_hashes: List[str]):
                 }
             )
 
+        # If there are any pending predictions, alert user and return existing ones
+        if pending is not None and int(pending) > 0:
+            results.append({
+                'detail': 'Object has pending predictions. Check back later for all model results.',
+                **object.dict()
+            })
+            continue
+
         # If everything is successful with object, return data
         results.append({**object.dict()})
     return results
 
 
+@model_router.get("/results/stream", dependencies=[Depends(current_user_investigator)])
+async def stream_job_results(request: Request, md5_hashes: List[str] = Query(...)):
+    """
+    Server-sent event stream that notifies the client when prediction jobs finish for a list of objects, so that
+    clients do not need to poll /results. An event is sent every time a model finishes with one of the objects:
+
+        event: prediction
+        data: {"hash_md5": "...", "model_name": "...", "pending": 2}
+
+    "pending" is the number of jobs that are still running on the object. When it is 0, all results for the object
+    are available from /results. Objects that have no pending jobs when the stream is opened are sent right away with
+    a model_name of null. The stream is closed once no requested object has pending jobs.
+
+    :param request: HTTP Request object
+    :param md5_hashes: List of object md5 hashes
+    :return: text/event-stream response
+    """
+    md5_hashes = list(set(md5_hashes))
+
+    async def event_stream():
+        # Wait until Redis confirmed the subscription before reading the pending counts, so that no completion
+        # message can be missed in between. If it is not confirmed in time, the counts are read again after every
+        # keep-alive until the listener is subscribed.
+        queue = prediction_event_broker.subscribe(md5_hashes)
+        try:
+            await prediction_event_broker.wait_until_subscribed(timeout=RESULT_STREAM_KEEP_ALIVE)
+            remaining = set(md5_hashes)
+            while remaining:
+                # Send every object that has finished all its jobs since the counts were last read
+                pending_jobs = await async_redis.mget(
+                    [dependency.PREDICTION_PENDING_KEY_PREFIX + md5_hash for md5_hash in md5_hashes]
+                )
+                for md5_hash, pending in zip(md5_hashes, pending_jobs):
+                    if md5_hash in remaining and (pending is None or int(pending) <= 0):
+                        remaining.discard(md5_hash)
+                        yield format_event({'hash_md5': md5_hash, 'model_name': None, 'pending': 0})
+
+                while remaining:
+                    try:
+                        event = await asyncio.wait_for(queue.get(), timeout=RESULT_STREAM_KEEP_ALIVE)
+                    except asyncio.TimeoutError:
+                        break  # Send a keep-alive and read the pending counts again in case a message was lost
+
+                    if event['hash_md5'] not in remaining:
+                        continue  # Already sent as finished
+
+                    yield format_event(event)
+                    if event['pending'] <= 0:
+                        remaining.discard(event['hash_md5'])
+
+                if remaining:
+                    if await request.is_disconnected():
+                        break
+                    prediction_event_broker.ensure_listening()
+                    yield ': keep-alive\n\n'
+        finally:
+            prediction_event_broker.unsubscribe(queue, md5_hashes)
+
+    return StreamingResponse(event_stream(), media_type='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+
 @model_router.post("/search")
 def search_objects(
         current_user: User = Depends(current_user_investigator),
         page_id: int = -1,
         search_string: str = '',
         search_filter: dependency.SearchFilter = None,
+        cursor: Optional[str] = None,
+        include_count: bool = True
 ):
     """
     Returns a list of object hashes of objects submitted by a user. Pagination of object hashes as
     well as searching is provided by this method.
 
+    Instead of page_id, a cursor may be provided to page through results. Cursor pages are equally fast no matter how
+    far into the results they are. Pass an empty cursor for the first page, then pass the 'next_cursor' of each
+    response to get the following page. 'next_cursor' is null on the last page.
+
     :param current_user: User currently logged in
     :param page_id: Optional int for individual page of results (From 1...N)
     :param search_filter Optional filter to narrow results by models
-    :param search_string Optional string to narrow results by metadata field
+    :param search_string Optional string to narrow results by words in file names and model results
+    :param cursor Optional cursor for the page of results. If provided, page_id is ignored
+    :param include_count Optional, set to false to skip counting results when using a cursor
     :return: List of hashes user has submitted (by page) and number of total pages. If no page is provided,
              then only the number of pages available is returned.
     """
@@ -254,11 +308,25 @@ def search_objects(
     else:
         search_filter = search_filter.search_filter
 
+    page_size = dependency.PAGINATION_PAGE_SIZE
+
+    if cursor is not None:
+        if cursor and not decode_search_cursor(cursor):
+            return JSONResponse(status_code=400, content={'detail': 'Invalid cursor.', 'cursor': cursor})
+
+        db_result = get_objects_from_user_db(current_user.username, search_filter=search_filter,
+                                             search_string=search_string, cursor=cursor, include_count=include_count)
+        return {
+            'page_size': page_size,
+            'hashes': db_result['hashes'],
+            'next_cursor': db_result['next_cursor'],
+            **({'num_pages': db_result['num_pages'], 'num_objects': db_result['num_objects']} if include_count else {})
+        }
+
     db_result = get_objects_from_user_db(current_user.username, page_id, search_filter, search_string)
     num_pages = db_result['num_pages']
     hashes = db_result['hashes'] if 'hashes' in db_result else []
     num_objects = db_result['num_objects']
-    page_size = dependency.PAGINATION_PAGE_SIZE
 
     if page_id <= 0:
         return {
@@ -319,7 +387,8 @@ def download_search_object_hashes(
         current_user.username,
         search_filter=filter_to_use,
         search_string=search_string,
-        paginate=False
+        paginate=False,
+        include_count=False
     )
     hashes = db_result['hashes']
 
@@ -364,36 +433,141 @@ def get_available_prediction_models():
     """
     Generates a list of all models connected to the server.
     """
-    worker_data = [w.name.split(';') for w in Worker.all(redis)]
-    valid_workers = set(w[2] for w in worker_data if w[0] == 'prediction')
-    return list(valid_workers)
+    return list(model_registry.get_models())
 
-  
-@model_router.post("/tag/update")
-async def update_image_tags(md5_hashes: List[str], username: str, new_tags: List[str] = []):
+
+
+def get_models_by_type(model_type):
     """
-    Find list of images and add tags into its universalMLimage object "tags" field
+    Returns list of types for each available model
+    """
+    retModels = []
+    for name, model in model_registry.get_models().items():
+        if model_type in model['type']:
+            retModels.append(name)
 
-    :param md5_hashes: List of hashes for universal ml image object
-    :param username: username of the current user
-    :param new_tags: list of image tags that need to be added to image object
-    :return: json with status and detail
+    return retModels
+
+
+def spool_uploaded_object(upload_file: UploadFile, model_type: str):
     """
-    result = update_tags_to_image(md5_hashes, username, new_tags)
-    return result
+    Reads an uploaded object once in blocks to compute its md5 hash. For text objects, the text content is returned.
+    For all other objects, the data is written to the prediction volume as it is read and stored under the name
+    <hash_md5><extension>, which is returned.
 
+    :param upload_file: Uploaded object
+    :param model_type: Type of models that the object will be predicted on
+    :return: 2-tuple of md5 hash, input for the prediction models
+    """
+    file_obj = upload_file.file
+    md5 = hashlib.md5()
 
+    if model_type == 'text':
+        text_chunks = []
+        for data in iter(lambda: file_obj.read(UPLOAD_BUFFER_SIZE), b''):
+            md5.update(data)
+            text_chunks.append(data)
+        return md5.hexdigest(), b''.join(text_chunks).decode('UTF-8')
 
-def get_models_by_type(model_type):
+    # Write to a unique temporary name since the hash, and therefore the final name, is not known yet
+    temporary_path = PREDICTION_OBJECT_DIRECTORY + 'upload_' + str(uuid.uuid4())
+    with open(temporary_path, 'wb') as stored_object:
+        for data in iter(lambda: file_obj.read(UPLOAD_BUFFER_SIZE), b''):
+            md5.update(data)
+            stored_object.write(data)
+
+    hash_md5 = md5.hexdigest()
+    new_filename = hash_md5 + os.path.splitext(upload_file.filename)[1]
+    os.replace(temporary_path, PREDICTION_OBJECT_DIRECTORY + new_filename)
+    return hash_md5, new_filename
+
+
+def select_prediction_priority(priority: Optional[PredictionPriority], object_count: int,
+                               user: User) -> Optional[PredictionPriority]:
     """
-    Returns list of types for each available model
+    Chooses the scheduling lane of an upload. Uploads without a priority are interactive if they have at most
+    PREDICTION_INTERACTIVE_MAX_OBJECTS objects, and bulk otherwise. Larger uploads may only be interactive if the user
+    is an administrator.
+
+    :param priority: Priority requested by the user, or None
+    :param object_count: Number of objects uploaded
+    :param user: User who uploaded the objects
+    :return: PredictionPriority, or None if the user may not use the requested priority
     """
-    worker_data = [w.name.split(';') for w in Worker.all(redis)]
-    valid_workers = {w[2]: w[1] for w in worker_data if w[0] == 'prediction'}
+    small_upload = object_count <= dependency.PREDICTION_INTERACTIVE_MAX_OBJECTS
+    if priority is None:
+        return PredictionPriority.interactive if small_upload else PredictionPriority.bulk
 
-    retModels = []
-    for key, value in valid_workers.items():
-        if model_type in value:
-            retModels.append(key)
+    if priority == PredictionPriority.interactive and not small_upload and Roles.admin.name not in user.roles:
+        return None
+    return priority
+
+
+def prediction_queue_name(model: str, bulk_user: Optional[str] = None) -> str:
+    """
+    Returns the name of the queue of a model in the interactive lane, or of the bulk queue of a user.
+    """
+    if bulk_user:
+        return model + dependency.PREDICTION_BULK_QUEUE_INFIX + bulk_user
+    return model
+
+
+def enqueue_prediction_jobs(models: List[str], prediction_inputs: dict, frame_models: List[str] = (),
+                            bulk_user: Optional[str] = None):
+    """
+    Enqueues a prediction job for every object on every model using one Redis pipeline. The number of pending jobs
+    of each object is increased in the same pipeline, and is decreased by the workers when a job is finished.
 
-    return list(set(retModels))
+    If frame models are given, a frame extraction job is also enqueued for every object on the video frames model. It
+    enqueues the frames of the video on the frame models, and adds those jobs to the pending jobs of the video.
+
+    :param models: List of model names to run on the objects
+    :param prediction_inputs: Dictionary of {hash_md5: input for model predict()}
+    :param frame_models: List of image model names to run on the frames of video objects
+    :param bulk_user: Username whose bulk queues the jobs are enqueued on, or None to enqueue interactive jobs
+    """
+    with redis.pipeline() as pipe:
+        if bulk_user:
+            # Workers listen on the bulk queues of the users in these sets. The frame extraction job adds the user to
+            # the sets of the frame models.
+            for model in list(models) + ([dependency.VIDEO_FRAMES_MODEL] if frame_models else []):
+                pipe.sadd(dependency.PREDICTION_BULK_USERS_KEY_PREFIX + model, bulk_user)
+
+        for model in models:
+            job_data = [
+                Queue.prepare_data(
+                    'utility.main.predict_object', (hash_md5, prediction_input),
+                    job_id=hash_md5 + model + str(uuid.uuid4()),
+                    on_success=Callback(dependency.PREDICTION_JOB_CALLBACK),
+                    on_failure=Callback(dependency.PREDICTION_JOB_CALLBACK)
+                )
+                for hash_md5, prediction_input in prediction_inputs.items()
+            ]
+            Queue(name=prediction_queue_name(model, bulk_user), connection=redis).enqueue_many(job_data, pipeline=pipe)
+
+        if frame_models:
+            job_data = [
+                Queue.prepare_data(
+                    'utility.fanout.extract_video_frames', (hash_md5, prediction_input, list(frame_models)),
+                    job_id=hash_md5 + dependency.VIDEO_FRAMES_MODEL + str(uuid.uuid4()),
+                    timeout=dependency.VIDEO_FRAMES_JOB_TIMEOUT,
+                    on_success=Callback(dependency.PREDICTION_JOB_CALLBACK),
+                    on_failure=Callback(dependency.PREDICTION_JOB_CALLBACK)
+                )
+                for hash_md5, prediction_input in prediction_inputs.items()
+            ]
+            Queue(name=prediction_queue_name(dependency.VIDEO_FRAMES_MODEL, bulk_user),
+                  connection=redis).enqueue_many(job_data, pipeline=pipe)
+
+        for hash_md5 in prediction_inputs:
+            pending_key = dependency.PREDICTION_PENDING_KEY_PREFIX + hash_md5
+            pipe.incrby(pending_key, len(models) + (1 if frame_models else 0))
+            pipe.expire(pending_key, dependency.PREDICTION_PENDING_KEY_TTL)
+        pipe.execute()
+
+
+def format_event(event: dict) -> str:
+    """
+    Formats a prediction event as a server-sent event message.
+    """
+    return 'event: prediction\ndata: ' + json.dumps(event) + '\n\n'
@@ -0,0 +1,141 @@
+from bson import ObjectId
+from pymongo import ASCENDING
+
+from dependency import object_collection, user_collection, frame_result_collection, UniversalMLPredictionObject, \
+    PAGINATION_PAGE_SIZE
+import db_connection
+from db_connection import create_indexes_db, get_user_by_name_db, get_object_by_md5_hash_db, add_user_db, \
+    upsert_object_db, update_tags_to_object, create_search_tokens, create_search_token_query, get_objects_from_user_db, \
+    migrate_search_tokens_db, SEARCH_TOKEN_VERSION
+
+
+def test_create_indexes_idempotent():
+    create_indexes_db()
+    create_indexes_db()  # Second call must not fail or create duplicate indexes
+
+    object_indexes = [index['key'] for index in object_collection.list_indexes()]
+    user_indexes = [index['key'] for index in user_collection.list_indexes()]
+    assert {'hash_md5': 1} in object_indexes
+    assert {'username': 1} in user_indexes
+
+
+def test_cursor_pages_of_users_are_read_from_compound_index():
+    create_indexes_db()
+    assert {'users': 1, '_id': 1} in [index['key'] for index in object_collection.list_indexes()]
+
+    plan = object_collection.find({'users': 'testing', '_id': {'$gt': ObjectId('0' * 24)}}) \
+        .sort('_id', ASCENDING).limit(PAGINATION_PAGE_SIZE + 1) \
+        .hint([('users', ASCENDING), ('_id', ASCENDING)]).explain()
+    winning_plan = str(plan['queryPlanner']['winningPlan'])
+    assert "'stage': 'SORT'" not in winning_plan  # Objects are read in _id order from the index, not sorted in memory
+    assert "'stage': 'IXSCAN'" in winning_plan
+
+
+def test_missing_documents_return_none():
+    assert get_user_by_name_db('user_that_does_not_exist') is None
+    assert get_object_by_md5_hash_db('hash_that_does_not_exist') is None
+
+
+def test_add_existing_user_fails():
+    assert not add_user_db(get_user_by_name_db('testing'))
+
+
+def test_upsert_object_adds_users_and_file_names():
+    obj = UniversalMLPredictionObject(hash_md5='upsert_test_hash', type='image', file_names=['a.jpg'],
+                                      users=['testing'], user_role_able_to_tag=['admin'])
+    try:
+        upsert_object_db(obj, 'testing', 'a.jpg')
+        upsert_object_db(obj, 'other_user', 'b.jpg')
+        upsert_object_db(obj, 'testing', 'a.jpg')
+
+        stored = get_object_by_md5_hash_db('upsert_test_hash')
+        assert stored.users == ['testing', 'other_user']
+        assert stored.file_names == ['a.jpg', 'b.jpg']
+    finally:
+        object_collection.delete_many({'hash_md5': 'upsert_test_hash'})
+
+
+def test_video_timeline_is_read_from_frame_results_in_timestamp_order():
+    obj = UniversalMLPredictionObject(hash_md5='timeline_test_hash', type='video', user_role_able_to_tag=['admin'])
+    try:
+        create_indexes_db()
+        upsert_object_db(obj, 'testing', 'a.mp4')
+        frame_result_collection.insert_many([
+            {'video_hash': 'timeline_test_hash', 'model_name': 'model', 'timestamp': timestamp,
+             'hash_md5': 'frame_' + str(timestamp), 'result': {'value': timestamp}}
+            for timestamp in [2.0, 0.0, 1.0]
+        ])
+
+        timeline = get_object_by_md5_hash_db('timeline_test_hash').timeline
+        assert [frame['timestamp'] for frame in timeline['model']] == [0.0, 1.0, 2.0]
+        assert timeline['model'][0] == {'timestamp': 0.0, 'hash_md5': 'frame_0.0', 'result': {'value': 0.0}}
+    finally:
+        object_collection.delete_many({'hash_md5': 'timeline_test_hash'})
+        frame_result_collection.delete_many({'video_hash': 'timeline_test_hash'})
+
+
+def test_update_tags_adds_and_removes():
+    obj = UniversalMLPredictionObject(hash_md5='tag_test_hash', type='image', user_role_able_to_tag=['admin'])
+    try:
+        upsert_object_db(obj, 'testing', 'a.jpg')
+
+        result = update_tags_to_object(['tag_test_hash', 'missing_hash'], 'testing', [], ['foo', 'bar'])
+        assert result[0]['status'] == 'success'
+        assert result[1]['status'] == 'failure'
+
+        update_tags_to_object(['tag_test_hash'], 'testing', ['bar'], [])
+        assert get_object_by_md5_hash_db('tag_test_hash').tags == ['foo']
+    finally:
+        object_collection.delete_many({'hash_md5': 'tag_test_hash'})
+
+
+def test_create_search_tokens():
+    tokens = create_search_tokens('Beach_Photo.JPG', {'environment_type': 'Outdoor', 'scores': [0.75, None]})
+    assert tokens == sorted(['beach', 'photo', 'jpg', 'environment', 'type', 'outdoor', 'scores', '0', '75'])
+
+
+def test_search_token_query_splits_on_regex_metacharacters():
+    # Metacharacters are never part of a token, so they can not change the meaning of the regular expressions
+    assert create_search_token_query('out.door (a+b)* [c] ^d$|e\\') == [
+        {'search_tokens': {'$regex': '^' + token}} for token in ['a', 'b', 'c', 'd', 'door', 'e', 'out']
+    ]
+
+
+def test_migrate_search_tokens_updates_objects_of_older_versions(monkeypatch):
+    monkeypatch.setattr(db_connection, 'SEARCH_TOKEN_MIGRATION_BATCH_SIZE', 1)  # Read every object in its own batch
+    object_collection.insert_many([
+        {'hash_md5': 'migrate_test_old', 'type': 'image', 'file_names': ['Old.jpg'], 'models': {},
+         'search_tokens': ['kept']},
+        {'hash_md5': 'migrate_test_current', 'type': 'image', 'file_names': ['Current.jpg'], 'models': {},
+         'search_tokens': [], 'search_tokens_version': SEARCH_TOKEN_VERSION},
+    ])
+    try:
+        migrate_search_tokens_db()
+
+        old = object_collection.find_one({'hash_md5': 'migrate_test_old'})
+        assert sorted(old['search_tokens']) == ['jpg', 'kept', 'old']
+        assert old['search_tokens_version'] == SEARCH_TOKEN_VERSION
+        assert object_collection.find_one({'hash_md5': 'migrate_test_current'})['search_tokens'] == []
+    finally:
+        object_collection.delete_many({'hash_md5': {'$in': ['migrate_test_old', 'migrate_test_current']}})
+
+
+def test_search_with_cursor_returns_every_object_once():
+    hashes = ['cursor_test_hash_' + str(i) for i in range(PAGINATION_PAGE_SIZE * 2 + 3)]
+    try:
+        for hash_md5 in hashes:
+            obj = UniversalMLPredictionObject(hash_md5=hash_md5, type='image')
+            upsert_object_db(obj, 'testing', 'cursortest_' + hash_md5 + '.jpg')
+
+        found = []
+        cursor = ''
+        while cursor is not None:
+            result = get_objects_from_user_db('testing', search_string='CursorTest', cursor=cursor)
+            assert result['num_objects'] == len(hashes)
+            assert len(result['hashes']) <= PAGINATION_PAGE_SIZE
+            found += result['hashes']
+            cursor = result['next_cursor']
+
+        assert found == hashes
+    finally:
+        object_collection.delete_many({'hash_md5': {'$in': hashes}})
@@ -0,0 +1,36 @@
+import numpy as np
+from PIL import Image
+
+from image_cache import image_cache_path, write_image_cache
+
+
+def test_write_image_cache_stores_full_and_reduced_rasters(tmp_path):
+    object_path = str(tmp_path / 'abc123.png')
+    Image.new('RGBA', (1200, 600), (10, 20, 30, 255)).save(object_path)
+
+    assert write_image_cache(object_path)
+
+    full = np.load(image_cache_path(object_path), mmap_mode='r')
+    assert full.shape == (600, 1200, 3)
+    assert full[0, 0].tolist() == [10, 20, 30]
+
+    assert np.load(image_cache_path(object_path, 1024)).shape == (512, 1024, 3)
+    assert np.load(image_cache_path(object_path, 512)).shape == (256, 512, 3)
+
+
+def test_write_image_cache_skips_reduced_rasters_of_small_images(tmp_path):
+    object_path = str(tmp_path / 'small.jpg')
+    Image.new('RGB', (300, 200)).save(object_path)
+
+    assert write_image_cache(object_path)
+    assert (tmp_path / 'small.rgb.npy').exists()
+    assert not (tmp_path / 'small.rgb_512.npy').exists()
+
+
+def test_write_image_cache_ignores_objects_that_are_not_images(tmp_path):
+    object_path = str(tmp_path / 'notes.txt')
+    with open(object_path, 'w') as text_file:
+        text_file.write('not an image')
+
+    assert not write_image_cache(object_path)
+    assert not (tmp_path / 'notes.rgb.npy').exists()
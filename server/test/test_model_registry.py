@@ -0,0 +1,78 @@
+from model_registry import ModelRegistry
+
+
+class FakePipeline:
+    def __init__(self, existing_keys):
+        self.existing_keys = existing_keys
+        self.results = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def exists(self, key):
+        self.results.append(int(key in self.existing_keys))
+
+    def execute(self):
+        return self.results
+
+
+class FakeRedis:
+    """
+    Minimal stand-in for the worker keys that rq stores in Redis.
+    """
+
+    def __init__(self, registered_keys, existing_keys):
+        self.registered_keys = registered_keys
+        self.existing_keys = existing_keys
+        self.reads = 0
+
+    def smembers(self, key):
+        self.reads += 1
+        return {k.encode() for k in self.registered_keys}
+
+    def pipeline(self):
+        return FakePipeline(self.existing_keys)
+
+
+def test_registry_reads_live_prediction_workers():
+    keys = [
+        'rq:worker:prediction;image;image_hash;essential,fast;1',
+        'rq:worker:prediction;text;ner_text;huggingface;2',
+        'rq:worker:prediction;image;stopped_model;fast;3',
+        'rq:worker:training;mnist;4',
+    ]
+    connection = FakeRedis(keys, existing_keys=[keys[0], keys[1], keys[3]])
+    registry = ModelRegistry(connection, ttl=60)
+
+    assert registry.get_models() == {
+        'image_hash': {'type': 'image', 'tags': 'essential,fast'},
+        'ner_text': {'type': 'text', 'tags': 'huggingface'},
+    }
+
+
+def test_registry_reads_every_model_of_multi_model_workers():
+    keys = ['rq:worker:prediction;image;image_shape;fast;image;image_hash;essential,fast;text;simple_text;;1']
+    connection = FakeRedis(keys, existing_keys=keys)
+    registry = ModelRegistry(connection, ttl=60)
+
+    assert registry.get_models() == {
+        'image_shape': {'type': 'image', 'tags': 'fast'},
+        'image_hash': {'type': 'image', 'tags': 'essential,fast'},
+        'simple_text': {'type': 'text', 'tags': ''},
+    }
+
+
+def test_registry_caches_until_invalidated():
+    connection = FakeRedis([], existing_keys=[])
+    registry = ModelRegistry(connection, ttl=60)
+
+    registry.get_models()
+    registry.get_models()
+    assert connection.reads == 1
+
+    registry.invalidate()
+    registry.get_models()
+    assert connection.reads == 2
@@ -6,6 +6,8 @@ from fastapi import Depends
 from db_connection import get_user_by_name_db
 
 from main import app
+from dependency import User, PredictionPriority, PREDICTION_INTERACTIVE_MAX_OBJECTS
+from routers.prediction import select_prediction_priority, prediction_queue_name
 
 client = TestClient(app)
 
@@ -14,6 +16,28 @@ client = TestClient(app)
 # --------------
 
 
+def test_small_uploads_default_to_interactive_priority():
+    user = User(username='investigator', password='', roles=['investigator'])
+    assert select_prediction_priority(None, 1, user) == PredictionPriority.interactive
+    assert select_prediction_priority(None, PREDICTION_INTERACTIVE_MAX_OBJECTS + 1, user) == PredictionPriority.bulk
+
+
+def test_only_admins_may_upload_large_interactive_requests():
+    investigator = User(username='investigator', password='', roles=['investigator'])
+    admin = User(username='admin', password='', roles=['admin'])
+    large_upload = PREDICTION_INTERACTIVE_MAX_OBJECTS + 1
+
+    assert select_prediction_priority(PredictionPriority.interactive, large_upload, investigator) is None
+    assert select_prediction_priority(PredictionPriority.interactive, large_upload, admin) == \
+        PredictionPriority.interactive
+    assert select_prediction_priority(PredictionPriority.bulk, 1, investigator) == PredictionPriority.bulk
+
+
+def test_bulk_jobs_are_enqueued_on_queues_of_each_user():
+    assert prediction_queue_name('image_hash') == 'image_hash'
+    assert prediction_queue_name('image_hash', 'investigator') == 'image_hash:bulk:investigator'
+
+
 # ---------
 # Image Tagging test
 # ----------
@@ -0,0 +1,92 @@
+import os
+import sys
+
+import pytest
+from rq import Queue
+from rq.registry import FailedJobRegistry, StartedJobRegistry
+
+from dependency import redis
+
+# The prediction worker is not a package of the server, so its utility package is imported from its directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'prediction_worker'))
+from utility.scheduling import LaneWorker, PREDICTION_BULK_QUEUE_INFIX, PREDICTION_BULK_USERS_KEY_PREFIX  # noqa: E402
+
+MODELS = ['scheduling_test_a', 'scheduling_test_b']
+USERS = ['alice', 'bob']
+
+
+@pytest.fixture
+def queues():
+    queue_names = MODELS + [model + PREDICTION_BULK_QUEUE_INFIX + user for model in MODELS for user in USERS]
+    yield {queue_name: Queue(queue_name, connection=redis) for queue_name in queue_names}
+
+    for queue_name in queue_names:
+        queue = Queue(queue_name, connection=redis)
+        queue.empty()
+        redis.delete(queue.registry_cleaning_key, StartedJobRegistry(queue=queue).key, FailedJobRegistry(queue=queue).key)
+    redis.delete(*[PREDICTION_BULK_USERS_KEY_PREFIX + model for model in MODELS])
+
+
+def enqueue(queue, count):
+    for _ in range(count):
+        queue.enqueue('os.getpid')
+
+
+def dequeue_order(worker):
+    """
+    Takes every job from the queues of a worker without performing them, and returns the queue of each job in order.
+    """
+    order = []
+    while True:
+        result = worker.dequeue_job_and_maintain_ttl(None)  # No timeout returns None once every queue is empty
+        if result is None:
+            return order
+        order.append(result[1].name)
+
+
+def test_interactive_jobs_are_taken_before_bulk_jobs(queues):
+    redis.sadd(PREDICTION_BULK_USERS_KEY_PREFIX + MODELS[0], 'alice')
+    enqueue(queues['scheduling_test_a:bulk:alice'], 2)
+    enqueue(queues['scheduling_test_a'], 2)
+
+    worker = LaneWorker([Queue(MODELS[0], connection=redis)], connection=redis)
+    assert dequeue_order(worker) == ['scheduling_test_a'] * 2 + ['scheduling_test_a:bulk:alice'] * 2
+
+
+def test_bulk_jobs_are_taken_from_each_user_and_model_in_turn(queues):
+    for model in MODELS:
+        redis.sadd(PREDICTION_BULK_USERS_KEY_PREFIX + model, *USERS)
+    enqueue(queues['scheduling_test_a:bulk:alice'], 3)
+    enqueue(queues['scheduling_test_b:bulk:alice'], 3)
+    enqueue(queues['scheduling_test_a:bulk:bob'], 1)
+    enqueue(queues['scheduling_test_b:bulk:bob'], 1)
+
+    worker = LaneWorker([Queue(model, connection=redis) for model in MODELS], connection=redis)
+    assert dequeue_order(worker) == [
+        'scheduling_test_a:bulk:alice', 'scheduling_test_b:bulk:alice',
+        'scheduling_test_a:bulk:bob', 'scheduling_test_b:bulk:bob',
+        'scheduling_test_a:bulk:alice', 'scheduling_test_b:bulk:alice',
+        'scheduling_test_a:bulk:alice', 'scheduling_test_b:bulk:alice',
+    ]
+
+
+def test_interactive_jobs_are_taken_from_each_model_in_turn(queues):
+    enqueue(queues['scheduling_test_a'], 2)
+    enqueue(queues['scheduling_test_b'], 2)
+
+    worker = LaneWorker([Queue(model, connection=redis) for model in MODELS], connection=redis)
+    assert dequeue_order(worker) == ['scheduling_test_a', 'scheduling_test_b'] * 2
+
+
+def test_abandoned_bulk_jobs_are_moved_to_failed(queues):
+    redis.sadd(PREDICTION_BULK_USERS_KEY_PREFIX + MODELS[0], 'alice')
+    queue = queues['scheduling_test_a:bulk:alice']
+    job = queue.enqueue('os.getpid')
+    started_registry = StartedJobRegistry(queue=queue)
+    redis.zadd(started_registry.key, {job.id: 1})  # Started by a worker that stopped long ago
+
+    worker = LaneWorker([Queue(MODELS[0], connection=redis)], connection=redis)
+    worker.clean_registries()
+
+    assert job.id not in started_registry
+    assert job.id in FailedJobRegistry(queue=queue)